@@ -1,13 +1,37 @@
 """This script executes the detection of chessboards."""
 
 
+import argparse
+import contextlib
+
 from lc2fen.board2data import regenerate_data_folder, process_input_boards
+from lc2fen.detectboard import debug
+
+
+def parse_arguments() -> bool:
+    """Parse the script arguments.
+
+    :return: Whether to save the debug images.
+    """
+    parser = argparse.ArgumentParser(
+        description="Detects all the chessboards in the data folder."
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        help="Save the images of each step of the board detection in "
+        + debug.DEBUG_SAVE_DIR,
+        action="store_true",
+    )
+    return parser.parse_args().debug
 
 
 def main():
     """Detect all the chessboards in the "data" folder."""
+    debugging = parse_arguments()
     regenerate_data_folder("data")
-    process_input_boards("data")
+    with debug.debugging() if debugging else contextlib.nullcontext():
+        process_input_boards("data")
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 
 
 import argparse
+import contextlib
 
 # `sklearn` is required for Jetson (to avoid "cannot allocate memory in
 # static TLS block" error)
@@ -11,6 +12,7 @@ from keras.applications.imagenet_utils import (
 )
 from keras.applications.mobilenet_v2 import preprocess_input as prein_mobilenet
 
+from lc2fen.detectboard import debug
 from lc2fen.predict_board import (
     predict_board_keras,
     predict_board_onnx,
@@ -33,14 +35,24 @@ MODEL_PATH_TRT = "data/models/MobileNetV2_0p5_all.trt"
 IMG_SIZE_TRT = 224
 PRE_INPUT_TRT = prein_mobilenet
 
+DEBUG = False  # Whether to save the debug images of the board detection
+MAX_BOARDS = 1  # Max. number of boards detected in a single image
+MIN_LAYERS = 1  # Min. number of layers of the board detection
+MAX_LAYERS = 3  # Max. number of layers of the board detection
+# Normalized side of the image of each layer of the board detection
+# (`None` for the default of the detection)
+LAYER_HEIGHTS = None
 
-def parse_arguments() -> tuple[str, str, str | None]:
+
+def parse_arguments() -> tuple[str, str, str | None, str | None, str | None]:
     """Parse the script arguments and set the corresponding flags.
 
-    :return: Path of the image or folder, location of the a1 square, and
-    FEN string of the previous board position.
+    :return: Path of the image or folder, location of the a1 square,
+    FEN string of the previous board position, path of the board-corner
+    cache file, and path of the PGN file.
     """
     global ACTIVATE_KERAS, ACTIVATE_ONNX, ACTIVATE_TRT
+    global DEBUG, MAX_BOARDS, MIN_LAYERS, MAX_LAYERS, LAYER_HEIGHTS
 
     parser = argparse.ArgumentParser(
         description="Predicts board configuration(s) (FEN string(s)) from "
@@ -65,6 +77,60 @@ def parse_arguments() -> tuple[str, str, str | None]:
         "the previous board position is known)",
     )
 
+    parser.add_argument(
+        "-c",
+        "--corner-cache",
+        help="Path to a file in which to cache the board corners found in "
+        "the folder, so that they are reused after a restart (if you are "
+        "predicting the FENs for a folder)",
+    )
+    parser.add_argument(
+        "-p",
+        "--pgn",
+        help="Path to a PGN file to which to append the games detected in "
+        "the folder (if you are predicting the FENs for a folder)",
+    )
+    parser.add_argument(
+        "-b",
+        "--boards",
+        type=int,
+        default=1,
+        help="Maximum number of boards to detect in the image, whose FENs "
+        "are printed one per line (if you are predicting the FEN for a "
+        "single image)",
+    )
+    parser.add_argument(
+        "--min-layers",
+        type=int,
+        default=MIN_LAYERS,
+        help="Minimum number of layers of the board detection",
+    )
+    parser.add_argument(
+        "--max-layers",
+        type=int,
+        default=MAX_LAYERS,
+        help="Maximum number of layers of the board detection, which "
+        "stops earlier once a layer finds the board precisely enough",
+    )
+    parser.add_argument(
+        "-l",
+        "--layer-heights",
+        type=int,
+        nargs="+",
+        metavar="HEIGHT",
+        help="Normalized side (in pixels) of the image searched in each "
+        "layer of the board detection, the last one being used for the "
+        "remaining layers (e.g., `250 500` finds the board at 250x250 "
+        "pixels and refines it at 500x500 pixels)",
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        help="Save the images of each step of the board detection in "
+        + debug.DEBUG_SAVE_DIR,
+        action="store_true",
+    )
+
     inf_engine = parser.add_mutually_exclusive_group(required=True)
     inf_engine.add_argument(
         "-k", "--keras", help="run inference using Keras", action="store_true"
@@ -89,45 +155,81 @@ def parse_arguments() -> tuple[str, str, str | None]:
         ACTIVATE_TRT = True
     else:
         ValueError("No inference engine selected. This should be unreachable.")
-
-    return args.path, args.a1_pos, args.previous_fen
+    DEBUG = args.debug
+    MAX_BOARDS = args.boards
+    MIN_LAYERS = args.min_layers
+    MAX_LAYERS = args.max_layers
+    if args.layer_heights is not None:
+        LAYER_HEIGHTS = tuple(args.layer_heights)
+
+    return (
+        args.path,
+        args.a1_pos,
+        args.previous_fen,
+        args.corner_cache,
+        args.pgn,
+    )
 
 
 def main():
-    """Parse the arguments and print the predicted FEN."""
-    path, a1_pos, previous_fen = parse_arguments()
-    if ACTIVATE_KERAS:
-        fen, _ = predict_board_keras(
-            MODEL_PATH_KERAS,
-            IMG_SIZE_KERAS,
-            PRE_INPUT_KERAS,
-            path,
-            a1_pos,
-            previous_fen=previous_fen,
-        )
-    elif ACTIVATE_ONNX:
-        fen, _ = predict_board_onnx(
-            MODEL_PATH_ONNX,
-            IMG_SIZE_ONNX,
-            PRE_INPUT_ONNX,
-            path,
-            a1_pos,
-            previous_fen=previous_fen,
-        )
-    elif ACTIVATE_TRT:
-        fen, _ = predict_board_trt(
-            MODEL_PATH_TRT,
-            IMG_SIZE_TRT,
-            PRE_INPUT_TRT,
-            path,
-            a1_pos,
-            previous_fen=previous_fen,
-        )
-    else:
-        fen = None
-        ValueError("No inference engine selected. This should be unreachable.")
-
-    print(fen)
+    """Parse the arguments and print the predicted FEN(s)."""
+    path, a1_pos, previous_fen, corner_cache, pgn_path = parse_arguments()
+    with debug.debugging() if DEBUG else contextlib.nullcontext():
+        if ACTIVATE_KERAS:
+            predictions = predict_board_keras(
+                MODEL_PATH_KERAS,
+                IMG_SIZE_KERAS,
+                PRE_INPUT_KERAS,
+                path,
+                a1_pos,
+                previous_fen=previous_fen,
+                corner_cache=corner_cache,
+                pgn_path=pgn_path,
+                max_boards=MAX_BOARDS,
+                min_layers=MIN_LAYERS,
+                max_layers=MAX_LAYERS,
+                layer_heights=LAYER_HEIGHTS,
+            )
+        elif ACTIVATE_ONNX:
+            predictions = predict_board_onnx(
+                MODEL_PATH_ONNX,
+                IMG_SIZE_ONNX,
+                PRE_INPUT_ONNX,
+                path,
+                a1_pos,
+                previous_fen=previous_fen,
+                corner_cache=corner_cache,
+                pgn_path=pgn_path,
+                max_boards=MAX_BOARDS,
+                min_layers=MIN_LAYERS,
+                max_layers=MAX_LAYERS,
+                layer_heights=LAYER_HEIGHTS,
+            )
+        elif ACTIVATE_TRT:
+            predictions = predict_board_trt(
+                MODEL_PATH_TRT,
+                IMG_SIZE_TRT,
+                PRE_INPUT_TRT,
+                path,
+                a1_pos,
+                previous_fen=previous_fen,
+                corner_cache=corner_cache,
+                pgn_path=pgn_path,
+                max_boards=MAX_BOARDS,
+                min_layers=MIN_LAYERS,
+                max_layers=MAX_LAYERS,
+                layer_heights=LAYER_HEIGHTS,
+            )
+        else:
+            predictions = None, None
+            ValueError(
+                "No inference engine selected. This should be unreachable."
+            )
+
+    if MAX_BOARDS <= 1:
+        predictions = [predictions]
+    for fen, _ in predictions:
+        print(fen)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""This module is responsible for persisting the board corners.
+
+Specifically, it saves the board corners found for each camera (or,
+in general, for each image source) in a local JSON cache file, so that
+the board detection can start from them after a restart instead of
+running the full detection on the first image.
+
+Together with the corners, a small grayscale fingerprint of the board
+area is saved. The cached corners are discarded when the board area of
+the new image does not resemble the fingerprint at all, e.g., because
+the source now points to a different scene. Otherwise, they are
+validated by the detection itself (see `detect()`).
+"""
+
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+from lc2fen.detectboard.image_object import (
+    image_read,
+    quad_side,
+    reduction_factor,
+)
+
+
+FINGERPRINT_SIZE = 16  # Side of the board fingerprints
+
+# Min. correlation between the board area of an image and the
+# fingerprint for the cached corners to be used
+MIN_FINGERPRINT_CORRELATION = 0.5
+
+
+def board_fingerprint(
+    board_path: str, board_corners: list[list[int]]
+) -> np.ndarray:
+    """Compute the fingerprint of the board area of an image.
+
+    :param board_path: Path to the chessboard image.
+
+    :param board_corners: Length-4 list of coordinates of four corners.
+
+    :return: `FINGERPRINT_SIZE`x`FINGERPRINT_SIZE` grayscale image of
+    the board area.
+    """
+    # We decode the image only as finely as the fingerprint needs
+    factor = reduction_factor(quad_side(board_corners), 4 * FINGERPRINT_SIZE)
+    img = cv2.cvtColor(image_read(board_path, factor), cv2.COLOR_BGR2GRAY)
+    corners = np.float32(board_corners) / factor
+    side = FINGERPRINT_SIZE
+    transform = cv2.getPerspectiveTransform(
+        corners, np.float32([[0, 0], [side, 0], [side, side], [0, side]])
+    )
+    return cv2.warpPerspective(
+        img, transform, (side, side), flags=cv2.INTER_AREA
+    )
+
+
+def __correlation(fingerprint1: np.ndarray, fingerprint2: np.ndarray):
+    """Return the normalized correlation of two fingerprints."""
+    fingerprint1 = np.float64(fingerprint1) - np.mean(fingerprint1)
+    fingerprint2 = np.float64(fingerprint2) - np.mean(fingerprint2)
+    norm = np.linalg.norm(fingerprint1) * np.linalg.norm(fingerprint2)
+    if norm == 0:
+        return 0
+    return np.sum(fingerprint1 * fingerprint2) / norm
+
+
+def __read_cache(cache_file: str) -> dict:
+    """Read the cache file.
+
+    The cache is empty if the file does not exist or is corrupt (in
+    which case it is overwritten by the next `save_corners()`).
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, "r") as cache_fd:
+        try:
+            cache = json.load(cache_fd)
+        except ValueError:  # The file is not valid JSON
+            return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def load_corners(
+    cache_file: str, source_id: str, board_path: str
+) -> list[list[int]] | None:
+    """Load the cached board corners of an image source.
+
+    :param cache_file: Path to the cache file.
+
+    :param source_id: Identifier of the camera or image source.
+
+    :param board_path: Path to a new chessboard image of the source.
+
+    :return: Length-4 list of coordinates of the four board corners or
+    `None` if there are no cached corners for the source or the board
+    area of the new image does not resemble their fingerprint.
+    """
+    entry = __read_cache(cache_file).get(source_id)
+    if entry is None:
+        return None
+
+    board_corners = entry["board_corners"]
+    fingerprint = board_fingerprint(board_path, board_corners)
+    if (
+        __correlation(fingerprint, np.uint8(entry["fingerprint"]))
+        < MIN_FINGERPRINT_CORRELATION
+    ):
+        return None
+    return board_corners
+
+
+def save_corners(
+    cache_file: str,
+    source_id: str,
+    board_path: str,
+    board_corners: list[list[int]],
+):
+    """Save the board corners of an image source in the cache file.
+
+    :param cache_file: Path to the cache file.
+
+    :param source_id: Identifier of the camera or image source.
+
+    :param board_path: Path to the chessboard image in which the corners
+    were found.
+
+    :param board_corners: Length-4 list of coordinates of four corners.
+    """
+    board_corners = np.int32(board_corners).tolist()
+    cache = __read_cache(cache_file)
+    cache[source_id] = {
+        "board_corners": board_corners,
+        "fingerprint": board_fingerprint(board_path, board_corners).tolist(),
+    }
+
+    # We replace the file at once so that it is never left half written
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "w") as cache_fd:
+        json.dump(cache, cache_fd)
+    os.replace(tmp_file, cache_file)
@@ -1,15 +1,13 @@
 """This is the chessboard-position-search (CPS) module."""
 
 
-import collections
 import itertools
 import math
 
 import cv2
-import matplotlib.path
 import numpy as np
 import pyclipper
-from scipy.spatial import ConvexHull
+from scipy.spatial import ConvexHull, cKDTree
 from sklearn.cluster import DBSCAN
 
 from lc2fen.detectboard import debug
@@ -72,6 +70,8 @@ def __remove_duplicates(input_list: list) -> list:
 
 def __sort_points(pts: list[list]) -> list[list]:
     """Sort points clockwise."""
+    if not pts:
+        return pts
     mlat = sum(x[0] for x in pts) / len(pts)
     mlng = sum(x[1] for x in pts) / len(pts)
 
@@ -104,88 +104,439 @@ def __ptl_distance(line: list[list], point: list, dx):
     )
 
 
-def __intersection(line1: list[list], line2: list[list]):
-    """Return the intersection of `line1` and `line2`.
+def __intersections(lines1: list[list], lines2: list[list]) -> np.ndarray:
+    """Return the pairwise intersections of two lists of lines.
 
-    If they don't intersect, the function returns (-1, -1).
+    Element `[i, j]` of the returned array is the intersection of
+    `lines1[i]` and `lines2[j]`. If they don't intersect, the element is
+    (-1, -1).
     """
-    xdiff = (line1[0][0] - line1[1][0], line2[0][0] - line2[1][0])
-    ydiff = (line1[0][1] - line1[1][1], line2[0][1] - line2[1][1])
+    l1 = np.array(lines1, dtype=np.int64).reshape(-1, 1, 2, 2)
+    l2 = np.array(lines2, dtype=np.int64).reshape(1, -1, 2, 2)
+    xdiff = (l1[..., 0, 0] - l1[..., 1, 0], l2[..., 0, 0] - l2[..., 1, 0])
+    ydiff = (l1[..., 0, 1] - l1[..., 1, 1], l2[..., 0, 1] - l2[..., 1, 1])
 
     def det(a, b):
         return a[0] * b[1] - a[1] * b[0]
 
     div = det(xdiff, ydiff)
-    if div == 0:
-        return -1, -1
+    d = (
+        l1[..., 0, 0] * l1[..., 1, 1] - l1[..., 0, 1] * l1[..., 1, 0],
+        l2[..., 0, 0] * l2[..., 1, 1] - l2[..., 0, 1] * l2[..., 1, 0],
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = det(d, xdiff) / div
+        y = det(d, ydiff) / div
+    x[div == 0] = -1
+    y[div == 0] = -1
+    return np.stack((x, y), axis=-1)
+
+
+def __candidate_frames(
+    vertical: list[list], horizontal: list[list], shape: list
+) -> np.ndarray:
+    """Return every convex frame formed by two pairs of lines.
+
+    This function is the vectorized equivalent of intersecting each
+    pair of `vertical` lines with each pair of `horizontal` lines,
+    keeping the combinations with exactly four intersections inside the
+    image, sorting their points with `__sort_points()`, and discarding
+    the non-convex ones (see `cv2.isContourConvex()`).
+
+    :param vertical: Candidate lines of the first orientation.
+
+    :param horizontal: Candidate lines of the second orientation.
+
+    :param shape: Shape of the image.
+
+    :return: Array of shape (N, 4, 2) with the integer corners of the N
+    frames, in the same order as the nested loops over
+    `itertools.combinations()`.
+    """
+    v_pairs = np.array(list(itertools.combinations(range(len(vertical)), 2)))
+    h_pairs = np.array(list(itertools.combinations(range(len(horizontal)), 2)))
+    if len(v_pairs) == 0 or len(h_pairs) == 0:
+        return np.zeros((0, 4, 2), dtype=np.int64)
+
+    vv = __intersections(vertical, vertical)[v_pairs[:, 0], v_pairs[:, 1]]
+    hh = __intersections(horizontal, horizontal)[h_pairs[:, 0], h_pairs[:, 1]]
+    vh = __intersections(vertical, horizontal)
+
+    # Process the frames in chunks of v pairs to bound the memory used
+    chunk = max(1, 2**16 // len(h_pairs))
+    frames = []
+    for start in range(0, len(v_pairs), chunk):
+        v0 = v_pairs[start : start + chunk, 0, np.newaxis]
+        v1 = v_pairs[start : start + chunk, 1, np.newaxis]
+        h0 = h_pairs[np.newaxis, :, 0]
+        h1 = h_pairs[np.newaxis, :, 1]
+        poly = np.stack(
+            np.broadcast_arrays(
+                vv[start : start + chunk, np.newaxis],
+                vh[v0, h0],
+                vh[v0, h1],
+                vh[v1, h0],
+                vh[v1, h1],
+                hh[np.newaxis],
+            ),
+            axis=2,
+        ).reshape(-1, 6, 2)
+
+        # Keep the frames with exactly four points inside the image
+        inside = (
+            (poly[..., 0] >= 0)
+            & (poly[..., 0] <= shape[1])
+            & (poly[..., 1] >= 0)
+            & (poly[..., 1] <= shape[0])
+        )
+        valid = np.count_nonzero(inside, axis=1) == 4
+        poly, inside = poly[valid], inside[valid]
+        order = np.argsort(~inside, axis=1, kind="stable")[:, :4]
+        poly = np.trunc(np.take_along_axis(poly, order[..., np.newaxis], 1))
+        poly = poly.astype(np.int64)
+
+        # Sort the points clockwise (as done by `__sort_points()`)
+        center = poly.sum(axis=1, keepdims=True) / 4
+        angle = (
+            np.arctan2(
+                poly[..., 0] - center[..., 0], poly[..., 1] - center[..., 1]
+            )
+            + 2 * math.pi
+        ) % (2 * math.pi)
+        order = np.argsort(angle, axis=1, kind="stable")
+        poly = np.take_along_axis(poly, order[..., np.newaxis], 1)
+
+        # Keep the convex frames (as done by `cv2.isContourConvex()`)
+        edges = poly - np.roll(poly, 1, axis=1)
+        prev_edges = np.roll(edges, 1, axis=1)
+        cross = (
+            edges[..., 1] * prev_edges[..., 0]
+            - edges[..., 0] * prev_edges[..., 1]
+        )
+        convex = np.all(cross > 0, axis=1) | np.all(cross < 0, axis=1)
+        frames.append(poly[convex])
+
+    return np.concatenate(frames)
+
+
+def __count_in_boxes(pts: np.ndarray, boxes: np.ndarray, shape: list):
+    """Count the points inside each of the given boxes.
+
+    The counts are computed with a summed-area table of the points, so
+    each box costs O(1) regardless of the number of points. Since the
+    points are binned into pixels, the counts are upper bounds of the
+    exact ones.
+
+    :param pts: Array of shape (N, 2) of points inside the image.
+
+    :param boxes: Array of shape (M, 4) of (x1, y1, x2, y2) boxes.
+
+    :param shape: Shape of the image.
+
+    :return: Array of shape (M,) with the number of points per box.
+    """
+    height, width = shape[0] + 1, shape[1] + 1
+    hist = np.zeros((height + 1, width + 1), dtype=np.int64)
+    np.add.at(
+        hist,
+        (
+            np.clip(pts[:, 1].astype(np.int64), 0, height - 1) + 1,
+            np.clip(pts[:, 0].astype(np.int64), 0, width - 1) + 1,
+        ),
+        1,
+    )
+    table = hist.cumsum(axis=0).cumsum(axis=1)
+
+    x1 = np.clip(np.floor(boxes[:, 0]).astype(np.int64), 0, width)
+    y1 = np.clip(np.floor(boxes[:, 1]).astype(np.int64), 0, height)
+    x2 = np.clip(np.floor(boxes[:, 2]).astype(np.int64) + 1, 0, width)
+    y2 = np.clip(np.floor(boxes[:, 3]).astype(np.int64) + 1, 0, height)
+    return table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1]
+
+
+def __round(values: np.ndarray) -> np.ndarray:
+    """Round half away from zero, as Clipper does."""
+    return np.where(values < 0, np.trunc(values - 0.5), np.trunc(values + 0.5))
+
+
+def __offset_polygons(polys: np.ndarray, delta: float) -> np.ndarray:
+    """Offset a batch of polygons as `pyclipper` does with miter joins.
+
+    This function computes the same offset polygons as
+    `PyclipperOffset` with `JT_MITER` joins and `ET_CLOSEDPOLYGON` ends
+    on a batch of polygons at once.
+
+    :param polys: Integer array of shape `(N, M, 2)` with N polygons of
+        M distinct consecutive vertices.
+
+    :param delta: Offset distance.
+
+    :return: Array of shape `(N, 3 * M, 2)` with the offset polygons.
+
+        Each vertex is offset into three points, which are repeated if
+        its join needs fewer points.
+    """
+    n, m = polys.shape[:2]
+    rows = np.arange(n)
+
+    # Clipper offsets positively oriented polygons
+    prev = np.roll(polys, 1, axis=1)
+    area = -0.5 * np.sum(
+        (prev[..., 0] + polys[..., 0]) * (prev[..., 1] - polys[..., 1]),
+        axis=1,
+    )
+    src = np.where((area < 0)[:, None, None], polys[:, ::-1], polys)
+    src = src.astype(np.float64)
+
+    # Unit normals of the edges
+    edges = np.roll(src, -1, axis=1) - src
+    f = 1.0 / np.sqrt(edges[..., 0] ** 2 + edges[..., 1] ** 2)
+    normals = np.stack((edges[..., 1] * f, -(edges[..., 0] * f)), axis=-1)
+
+    out = np.empty((n, m, 3, 2))
+    concaves = np.zeros((n, m), dtype=bool)
+    k = np.full(n, m - 1)
+    for j in range(m):
+        pt, nk, nj = src[:, j], normals[rows, k], normals[:, j]
+        sin_a = nk[:, 0] * nj[:, 1] - nj[:, 0] * nk[:, 1]
+        cos_a = nk[:, 0] * nj[:, 0] + nj[:, 1] * nk[:, 1]
+        small = np.abs(sin_a * delta) < 1.0
+        flat = small & (cos_a > 0)  # Almost straight angle
+        sin_a = np.where(small, sin_a, np.clip(sin_a, -1.0, 1.0))
+        concave = ~flat & (sin_a * delta < 0)
+        r = 1 + (nj[:, 0] * nk[:, 0] + nj[:, 1] * nk[:, 1])
+        square = ~flat & ~concave & (r < 0.5)  # Over the miter limit
+
+        pk = pt + nk * delta
+        pj = pt + nj * delta
+        with np.errstate(divide="ignore", invalid="ignore"):
+            miter = pt + (nk + nj) * (delta / r)[:, None]
+        dx = np.tan(
+            np.arctan2(sin_a, nk[:, 0] * nj[:, 0] + nk[:, 1] * nj[:, 1]) / 4
+        )[:, None]
+        square1 = pt + delta * (nk + nk[:, ::-1] * [-1, 1] * dx)
+        square2 = pt + delta * (nj + nj[:, ::-1] * [1, -1] * dx)
+
+        flat, concave, square = (x[:, None] for x in (flat, concave, square))
+        joined = np.where(square, square2, miter)
+        out[:, j, 0] = np.where(
+            flat | concave, pk, np.where(square, square1, miter)
+        )
+        out[:, j, 1] = np.where(flat, pk, np.where(concave, pt, joined))
+        out[:, j, 2] = np.where(flat, pk, np.where(concave, pj, joined))
+        concaves[:, j] = concave[:, 0]
+        # The previous normal is kept after an almost straight angle
+        k = np.where(flat[:, 0], k, j)
+    out = __round(out)
+
+    # The union done by Clipper afterwards replaces the loop made by the
+    # offset edges around a concave vertex with their (rounded)
+    # intersection
+    res = out.copy()
+    for j in range(m):
+        a0, a1 = out[:, j - 1, 2], out[:, j, 0]
+        b0, b1 = out[:, j, 2], out[:, (j + 1) % m, 0]
+        da, db, dab = a1 - a0, b1 - b0, b0 - a0
+        den = da[:, 0] * db[:, 1] - da[:, 1] * db[:, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (dab[:, 0] * db[:, 1] - dab[:, 1] * db[:, 0]) / den
+            u = (dab[:, 0] * da[:, 1] - dab[:, 1] * da[:, 0]) / den
+        loop = concaves[:, j] & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        res[loop, j] = __round(a0 + t[:, None] * da)[loop, None]
+    return res.reshape(n, 3 * m, 2)
+
+
+def __offset_frames(cnts: np.ndarray, delta: float) -> np.ndarray:
+    """Offset a batch of quadrilaterals as `pyclipper` does.
+
+    Repeated consecutive vertices are dropped before offsetting, as
+    Clipper does. The quadrilaterals that are left with less than
+    three vertices (whose offset is empty) are returned unchanged.
+
+    :param cnts: Integer array of shape `(N, 4, 2)` with the frames.
+
+    :param delta: Offset distance.
+
+    :return: Array of shape `(N, 12, 2)` with the offset frames.
+    """
+    keep = np.ones(cnts.shape[:2], dtype=bool)
+    keep[:, 1:] = np.any(cnts[:, 1:] != cnts[:, :-1], axis=2)
+    closing = np.ones(len(cnts), dtype=bool)
+    for i in range(3, 0, -1):
+        closing &= np.all(cnts[:, i] == cnts[:, 0], axis=1)
+        keep[:, i] &= ~closing
+
+    out = np.repeat(cnts.astype(np.float64), 3, axis=1)
+    n_vertices = np.count_nonzero(keep, axis=1)
+    for m in (3, 4):
+        sel = np.flatnonzero(n_vertices == m)
+        if len(sel) > 0:
+            polys = cnts[sel][keep[sel]].reshape(-1, m, 2)
+            out[sel, : 3 * m] = __offset_polygons(polys, delta)
+            out[sel, 3 * m :] = out[sel, 3 * m - 1 : 3 * m]
+    return out
+
+
+def __winding_numbers(polys: np.ndarray, pts: np.ndarray) -> np.ndarray:
+    """Return the winding number of each point around each polygon.
+
+    Edge crossings are decided with the same rule as
+    `matplotlib.path.Path.contains_points`, so points on the border
+    get the same treatment.
+
+    :param polys: Array of shape `(N, M, 2)` with the polygons.
 
-    d = (det(*line1), det(*line2))
-    x = det(d, xdiff) / div
-    y = det(d, ydiff) / div
-    return x, y
+    :param pts: Array of shape `(P, 2)` with the points.
+
+    :return: Integer array of shape `(N, P)`.
+    """
+    tx, ty = pts[:, 0], pts[:, 1]
+    winding = np.zeros((len(polys), len(pts)), dtype=np.int64)
+    for v0, v1 in zip(
+        polys.transpose(1, 0, 2), np.roll(polys, -1, axis=1).transpose(1, 0, 2)
+    ):
+        x0, y0 = v0[:, 0, None], v0[:, 1, None]
+        x1, y1 = v1[:, 0, None], v1[:, 1, None]
+        yflag0, yflag1 = y0 >= ty, y1 >= ty
+        crossing = (yflag0 != yflag1) & (
+            ((y1 - ty) * (x0 - x1) >= (x1 - tx) * (y0 - y1)) == yflag1
+        )
+        winding += crossing * (2 * yflag1 - 1)
+    return winding
+
+
+def __hull_vertices(inside: np.ndarray, pts: np.ndarray) -> np.ndarray:
+    """Find the convex hull vertices of several subsets of points.
+
+    This function runs Andrew's monotone chain algorithm on all of the
+    subsets at once. Points lying on a hull edge are not vertices.
+
+    :param inside: Boolean array of shape `(N, P)` with the subsets.
+
+    :param pts: Array of shape `(P, 2)` with distinct points.
+
+    :return: Boolean array of shape `(N, P)` with the hull vertices.
+    """
+    n = len(inside)
+    rows = np.arange(n)
+    order = np.lexsort((pts[:, 1], pts[:, 0]))
+    vertices = np.zeros_like(inside)
+    for chain in (order, order[::-1]):
+        stack = np.zeros((n, len(pts) + 2), dtype=np.int64)
+        top = np.zeros(n, dtype=np.int64)
+        for idx in chain:
+            active = inside[:, idx]
+            while True:
+                o = pts[stack[rows, np.maximum(top - 2, 0)]]
+                a = pts[stack[rows, np.maximum(top - 1, 0)]]
+                cross = (a[:, 0] - o[:, 0]) * (pts[idx, 1] - o[:, 1]) - (
+                    a[:, 1] - o[:, 1]
+                ) * (pts[idx, 0] - o[:, 0])
+                pop = active & (top >= 2) & (cross <= 0)
+                if not np.any(pop):
+                    break
+                top -= pop
+            stack[rows, top] = np.where(active, idx, stack[rows, top])
+            top += active
+        for i in range(len(pts)):
+            in_chain = i < top
+            vertices[rows[in_chain], stack[in_chain, i]] = True
+            if not np.any(in_chain):
+                break
+    return vertices
 
 
 def __polyscore(cnt, pts, cen, alfa, beta):
-    """Calculate the polyscore value."""
+    """Calculate the polyscore value of one frame or a batch of frames.
+
+    :param cnt: Frame of shape `(4, 2)` or frames of shape `(N, 4, 2)`.
+
+    :param pts: Lattice points.
+
+    :param cen: Centroid of the lattice points.
+
+    :param alfa: Half of the side of a chessboard square.
+
+    :param beta: Number of lattice points that a frame may miss.
+
+    :return: Polyscore of the frame, or array with the polyscore of
+        each frame.
+    """
+    cnts = np.asarray(cnt, dtype=np.int64)
+    scores = np.zeros(cnts.shape[:-2])
+    cnts = cnts.reshape(-1, 4, 2)
+
     # Too small area
-    frame_area = cv2.contourArea(cnt)
-    if frame_area < (4 * alfa * alfa) * 5:
-        return 0
+    frame_area = 0.5 * np.abs(
+        np.sum(
+            cnts[..., 0] * np.roll(cnts[..., 1], -1, axis=1)
+            - np.roll(cnts[..., 0], -1, axis=1) * cnts[..., 1],
+            axis=1,
+        )
+    )
+    frames = np.flatnonzero(frame_area >= (4 * alfa * alfa) * 5)
 
     gamma = alfa / 1.5
 
-    pts = np.array(pts)
+    # Repeated points are counted but they are the same hull vertex
+    pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+    uniq, counts = np.unique(pts, axis=0, return_counts=True)
+
+    # We score the frames in chunks to bound the memory usage
+    for sel in np.array_split(frames, len(frames) // 1024 + 1):
+        # Too few points
+        inside = __winding_numbers(__offset_frames(cnts[sel], gamma), uniq)
+        inside = inside > 0
+        pts_in_frame = np.minimum(inside @ counts, 49)
+        enough = (pts_in_frame > 0) & (
+            pts_in_frame >= min(pts.shape[0], 49) - 2 * beta - 1
+        )
+        sel, inside = sel[enough], inside[enough]
+        pts_in_frame = pts_in_frame[enough]
+        hull = __hull_vertices(inside, uniq)
 
-    # Too few points
-    pco = pyclipper.PyclipperOffset()
-    pco.AddPath(cnt, pyclipper.JT_MITER, pyclipper.ET_CLOSEDPOLYGON)
-    pcnt = matplotlib.path.Path(pco.Execute(gamma)[0])
-    wtfs = pcnt.contains_points(pts)
-    pts_in_frame = min(np.count_nonzero(wtfs), 49)
-    if pts_in_frame < min(pts.shape[0], 49) - 2 * beta - 1:
-        return 0
+        # We are looking for the focal point of the cluster
+        cen2 = (hull @ uniq) / np.count_nonzero(hull, axis=1)[:, None]
 
-    pcnt_in = pts[wtfs]
-    hull = ConvexHull(pcnt_in).vertices
-    points = pcnt_in[hull]
+        # Distance between the group centroid and the frame centroid
+        cen_dist = np.sqrt(
+            (cen[0] - cen2[:, 0]) ** 2 + (cen[1] - cen2[:, 1]) ** 2
+        )
 
-    # We are looking for the focal point of the cluster
-    length = points.shape[0]
-    sum_xy = np.sum(points, axis=0)
-    cen2 = (sum_xy[0] / length, sum_xy[1] / length)
-
-    # Distance between the group centroid and the frame centroid
-    cen_dist = math.sqrt((cen[0] - cen2[0]) ** 2 + (cen[1] - cen2[1]) ** 2)
-
-    lns = [
-        [cnt[0], cnt[1]],
-        [cnt[1], cnt[2]],
-        [cnt[2], cnt[3]],
-        [cnt[3], cnt[0]],
-    ]
-    i = 0
-    j = 0
-    for l in lns:
-        d = math.sqrt((l[0][0] - l[1][0]) ** 2 + (l[0][1] - l[1][1]) ** 2)
-        for p in points:
-            r = __ptl_distance(l, p, d)
-            if r < gamma:
-                i += r
-                j += 1
-    if j == 0:
-        return 0
-
-    average_dist = i / j
-
-    if frame_area == 0 or pts_in_frame == 0:
-        return 0
-
-    w_points = 1 + (average_dist / pts_in_frame) ** (1 / 3)
-    w_centroid = 1 + (cen_dist / pts_in_frame) ** (1 / 5)
-    return (pts_in_frame**4) / ((frame_area**2) * w_points * w_centroid)
-
-
-def __padcrop(img, four_points):
+        i = np.zeros(len(sel))
+        j = np.zeros(len(sel), dtype=np.int64)
+        for side in range(4):
+            l0 = cnts[sel, side, :, None]
+            l1 = cnts[sel, (side + 1) % 4, :, None]
+            d = np.sqrt(
+                (l0[:, 0] - l1[:, 0]) ** 2 + (l0[:, 1] - l1[:, 1]) ** 2
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r = (
+                    np.abs(
+                        (l1[:, 0] - l0[:, 0]) * (l0[:, 1] - uniq[:, 1])
+                        - (l1[:, 1] - l0[:, 1]) * (l0[:, 0] - uniq[:, 0])
+                    )
+                    / d
+                )
+            near = hull & (r < gamma)
+            i += np.sum(r, axis=1, where=near)
+            j += np.count_nonzero(near, axis=1)
+
+        valid = j > 0
+        average_dist = i[valid] / j[valid]
+        pts_in_frame = pts_in_frame[valid]
+
+        w_points = 1 + (average_dist / pts_in_frame) ** (1 / 3)
+        w_centroid = 1 + (cen_dist[valid] / pts_in_frame) ** (1 / 5)
+        scores.flat[sel[valid]] = (pts_in_frame**4) / (
+            (frame_area[sel[valid]] ** 2) * w_points * w_centroid
+        )
+
+    return scores if scores.ndim > 0 else float(scores)
+
+
+def __padcrop(img, four_points, padding=60):
     """Apply a border to the inner four points of the chessboard.
 
     This function applies a border to the inner four points of the
@@ -194,45 +545,46 @@ def __padcrop(img, four_points):
     pco = pyclipper.PyclipperOffset()
     pco.AddPath(four_points, pyclipper.JT_MITER, pyclipper.ET_CLOSEDPOLYGON)
 
-    padded = pco.Execute(60)[0]
-
-    debug.DebugImage(img).points(four_points, color=(0, 0, 255)).points(
-        padded, color=(0, 255, 0)
-    ).lines(
-        [
-            [four_points[0], four_points[1]],
-            [four_points[1], four_points[2]],
-            [four_points[2], four_points[3]],
-            [four_points[3], four_points[0]],
-        ],
-        color=(255, 255, 255),
-    ).lines(
-        [
-            [padded[0], padded[1]],
-            [padded[1], padded[2]],
-            [padded[2], padded[3]],
-            [padded[3], padded[0]],
-        ],
-        color=(255, 255, 255),
-    ).save(
-        "cps_final_pad"
-    )
+    padded = pco.Execute(padding)[0]
+
+    if debug.enabled():
+        debug.DebugImage(img).points(four_points, color=(0, 0, 255)).points(
+            padded, color=(0, 255, 0)
+        ).lines(
+            [
+                [four_points[0], four_points[1]],
+                [four_points[1], four_points[2]],
+                [four_points[2], four_points[3]],
+                [four_points[3], four_points[0]],
+            ],
+            color=(255, 255, 255),
+        ).lines(
+            [
+                [padded[0], padded[1]],
+                [padded[1], padded[2]],
+                [padded[2], padded[3]],
+                [padded[3], padded[0]],
+            ],
+            color=(255, 255, 255),
+        ).save(
+            "cps_final_pad"
+        )
 
     return __order_points(padded)
 
 
-def cps(
-    img: np.ndarray, points: list[list], lines: list[list]
-) -> list[list[int]]:
-    """Search for the chessboard position in the given image.
+def __board_frame(img: np.ndarray, points: list[list], lines: list[list]):
+    """Search for the frame of the board formed by the given points.
 
-    :param img: Image to search.
+    :param img: Image to search (in grayscale).
 
-    :param points: Points obtained in laps.
+    :param points: Lattice points of the board, sorted by
+    `__sort_points()`.
 
     :param lines: Lines detected by slid.
 
-    :return: The four inner points of the detected chessboard.
+    :return: A pair formed by the polyscore of the frame found (0 if no
+    frame scored) and the four inner points of the board.
     """
     ptp_cache = {}
 
@@ -248,28 +600,6 @@ def cps(
         ptp_cache[idx] = math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2)
         return ptp_cache[idx]
 
-    points = __check_correctness(__normalize(points), img.shape)
-
-    # Clustering
-    __points = {}
-    points = __sort_points(points)
-    __max = 0
-    __points_max = []
-    alfa = math.sqrt(cv2.contourArea(np.array(points)) / 49)
-    X = DBSCAN(eps=alfa * 4).fit(points)
-    for i in range(len(points)):
-        __points[i] = []
-    for i in range(len(points)):
-        if X.labels_[i] != -1:
-            __points[X.labels_[i]].append(points[i])
-    for i in range(len(points)):
-        if len(__points[i]) > __max:
-            __max = len(__points[i])
-            __points_max = __points[i]
-
-    if len(__points) > 0 and len(points) > 49 / 2:
-        points = __points_max
-
     n = len(points)
     beta = n * (5 / 100)  # beta = n * (100 - (CPS efectiveness))
     alfa = math.sqrt(cv2.contourArea(np.array(points)) / 49)
@@ -292,13 +622,11 @@ def cps(
         b = [int((1 - t) * x_0 + t * x_1), int((1 - t) * y_0 + t * y_1)][::-1]
 
         poly1 = __sort_points([[0, 0], [0, img.shape[0]], a, b])
-        s1 = __polyscore(np.array(poly1), points, centroid, alfa / 2, beta)
         poly2 = __sort_points(
             [a, b, [img.shape[1], 0], [img.shape[1], img.shape[0]]]
         )
-        s2 = __polyscore(np.array(poly2), points, centroid, alfa / 2, beta)
 
-        return [a, b], s1, s2
+        return [a, b], poly1, poly2
 
     def __h(l):
         x_0, y_0 = l[0][0], l[0][1]
@@ -313,37 +641,44 @@ def cps(
         b = [int((1 - t) * x_0 + t * x_1), int((1 - t) * y_0 + t * y_1)]
 
         poly1 = __sort_points([[0, 0], [img.shape[1], 0], a, b])
-        s1 = __polyscore(np.array(poly1), points, centroid, alfa / 2, beta)
         poly2 = __sort_points(
             [a, b, [0, img.shape[0]], [img.shape[1], img.shape[0]]]
         )
-        s2 = __polyscore(np.array(poly2), points, centroid, alfa / 2, beta)
 
-        return [a, b], s1, s2
+        return [a, b], poly1, poly2
 
-    pregroup = [[], []]  # Division into 2 groups (for the frame)
+    np_points = np.array(points)
+    ring, polys = [], []
     for l in lines:  # We will review all of the lines
         # We reject lines that pass through the center of the cluster
         if __ptl_distance(l, centroid, ptp_distance(*l)) > alfa * 2.5:
-            for p in points:
-                # We check that the line passes near a good point
-                if __ptl_distance(l, p, ptp_distance(*l)) < alfa:
-                    # The line belongs to the ring
-                    tx, ty = l[0][0] - l[1][0], l[0][1] - l[1][1]
-                    if abs(tx) < abs(ty):
-                        ll, s1, s2 = __v(l)
-                        orientation = 0
-                    else:
-                        ll, s1, s2 = __h(l)
-                        orientation = 1
-                    if s1 == 0 and s2 == 0:
-                        continue
-                    pregroup[orientation].append(ll)
+            # We check that the line passes near a good point
+            if np.any(__ptl_distance(l, np_points.T, ptp_distance(*l)) < alfa):
+                # The line belongs to the ring
+                tx, ty = l[0][0] - l[1][0], l[0][1] - l[1][1]
+                if abs(tx) < abs(ty):
+                    ll, poly1, poly2 = __v(l)
+                    orientation = 0
+                else:
+                    ll, poly1, poly2 = __h(l)
+                    orientation = 1
+                ring.append((ll, orientation))
+                polys.extend((poly1, poly2))
+
+    # Both sides of all of the ring lines are scored at once
+    scores = __polyscore(
+        np.reshape(polys, (-1, 4, 2)), points, centroid, alfa / 2, beta
+    )
+    pregroup = [[], []]  # Division into 2 groups (for the frame)
+    for (ll, orientation), s1, s2 in zip(ring, scores[::2], scores[1::2]):
+        if s1 == 0 and s2 == 0:
+            continue
+        pregroup[orientation].append(ll)
 
     pregroup[0] = __remove_duplicates(pregroup[0])
     pregroup[1] = __remove_duplicates(pregroup[1])
 
-    if debug.DEBUG:
+    if debug.enabled():
         # We create an outer ring
         def convex_approx(points, alfa=0.01):
             points = np.array(points)
@@ -368,43 +703,171 @@ def cps(
             pregroup[1], color=(255, 0, 0)
         ).save("cps_pregroups")
 
-    score = {}  # Frame ranking with the result
-    for v in itertools.combinations(pregroup[0], 2):  # Horizontal
-        for h in itertools.combinations(pregroup[1], 2):  # Vertical
-            poly = [
-                __intersection(v[0], v[1]),
-                __intersection(v[0], h[0]),
-                __intersection(v[0], h[1]),
-                __intersection(v[1], h[0]),
-                __intersection(v[1], h[1]),
-                __intersection(h[0], h[1]),
-            ]
-            poly = __check_correctness(poly, img.shape)
-            if len(poly) != 4:
-                continue
-            poly = np.array(__sort_points(__normalize(poly)))
-            if not cv2.isContourConvex(poly):
-                continue
-            score[-__polyscore(poly, points, centroid, alfa / 2, beta)] = poly
-
-    score = collections.OrderedDict(sorted(score.items()))
-    K = next(iter(score))
-
-    inner_points = __normalize(score[K])
+    # All of the convex frames formed by two horizontal and two vertical
+    # lines
+    frames = __candidate_frames(pregroup[0], pregroup[1], img.shape)
+    if len(frames) == 0:
+        raise ValueError("No chessboard frame was found")
+
+    # Cheap bounds to discard the frames whose polyscore would be 0
+    # before computing it: the frame area must be big enough and there
+    # must be enough points around the frame
+    area = 0.5 * np.abs(
+        np.sum(
+            frames[..., 0] * np.roll(frames[..., 1], -1, axis=1)
+            - np.roll(frames[..., 0], -1, axis=1) * frames[..., 1],
+            axis=1,
+        )
+    )
+    margin = 2 * (alfa / 2) / 1.5 + 2  # Max. offset done by __polyscore
+    boxes = np.concatenate(
+        (frames.min(axis=1) - margin, frames.max(axis=1) + margin), axis=1
+    )
+    pts_around = __count_in_boxes(np_points, boxes, img.shape)
+    promising = (area >= (4 * (alfa / 2) * (alfa / 2)) * 5) & (
+        np.minimum(pts_around, 49) >= min(n, 49) - 2 * beta - 1
+    )
+
+    # Frame ranking with the result (if several frames share the best
+    # score, the last one is kept)
+    best_frame, best_score = frames[-1], 0
+    frames = frames[promising]
+    scores = __polyscore(frames, points, centroid, alfa / 2, beta)
+    if np.any(scores > 0):
+        best_frame = frames[np.flatnonzero(scores == scores.max())[-1]]
+        best_score = scores.max()
+
+    inner_points = __normalize(best_frame)
     inner_points = __order_points(inner_points)
 
-    debug.DebugImage(img).points(points, color=(0, 255, 0)).points(
-        inner_points, color=(0, 0, 255)
-    ).points([centroid], color=(255, 0, 0)).lines(
-        [
-            [inner_points[0], inner_points[1]],
-            [inner_points[1], inner_points[2]],
-            [inner_points[2], inner_points[3]],
-            [inner_points[3], inner_points[0]],
-        ],
-        color=(255, 255, 255),
-    ).save(
-        "cps_debug_2"
-    )
+    if debug.enabled():
+        debug.DebugImage(img).points(points, color=(0, 255, 0)).points(
+            inner_points, color=(0, 0, 255)
+        ).points([centroid], color=(255, 0, 0)).lines(
+            [
+                [inner_points[0], inner_points[1]],
+                [inner_points[1], inner_points[2]],
+                [inner_points[2], inner_points[3]],
+                [inner_points[3], inner_points[0]],
+            ],
+            color=(255, 255, 255),
+        ).save(
+            "cps_debug_2"
+        )
+
+    return best_score, inner_points
+
+
+def cps(
+    img: np.ndarray,
+    points: list[list],
+    lines: list[list],
+    padding: float = 60,
+) -> list[list[int]]:
+    """Search for the chessboard position in the given image.
+
+    :param img: Image to search (in grayscale).
+
+    :param points: Points obtained in laps.
+
+    :param lines: Lines detected by slid.
 
-    return __padcrop(img, inner_points)
+    :param padding: Border (in pixels) applied to the inner points.
+
+    :return: The four inner points of the detected chessboard.
+    """
+    points = __check_correctness(__normalize(points), img.shape)
+    if not points:
+        raise ValueError("No lattice points were found")
+
+    # Clustering
+    __points = {}
+    points = __sort_points(points)
+    __max = 0
+    __points_max = []
+    alfa = math.sqrt(cv2.contourArea(np.array(points)) / 49)
+    X = DBSCAN(eps=alfa * 4).fit(points)
+    for i in range(len(points)):
+        __points[i] = []
+    for i in range(len(points)):
+        if X.labels_[i] != -1:
+            __points[X.labels_[i]].append(points[i])
+    for i in range(len(points)):
+        if len(__points[i]) > __max:
+            __max = len(__points[i])
+            __points_max = __points[i]
+
+    if len(__points) > 0 and len(points) > 49 / 2:
+        points = __points_max
+
+    _, inner_points = __board_frame(img, points, lines)
+    return __padcrop(img, inner_points, padding)
+
+
+def __overlap(poly1: list[list[int]], poly2: list[list[int]]) -> bool:
+    """Check whether two convex polygons overlap."""
+    area, _ = cv2.intersectConvexConvex(np.float32(poly1), np.float32(poly2))
+    return area > 0
+
+
+def cps_boards(
+    img: np.ndarray,
+    points: list[list],
+    lines: list[list],
+    padding: float = 60,
+    max_boards: int = 6,
+) -> list[list[list[int]]]:
+    """Search for the positions of several chessboards in the image.
+
+    The lattice points are split into one cluster per board and the
+    frame of each board is searched as in `cps()`, all with the same
+    lines and points.
+
+    :param img: Image to search (in grayscale).
+
+    :param points: Points obtained in laps.
+
+    :param lines: Lines detected by slid.
+
+    :param padding: Border (in pixels) applied to the inner points.
+
+    :param max_boards: Maximum number of chessboards to return.
+
+    :return: List of the four inner points of each of the detected
+    chessboards, which do not overlap, ranked by the polyscore of their
+    frames.
+    """
+    points = __check_correctness(__normalize(points), img.shape)
+    if len(points) <= 49 / 2:
+        return []
+
+    # The lattice points of a board are one square apart (the distance
+    # to the nearest point), so the points of boards that are at least
+    # two squares apart end up in different clusters
+    dists, _ = cKDTree(points).query(points, k=2)
+    square = np.median(dists[:, 1])
+    labels = DBSCAN(eps=square * 2).fit(points).labels_
+
+    boards = []
+    for label in set(labels) - {-1}:
+        cluster = [p for p, l in zip(points, labels) if l == label]
+        if len(cluster) <= 49 / 2:
+            continue
+        try:
+            score, inner_points = __board_frame(
+                img, __sort_points(cluster), lines
+            )
+        except ValueError:  # No frame was found for this cluster
+            continue
+        if score > 0:
+            boards.append((score, inner_points))
+
+    boards.sort(key=lambda board: board[0], reverse=True)
+    ranked = []
+    for _, inner_points in boards:
+        if not any(__overlap(inner_points, other) for other in ranked):
+            ranked.append(inner_points)
+        if len(ranked) == max_boards:
+            break
+
+    return [__padcrop(img, inner_points, padding) for inner_points in ranked]
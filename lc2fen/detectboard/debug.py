@@ -1,7 +1,23 @@
-"""This is the module for debugging utilities."""
+"""This is the module for debugging utilities.
 
+The debug images are only drawn and saved while debugging is enabled
+with `debugging()`, which enables it for the current request (i.e., the
+current thread or asyncio task) only. Every debug-image statement is
+guarded by `enabled()`, so that disabled debugging costs a single check
+and none of the arguments of the debug images are computed.
 
+While debugging is enabled, the images are saved by a background thread
+so that the detection does not wait for them to be written. The scripts
+enable it with their `--debug` option.
+"""
+
+
+import contextlib
+import contextvars
 import itertools
+import os
+import queue
+import threading
 from copy import copy
 from random import randint
 
@@ -9,9 +25,11 @@ import cv2
 import numpy as np
 
 
-DEBUG = False  # Set it to `True`/`False` to enable/disable debug images
-COUNTER = itertools.count()
 DEBUG_SAVE_DIR = "data/boards/debug_steps/"
+MAX_QUEUED_IMAGES = 16  # Max. number of debug images waiting to save
+
+# Debug session of the current request (`None` if debugging is disabled)
+_SESSION = contextvars.ContextVar("debug_session", default=None)
 
 
 def rand_color():
@@ -19,47 +37,122 @@ def rand_color():
     return randint(0, 255), randint(0, 255), randint(0, 255)
 
 
+class DebugSession:
+    """Represent the debugging of a request.
+
+    This class numbers the debug images of the request and hands them to
+    a background thread that saves them. The queue of images waiting to
+    be saved is bounded, so a request that produces debug images faster
+    than they can be saved waits instead of piling them up in memory.
+    """
+
+    def __init__(
+        self,
+        save_dir: str = DEBUG_SAVE_DIR,
+        max_queued_images: int = MAX_QUEUED_IMAGES,
+    ):
+        """Initialize an instance of the `DebugSession`.
+
+        :param save_dir: Directory in which to save the debug images.
+
+        :param max_queued_images: Max. number of images waiting to be
+        saved.
+        """
+        os.makedirs(save_dir, exist_ok=True)
+        self.save_dir = save_dir
+        self.counter = itertools.count()
+        self.queue = queue.Queue(max_queued_images)
+        self.writer = threading.Thread(target=self.__write, daemon=True)
+        self.writer.start()
+
+    def __write(self):
+        """Save the queued images until the session is closed.
+
+        An image that cannot be saved is reported and skipped, so that
+        the thread keeps emptying the queue and the request never waits
+        for it forever.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, img = item
+            try:
+                if not cv2.imwrite(path, img):
+                    raise OSError("the file could not be written")
+            except Exception as error:
+                print(f"Warning: debug image {path} not saved: {error}")
+
+    def save(self, filename: str, img: np.ndarray, prefix: bool = True):
+        """Queue an image to be saved."""
+        if prefix:
+            filename = "__debug_%04d_" % next(self.counter) + filename
+        self.queue.put((self.save_dir + filename + ".jpg", img))
+
+    def close(self):
+        """Wait until all of the queued images are saved."""
+        self.queue.put(None)
+        self.writer.join()
+
+
+@contextlib.contextmanager
+def debugging(
+    save_dir: str = DEBUG_SAVE_DIR, max_queued_images: int = MAX_QUEUED_IMAGES
+):
+    """Enable the debug images for the current request.
+
+    For instance, `with debugging(): detect(...)` saves the debug images
+    of that detection only. All of them are saved when the block exits.
+
+    :param save_dir: Directory in which to save the debug images.
+
+    :param max_queued_images: Max. number of images waiting to be saved.
+    """
+    session = DebugSession(save_dir, max_queued_images)
+    token = _SESSION.set(session)
+    try:
+        yield session
+    finally:
+        _SESSION.reset(token)
+        session.close()
+
+
+def enabled():
+    """Return whether debugging is enabled for the current request."""
+    return _SESSION.get() is not None
+
+
 class DebugImage:
     """Represent a debug image.
 
     This class is used for drawing points and lines and saving the
     resulting image.
+
+    It should only be used when `enabled()`.
     """
 
     def __init__(self, img):
         """Initialize an instance of the `DebugImage`."""
-        if DEBUG:
-            if isinstance(img, tuple):
-                img = np.zeros((img[0], img[1], 3), np.uint8)
-            if len(img.shape) < 3:
-                img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-            self.img = copy(img)
+        if isinstance(img, tuple):
+            img = np.zeros((img[0], img[1], 3), np.uint8)
+        if len(img.shape) < 3:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+        self.img = copy(img)
 
     def lines(self, _lines, color=(0, 0, 255), size=2):
         """Draw lines in the image."""
-        if DEBUG:
-            for li1, li2 in _lines:
-                cv2.line(self.img, tuple(li1), tuple(li2), color, size)
+        for li1, li2 in _lines:
+            cv2.line(self.img, tuple(li1), tuple(li2), color, size)
         return self
 
     def points(self, _points, color=(0, 0, 255), size=10):
         """Draw points in the image."""
-        if DEBUG:
-            for point in _points:
-                cv2.circle(
-                    self.img, (int(point[0]), int(point[1])), size, color, -1
-                )
+        for point in _points:
+            cv2.circle(
+                self.img, (int(point[0]), int(point[1])), size, color, -1
+            )
         return self
 
     def save(self, filename, prefix=True):
-        """Save the image."""
-        global COUNTER
-        if DEBUG:
-            if prefix:
-                __prefix = "__debug_" + "%04d" % int(next(COUNTER)) + "_"
-            else:
-                __prefix = ""
-
-            cv2.imwrite(
-                DEBUG_SAVE_DIR + __prefix + filename + ".jpg", self.img
-            )
+        """Save the image (in the background)."""
+        _SESSION.get().save(filename, self.img, prefix)
@@ -1,19 +1,90 @@
 """This is the main file of detectboard module.
 
-It detects a board on a given image using the `detect()` function.
+It detects a board on a given image using the `detect()` function and
+several boards on a given image using the `detect_boards()` function.
 """
 
 
+import math
+
 import cv2
 import numpy as np
 
 from lc2fen.detectboard import debug
-from lc2fen.detectboard.cps import cps
-from lc2fen.detectboard.image_object import ImageObject
+from lc2fen.detectboard.cps import cps, cps_boards
+from lc2fen.detectboard.image_object import (
+    BOARD_FRAME,
+    BOARD_LENGTH,
+    REDUCED_FLAGS,
+    ImageObject,
+    board_transform,
+    image_read,
+    image_shape,
+    quad_side,
+    reduction_factor,
+)
 from lc2fen.detectboard.laps import laps, check_board_position
 from lc2fen.detectboard.slid import slid
 
 
+# Max. distance (in board squares) between a lattice point found in a
+# layer and its position in the board found in that layer
+__LATTICE_POINT_TOLERANCE = 0.1
+
+# The detection stops when the fraction of interior lattice points of
+# the board found in a layer or the displacement (in board squares) of
+# the board corners with respect to the previous layer reach these
+# values
+__CONVERGENCE_LATTICE_FRACTION = 0.9
+__CONVERGENCE_DISPLACEMENT = 0.1
+
+# Min. fraction of interior lattice points of the board found in the
+# last layer for the board found in a region of interest to be kept
+# (otherwise, a larger region is searched)
+__ROI_LATTICE_FRACTION = 0.5
+
+# Default normalized side of the image of each layer when a single board
+# is detected and when several boards are detected (see `detect()` and
+# `detect_boards()`)
+LAYER_HEIGHTS = (500,)
+BOARDS_LAYER_HEIGHTS = (1000, 500)
+
+# Min. ratio between the normalized side of the searched region of the
+# reduced input image and the side of the largest searched image (so
+# that the board found in the first layer is still sampled finely
+# enough in the following layers)
+__REDUCED_HEIGHT_RATIO = 2
+
+# Corners of the squares of the cropped board, sorted by column and then
+# by row (i.e., the corner in column i and row j is the (9i + j)-th one)
+__SQUARE_CORNERS = (
+    np.float32(np.stack(np.mgrid[0:9, 0:9], axis=2)).reshape(-1, 1, 2)
+    * BOARD_LENGTH
+    / 8
+)
+
+
+def __original_transform(point_list):
+    """Compute the transform from a cropped image to the original image.
+
+    :param point_list: List of the relative points.
+
+    The relative points are in the sequence of image transformations
+    done in each layer.
+
+    :return: Transform from the image cropped by the last points of
+    `point_list` to the original image.
+    """
+    transform = np.identity(3)
+    for points in point_list:
+        # The transform of each layer is obtained directly in the
+        # inverse direction, so no matrix is inverted
+        transform = transform @ cv2.getPerspectiveTransform(
+            BOARD_FRAME, np.float32(points)
+        )
+    return transform
+
+
 def __original_points_coords(point_list):
     """Detect the coordinates of the board in the original image.
 
@@ -27,61 +98,73 @@ def __original_points_coords(point_list):
     chessboard squares as a pair of `board_corners` and
     `square_corners`.
     """
-    ptslims = np.float32([[0, 0], [1200, 0], [1200, 1200], [0, 1200]])
-    last_index = len(point_list) - 1
-
-    # Compute all of the transformation matrixes
-    transf_mats = []
-    for i in range(last_index):
-        transf_mat = cv2.getPerspectiveTransform(
-            np.float32(point_list[i]), ptslims
-        )
-        cv2.invert(transf_mat, transf_mat)
-        transf_mats.append(transf_mat)
+    # The corners are given in the image cropped by the previous layers
+    transform = __original_transform(point_list[:-1])
+    board_corners = cv2.perspectiveTransform(
+        np.float32(point_list[-1]).reshape(-1, 1, 2), transform
+    )
+    square_corners = cv2.perspectiveTransform(
+        __SQUARE_CORNERS,
+        transform @ __original_transform(point_list[-1:]),
+    )
+    return (
+        np.int32(board_corners.reshape(-1, 2)),
+        np.int32(square_corners.reshape(-1, 2)),
+    )
 
-    # Multiply into an equivalent single transformation matrix
-    transf_mat = transf_mats[0]
-    for i in range(1, last_index):
-        transf_mat = transf_mat.dot(transf_mats[i])
 
-    # Transform the actual corner points
-    transf_points = cv2.perspectiveTransform(
-        np.float32(point_list[last_index]).reshape(-1, 1, 2), transf_mat
-    )
+def __layer_confidence(image, points, four_points):
+    """Compute the confidence in the board found in a layer.
 
-    board_corners = np.int32(
-        [transf_points[i][0] for i in range(len(transf_points))]
-    )
+    :param image: ImageObject already cropped by the layer.
 
-    # Now obtain the corners of each square in the chessboard
-    # To do so we need also the last transformation matrix
-    last_transf_mat = cv2.getPerspectiveTransform(
-        np.float32(point_list[last_index]), ptslims
-    )
-    cv2.invert(last_transf_mat, last_transf_mat)
-    transf_mat = transf_mat.dot(last_transf_mat)
+    :param points: Lattice points found in the layer.
 
-    # Generate the corners of the squares as if the board were of size
-    # 1200x1200
-    corners = []
-    for row_corner in range(0, 1200 + 150, 150):
-        for col_corner in range(0, 1200 + 150, 150):
-            corners.append([row_corner, col_corner])
+    :param four_points: Four corners of the board found in the layer.
 
-    # Transform the corners of the squares
-    square_corners = cv2.perspectiveTransform(
-        np.float32(corners).reshape(-1, 1, 2), transf_mat
+    :return: A pair formed by the fraction of the 49 interior lattice
+    points of the board that were found in the layer and the largest
+    displacement (in board squares) of the board corners with respect
+    to the board of the previous layer (`None` for the first layer).
+    """
+    square = BOARD_LENGTH / 8
+    grid = np.float32(
+        [[square * i, square * j] for i in range(1, 8) for j in range(1, 8)]
     )
 
-    square_corners = np.int32(
-        [square_corners[i][0] for i in range(len(square_corners))]
-    )
+    fraction = 0
+    if len(points) > 0:
+        # Lattice points in the coordinates of the new cropped image
+        points = cv2.perspectiveTransform(
+            np.float32(points).reshape(-1, 1, 2), board_transform(four_points)
+        ).reshape(-1, 2)
+        dists = np.linalg.norm(grid[:, None] - points[None], axis=2)
+        found = np.min(dists, axis=1) <= __LATTICE_POINT_TOLERANCE * square
+        fraction = np.count_nonzero(found) / len(grid)
+
+    displacement = None
+    if len(image.get_points()) > 1:
+        # The new corners are given in the previous cropped image
+        corners = np.float32(image.get_points()[-1])
+        displacement = (
+            np.max(np.linalg.norm(corners - BOARD_FRAME, axis=1)) / square
+        )
 
-    return board_corners, square_corners
+    return fraction, displacement
+
+
+def __layer(img, height=500, next_height=500):
+    """Execute one layer (iteration) on the given image.
+
+    :param img: ImageObject whose last downscaled image is searched.
 
+    :param height: Normalized side of the searched image.
 
-def __layer(img):
-    """Execute one layer (iteration) on the given image."""
+    :param next_height: Normalized side of the image of the next layer.
+
+    :return: Confidence in the board found, as returned by
+    `__layer_confidence()`.
+    """
     # Step 1 --- Straight line detector
     lines = slid(img["main"])
 
@@ -89,23 +172,161 @@ def __layer(img):
     points = laps(img["main"], lines)
 
     # Step 3 --- Chessboard position search
-    four_points = cps(img["main"], points, lines)
+    # (the border around the board scales with the searched image)
+    four_points = cps(img["main"], points, lines, 60 * height / 500)
 
     # Crop the image for the next step
-    img.crop(four_points)
+    img.crop(four_points, next_height)
+
+    return __layer_confidence(img, points, four_points)
+
+
+def __read(images, path, factor, grayscale=False):
+    """Return the input image reduced by the given factor.
+
+    :param images: Dictionary of the input images obtained so far, by
+    reduction factor and whether they are in grayscale.
+
+    :param path: Path to the input image (`None` if it is only given as
+    an array, which is never reduced).
+
+    :param factor: Reduction factor.
+
+    :param grayscale: Whether to return the image in grayscale.
+
+    :return: The reduced input image, which is obtained and saved in
+    `images` if it was not obtained yet.
+    """
+    if (factor, grayscale) not in images:
+        if path is None:
+            images[factor, grayscale] = cv2.cvtColor(
+                images[factor, False], cv2.COLOR_BGR2GRAY
+            )
+        else:
+            images[factor, grayscale] = image_read(path, factor, grayscale)
+    return images[factor, grayscale]
+
+
+def __roi(board_corners, padding, shape):
+    """Return a padded bounding box of the board corners.
+
+    :param board_corners: List of coordinates of the four board corners.
+
+    :param padding: Padding of each side of the box.
+
+        It is given as a fraction of the largest side of the box.
+
+    :param shape: Shape of the input image.
+
+    :return: The box as `(x0, y0, x1, y1)` clipped to the input image or
+    `None` if it covers the whole image.
+    """
+    corners = np.float32(board_corners)
+    (x0, y0), (x1, y1) = np.min(corners, axis=0), np.max(corners, axis=0)
+    pad = padding * max(x1 - x0, y1 - y0)
+    roi = (
+        max(math.floor(x0 - pad), 0),
+        max(math.floor(y0 - pad), 0),
+        min(math.ceil(x1 + pad), shape[1]),
+        min(math.ceil(y1 + pad), shape[0]),
+    )
+    if roi == (0, 0, shape[1], shape[0]):
+        return None
+    return roi
+
+
+def __has_converged(fraction, displacement):
+    """Return whether a layer converged given its confidence.
+
+    :param fraction: Fraction of interior lattice points found in the
+    layer (see `__layer_confidence()`).
+
+    :param displacement: Displacement of the board corners in the layer
+    (see `__layer_confidence()`).
+    """
+    return fraction >= __CONVERGENCE_LATTICE_FRACTION or (
+        displacement is not None and displacement <= __CONVERGENCE_DISPLACEMENT
+    )
+
+
+def __layers(image, heights, min_layers, max_layers, first_layer=0):
+    """Execute the layers of the detection on the given image.
+
+    :param image: ImageObject of the input image.
+
+    :param heights: Normalized side of the image of each layer.
+
+    :param min_layers: Minimum number of layers of the detection.
+
+    :param max_layers: Maximum number of layers of the detection.
+
+    :param first_layer: Index of the first layer to execute.
+
+        The previous layers must have already been executed on `image`.
+
+    :return: Fraction of interior lattice points of the board found in
+    the last layer executed (see `__layer_confidence()`), or `None` if
+    no layer is executed.
+    """
+    fraction = None
+    for i in range(first_layer, max_layers):
+        fraction, displacement = __layer(image, heights[i], heights[i + 1])
+        if debug.enabled():
+            debug.DebugImage(image["orig"]).save(f"end_iteration{i}")
+
+        if i + 1 >= min_layers and __has_converged(fraction, displacement):
+            break
+    return fraction
+
+
+def __open(input_image):
+    """Prepare the input image of the detection to be read.
+
+    :param input_image: Input chessboard image or path to it.
+
+    :return: A tuple formed by the path to the input image (`None` if it
+    is only given as an array), its shape, the dictionary of the input
+    images obtained so far (see `__read()`), and the max. reduction
+    factor of the input image.
+    """
+    path = None
+    if isinstance(input_image, str):
+        path, shape = input_image, image_shape(input_image)
+        if shape is None:
+            # Only JPEG images are decoded reduced
+            path, input_image = None, image_read(input_image)
+    if path is None:
+        return None, np.shape(input_image), {(1, False): input_image}, 1
+    return path, shape, {}, max(REDUCED_FLAGS)
+
+
+def __heights(layer_heights, max_layers):
+    """Return the normalized side of the image of each layer."""
+    return [
+        layer_heights[min(i, len(layer_heights) - 1)]
+        for i in range(max_layers + 1)
+    ]
 
 
 def detect(
-    input_image: np.ndarray,
+    input_image: (np.ndarray | str),
     output_board: str,
     board_corners: (list[list[int]] | None) = None,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: tuple[int, ...] = LAYER_HEIGHTS,
+    roi_paddings: tuple[float, ...] = (0.25, 1),
 ):
     """Detect the board position and store the cropped detected board.
 
     This function detects the board position in `input_image` and stores
     the cropped detected board in `output_board`.
 
-    :param input_image: Input chessboard image.
+    :param input_image: Input chessboard image or path to it.
+
+        If it is a path to a JPEG image, the image is decoded only as
+        finely as needed: at reduced size for the search and again for
+        the final board (see `ImageObject`).
 
     :param output_board: Output path for the detected-board image.
 
@@ -116,32 +337,199 @@ def detect(
         If it is not None, first check if the board is in the position
         given by these corners. If not, runs the full detection.
 
+    :param min_layers: Minimum number of layers of the detection.
+
+    :param max_layers: Maximum number of layers of the detection.
+
+        Between these two values, the detection stops as soon as a
+        layer converges, i.e., when most of the interior lattice points
+        of the board are found where they should be or when the board
+        corners barely move with respect to the previous layer.
+
+    :param layer_heights: Normalized side of the image of each layer.
+
+        The last value is used for the remaining layers. For instance,
+        `(250, 500)` finds an approximate board at 250x250 pixels and
+        then refines it at 500x500 pixels, which is less work than
+        searching the whole image at 500x500 pixels.
+
+    :param roi_paddings: Paddings of the regions of interest.
+
+        If `board_corners` is not None and the board is not in their
+        position, the detection first searches only the bounding box of
+        the corners padded by each of these fractions of its side in
+        turn. The region is only expanded (and, finally, the whole
+        image searched) when the detection fails to find a board in it
+        or the board found is implausible (i.e., few of its interior
+        lattice points are found). Otherwise, the board found in the
+        region is kept even if the detection did not converge.
+
     :return: Final ImageObject with which to compute the corners if
     necessary.
+
+        Its images are already freed unless debugging is enabled.
     """
+    path, shape, images, max_factor = __open(input_image)
+
     # Check if we can skip full board detection (if board position is
     # already known)
+    rois = [None]
     if board_corners is not None:
-        found, cropped_img = check_board_position(input_image, board_corners)
+        # The image is decoded finely enough for the cropped board
+        factor = reduction_factor(
+            quad_side(board_corners), BOARD_LENGTH, max_factor
+        )
+        img = __read(images, path, factor)
+        found, cropped_img = check_board_position(
+            img, np.float32(board_corners) / factor
+        )
         if found:
             cv2.imwrite(output_board, cropped_img)
-            image = ImageObject(input_image)
+            image = ImageObject(path=path, color=images.get((1, False)))
             # For corners calculation
-            image.add_points([[0, 0], [1200, 0], [1200, 1200], [0, 1200]])
+            image.add_points(BOARD_FRAME.tolist())
             image.add_points(board_corners)
+            if not debug.enabled():
+                image.release()
             return image
 
+        rois = [
+            __roi(board_corners, padding, shape) for padding in roi_paddings
+        ]
+        rois = [roi for roi in rois if roi is not None] + [None]
+
     # Read the input image and store the cropped detected board
-    n_layers = 3
-    image = ImageObject(input_image)
-    for i in range(n_layers):
-        __layer(image)
-        debug.DebugImage(image["orig"]).save(f"end_iteration{i}")
+    heights = __heights(layer_heights, max_layers)
+    best = None
+    for roi in rois:
+        # The image is decoded finely enough for the largest layer
+        x0, y0, x1, y1 = roi or (0, 0, shape[1], shape[0])
+        factor = reduction_factor(
+            math.sqrt((x1 - x0) * (y1 - y0)),
+            __REDUCED_HEIGHT_RATIO * max(heights),
+            max_factor,
+        )
+        image = ImageObject(
+            __read(images, path, factor, True),
+            heights[0],
+            path,
+            factor,
+            roi,
+            images.get((1, False)),
+        )
+        try:
+            fraction = __layers(image, heights, min_layers, max_layers)
+        except (ValueError, ZeroDivisionError, cv2.error):
+            # We search the next region if no board is found in this one
+            # (and only fail if no board is found in any region)
+            if roi is None and best is None:
+                raise
+            continue
+        if best is None or fraction > best[0]:
+            best = fraction, image
+
+        # We only search a larger region if the board found in this one
+        # is implausible
+        if fraction >= __ROI_LATTICE_FRACTION:
+            break
+    image = best[1]
     cv2.imwrite(output_board, image["orig"])
 
+    # Only the points are needed from now on (and the first image, for
+    # debugging)
+    if not debug.enabled():
+        image.release()
+
     return image
 
 
+def detect_boards(
+    input_image: (np.ndarray | str),
+    output_boards: list[str],
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: tuple[int, ...] = BOARDS_LAYER_HEIGHTS,
+):
+    """Detect several boards and store the cropped detected boards.
+
+    This function detects up to `len(output_boards)` non-overlapping
+    boards in `input_image` and stores each cropped detected board in
+    its output path.
+
+    The straight lines and lattice points of the first layer are only
+    searched once, in the whole input image, and all of the boards are
+    found among them (see `cps_boards()`). Each board is then refined on
+    its own in the following layers, as in `detect()`.
+
+    :param input_image: Input image or path to it (see `detect()`).
+
+    :param output_boards: Output paths for the detected-board images.
+
+        These paths must include both the name and extension. The i-th
+        detected board is stored in the i-th path.
+
+    :param min_layers: Minimum number of layers of the detection.
+
+    :param max_layers: Maximum number of layers of the detection.
+
+    :param layer_heights: Normalized side of the image of each layer.
+
+        Since each board covers only a part of the searched image in
+        the first layer, the first layer is searched at a larger side
+        than in `detect()` by default.
+
+    :return: List of the final ImageObjects of the detected boards,
+    ranked by score, with which to compute their corners if necessary.
+
+        Their images are already freed unless debugging is enabled.
+    """
+    path, shape, images, max_factor = __open(input_image)
+
+    # The image is decoded finely enough for the largest layer
+    heights = __heights(layer_heights, max_layers)
+    factor = reduction_factor(
+        math.sqrt(shape[0] * shape[1]),
+        __REDUCED_HEIGHT_RATIO * max(heights),
+        max_factor,
+    )
+    image = ImageObject(
+        __read(images, path, factor, True),
+        heights[0],
+        path,
+        factor,
+        None,
+        images.get((1, False)),
+    )
+
+    # Steps 1 and 2 run once for all of the boards
+    lines = slid(image["main"])
+    points = laps(image["main"], lines)
+    boards_points = cps_boards(
+        image["main"], points, lines, 60 * heights[0] / 500, len(output_boards)
+    )
+
+    boards = []
+    for four_points, output_board in zip(boards_points, output_boards):
+        board = image.copy()
+        board.crop(four_points, heights[1])
+        if debug.enabled():
+            debug.DebugImage(board["orig"]).save("end_iteration0")
+        if not (
+            min_layers <= 1
+            and __has_converged(
+                *__layer_confidence(board, points, four_points)
+            )
+        ):
+            __layers(board, heights, min_layers, max_layers, 1)
+        cv2.imwrite(output_board, board["orig"])
+
+        if not debug.enabled():
+            board.release()
+        boards.append(board)
+
+    return boards
+
+
 def compute_corners(image_object):
     """Compute the coordinates of the board in the original image.
 
@@ -158,8 +546,11 @@ def compute_corners(image_object):
         image_object.get_points()
     )
 
-    debug.DebugImage(image_object.get_images()[0]["orig"]).points(
-        square_corners, size=50, color=(0, 0, 255)
-    ).points(board_corners, size=50, color=(0, 255, 0)).save("corner_points")
+    if debug.enabled():
+        debug.DebugImage(image_object.get_source()).points(
+            square_corners, size=50, color=(0, 0, 255)
+        ).points(board_corners, size=50, color=(0, 255, 0)).save(
+            "corner_points"
+        )
 
     return board_corners, square_corners
@@ -1,40 +1,175 @@
 """This module is responsible for iteratively finding a chessboard."""
 
 
+import copy
 import math
 
 import cv2
 import numpy as np
 
 
+BOARD_LENGTH = 1200  # Side of the cropped board images
+
+# Corners of the cropped board images
+BOARD_FRAME = np.float32(
+    [
+        [0, 0],
+        [BOARD_LENGTH, 0],
+        [BOARD_LENGTH, BOARD_LENGTH],
+        [0, BOARD_LENGTH],
+    ]
+)
+
+# Flags to decode JPEG images reduced by each factor
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Markers of the JPEG frame headers, which contain the image size
+__JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+__JPEG_APP1_MARKER = 0xE1  # Marker of the segment with the Exif data
+
+# Exif orientations that transpose the image (see
+# `__exif_orientation()`)
+__TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
 def image_scale(pts, scale):
     """Scale to original image size."""
     return [[x / scale, y / scale] for (x, y) in pts]
 
 
+def resize_scale(shape, height: int = 500):
+    """Return the scale that normalizes the area to height**2."""
+    return math.sqrt((height * height) / (shape[0] * shape[1]))
+
+
 def image_resize(img: np.ndarray, height: int = 500):
     """Resize image to same normalized area (height**2)."""
     shape = np.shape(img)
-    scale = math.sqrt((height * height) / (shape[0] * shape[1]))
+    scale = resize_scale(shape, height)
     img = cv2.resize(img, (int(shape[1] * scale), int(shape[0] * scale)))
     return img, shape, scale
 
 
+def __exif_orientation(segment: bytes) -> int:
+    """Return the orientation tag of a JPEG APP1 segment.
+
+    :param segment: Data of the segment (without its marker and
+    length).
+
+    :return: The orientation (from 1 to 8) given in the first IFD of the
+    Exif data, or 1 (the image is not rotated) if there is none.
+    """
+    if segment[:6] != b"Exif\x00\x00":
+        return 1
+    tiff = segment[6:]
+    byteorder = {b"II": "little", b"MM": "big"}.get(tiff[:2])
+    if byteorder is None:
+        return 1
+
+    def uint(start, size):
+        return int.from_bytes(tiff[start : start + size], byteorder)
+
+    ifd = uint(4, 4)
+    for entry in range(ifd + 2, ifd + 2 + 12 * uint(ifd, 2), 12):
+        if entry + 12 > len(tiff):
+            break
+        if uint(entry, 2) == 0x0112:  # Orientation tag (a short)
+            return uint(entry + 8, 2)
+    return 1
+
+
+def image_shape(path: str):
+    """Read the shape of a JPEG image from its header.
+
+    The shape is that of the image as decoded by `cv2.imread()`, which
+    rotates the image as given by its Exif orientation.
+
+    :return: The (height, width) of the image or `None` if it is not a
+    JPEG image.
+    """
+    orientation = 1
+    with open(path, "rb") as file:
+        if file.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            length = int.from_bytes(file.read(2), "big")
+            if marker[1] in __JPEG_SOF_MARKERS:
+                header = file.read(5)
+                shape = (
+                    int.from_bytes(header[1:3], "big"),
+                    int.from_bytes(header[3:5], "big"),
+                )
+                if orientation in __TRANSPOSED_ORIENTATIONS:
+                    return shape[::-1]
+                return shape
+            if marker[1] == __JPEG_APP1_MARKER and orientation == 1:
+                orientation = __exif_orientation(file.read(length - 2))
+            else:
+                file.seek(length - 2, 1)
+
+
+def reduction_factor(length, min_length, max_factor: int = 8):
+    """Return the largest factor that keeps a length above a minimum.
+
+    :param length: Length in the full-size image.
+
+    :param min_length: Min. length in the reduced image.
+
+    :param max_factor: Max. factor returned.
+
+    :return: Largest of the factors in `REDUCED_FLAGS` (and not larger
+    than `max_factor`) by which `length` can be reduced without falling
+    below `min_length`, or 1 if there is no such factor.
+    """
+    factors = [
+        factor
+        for factor in REDUCED_FLAGS
+        if factor <= max_factor and length / factor >= min_length
+    ]
+    return max(factors, default=1)
+
+
+def image_read(path: str, factor: int = 1, grayscale: bool = False):
+    """Read an image reduced by the given factor.
+
+    JPEG images are decoded directly at 1/2, 1/4, or 1/8 of their size,
+    which is much faster than decoding them at full size. Decoding them
+    in grayscale is faster still, since the color is not decoded.
+    """
+    if grayscale:
+        return cv2.imread(path, REDUCED_GRAYSCALE_FLAGS[factor])
+    return cv2.imread(path, REDUCED_FLAGS[factor])
+
+
+def quad_side(points):
+    """Return the length of the shortest side of a quadrilateral."""
+    points = np.float32(points)
+    return np.min(np.linalg.norm(points - np.roll(points, 1, 0), axis=1))
+
+
+def board_transform(points):
+    """Return the perspective transform that crops the board."""
+    return cv2.getPerspectiveTransform(np.float32(points), BOARD_FRAME)
+
+
 def image_transform(img: np.ndarray, points):
     """Crop original image using perspective warp."""
-    board_length = 1200
-
-    pts1 = np.float32(points)
-    pts2 = np.float32(
-        [
-            [0, 0],
-            [board_length, 0],
-            [board_length, board_length],
-            [0, board_length],
-        ]
-    )
-    mat = cv2.getPerspectiveTransform(pts1, pts2)
-    return cv2.warpPerspective(img, mat, (board_length, board_length))
+    mat = board_transform(points)
+    return cv2.warpPerspective(img, mat, (BOARD_LENGTH, BOARD_LENGTH))
 
 
 class ImageObject:
@@ -42,56 +177,182 @@ class ImageObject:
 
     This class represents an image object in the iterative process of
     finding a chessboard.
+
+    The search runs on grayscale images: only the full-size images are
+    in color, and they are warped from the first image in color.
+
+    Only the first (source) image and the images of the current
+    iteration are kept. The images of each iteration are warped directly
+    from the first image with the composition of the transforms of all
+    of the previous iterations: the downscaled image when the iteration
+    is added and the full-size image only when it is first used. Apart
+    from them, only the points found in each iteration are kept, which
+    is all that `compute_corners()` needs.
+
+    When the first image is given reduced together with its path (see
+    `image_read()`), it is decoded again only when a full-size image is
+    first used, i.e., for the final board, and only as finely as that
+    image needs. All of the points and transforms are still given in
+    full-size coordinates.
     """
 
-    def __init__(self, img: (np.ndarray | None) = None):
-        """Save and prepare image array."""
-        # We save the whole sequence of transformations attribute[i] is
-        # the attribute of iteration i, with iteration 0 being the first
-        # one
+    def __init__(
+        self,
+        img: (np.ndarray | None) = None,
+        height: int = 500,
+        path: (str | None) = None,
+        reduction: int = 1,
+        roi: (tuple[int, int, int, int] | None) = None,
+        color: (np.ndarray | None) = None,
+    ):
+        """Save and prepare image array.
+
+        :param img: First (source) image in grayscale.
+
+        :param height: Normalized side of the downscaled image.
+
+        :param path: Path to the first image.
+
+            It is only needed if `img` is reduced.
+
+        :param reduction: Factor by which `img` is reduced.
+
+        :param roi: Region of interest of the first image.
+
+            If it is not None, only this region, given as `(x0, y0, x1,
+            y1)` in full-size coordinates, is downscaled and searched in
+            the first iteration.
+
+        :param color: First image at full size in color.
+
+            If it is None, it is read from `path` when it is needed.
+        """
         self.points = []  # Points of the new cropped image for next iteration
-        self.images = []
-        self.shape = []  # (0, 0)
-        self.scale = []  # 1
+        self.iteration = 0
+        self.images = {}  # Images of the current iteration
+        self.scale = 1  # Scale of the current downscaled image
+        self.transform = np.identity(3)  # Transform from first image
+        self.path = path
+        self.reduction = reduction
+        self.offset = (0, 0)  # Position of the first downscaled image
+
+        # The downscaled images are warped from the (reduced) first
+        # image
+        self.source = img
+        self.full_source = color
         if img is not None:
-            # Downscale for speed
-            downscaled_img_, shape_, scale_ = image_resize(img)
+            if roi is not None:
+                x0, y0 = roi[0] // reduction, roi[1] // reduction
+                x1, y1 = -(-roi[2] // reduction), -(-roi[3] // reduction)
+                img = img[y0:y1, x0:x1]
+                self.offset = (x0 * reduction, y0 * reduction)
 
-            self.images.append({"orig": img, "main": downscaled_img_})
-            self.shape.append(shape_)  # (0, 0)
-            self.scale.append(scale_)  # 1
+            # Downscale for speed
+            self.images["main"], _, scale_ = image_resize(img, height)
+            self.scale = scale_ / reduction
 
     def __getitem__(self, attr):
         """Return last image as array."""
-        return self.images[-1][attr]
+        if attr == "orig" and "orig" not in self.images:
+            if self.iteration == 0:
+                self.images["orig"] = self.get_source()
+            else:
+                source, transform = self.__warp_source(self.transform)
+                self.images["orig"] = cv2.warpPerspective(
+                    source, transform, (BOARD_LENGTH, BOARD_LENGTH)
+                )
+        return self.images[attr]
+
+    def __warp_source(self, transform):
+        """Return the image from which to warp a full-size image.
+
+        The first image is decoded reduced by the largest factor that
+        still samples the cropped region at least as finely as the
+        full-size cropped image does, so it is only decoded at full size
+        when the cropped region is small.
+
+        :param transform: Transform from the full-size first image.
+
+        :return: A pair formed by the image and the transform from it.
+        """
+        if self.reduction > 1 and self.full_source is None:
+            corners = cv2.perspectiveTransform(
+                BOARD_FRAME.reshape(-1, 1, 2), np.linalg.inv(transform)
+            )
+            factor = reduction_factor(
+                quad_side(corners.reshape(-1, 2)), BOARD_LENGTH, self.reduction
+            )
+            if factor > 1:
+                return (
+                    image_read(self.path, factor),
+                    transform @ np.diag([factor, factor, 1]),
+                )
+        return self.get_source(), transform
 
     def __setitem__(self, attr, val):
         """Save image to object as last image."""
-        self.images[-1][attr] = val
+        self.images[attr] = val
+
+    def crop(self, pts, height: int = 500):
+        """Crop using 4 points transform.
 
-    def add_image(self, img: np.ndarray):
-        """Add a new image in the iteration."""
-        # Downscale for speed
-        downscaled_img_, shape_, scale_ = image_resize(img)
+        The images of the previous iteration are freed.
 
-        self.images.append({"orig": img, "main": downscaled_img_})
-        self.shape.append(shape_)
-        self.scale.append(scale_)
+        :param pts: Four points of the last downscaled image to crop.
 
-    def crop(self, pts):
-        """Crop using 4 points transform."""
-        pts_orig = image_scale(pts, self.scale[-1])
-        img_crop = image_transform(self.images[-1]["orig"], pts_orig)
+        :param height: Normalized side of the new downscaled image.
+        """
+        pts_orig = image_scale(pts, self.scale)
+        if self.iteration == 0:
+            pts_orig = [
+                [x + self.offset[0], y + self.offset[1]] for (x, y) in pts_orig
+            ]
         self.points.append(pts_orig)
-        self.add_image(img_crop)
+        self.transform = board_transform(pts_orig) @ self.transform
+        self.iteration += 1
+
+        # The (downscaled) cropped image is warped from the first image
+        self.scale = resize_scale((BOARD_LENGTH, BOARD_LENGTH), height)
+        size = int(BOARD_LENGTH * self.scale)
+        self.images = {
+            "main": cv2.warpPerspective(
+                self.source,
+                np.diag([self.scale, self.scale, 1])
+                @ self.transform
+                @ np.diag([self.reduction, self.reduction, 1]),
+                (size, size),
+            )
+        }
+
+    def copy(self):
+        """Return a copy that can be cropped on its own.
+
+        The images are shared with the copy, since they are never
+        modified, but the points found from now on are not.
+        """
+        image = copy.copy(self)
+        image.points = list(self.points)
+        return image
+
+    def release(self):
+        """Free all of the images, keeping only the points."""
+        self.images = {}
+        self.source = None
+        self.full_source = None
 
     def add_points(self, points):
         """Add points to the point list."""
         self.points.append(points)
 
-    def get_images(self):
-        """Return images list."""
-        return self.images
+    def get_source(self):
+        """Return the first image at full size in color.
+
+        :return: The first image or `None` if it was released and it
+        cannot be read again from its path.
+        """
+        if self.full_source is None and self.path is not None:
+            self.full_source = image_read(self.path)
+        return self.full_source
 
     def get_points(self):
         """Return points list."""
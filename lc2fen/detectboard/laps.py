@@ -1,13 +1,12 @@
 """This is the lattice-points-search module."""
 
 
-import collections
-
 import cv2
 import numpy as np
 import onnxruntime
-from scipy.cluster.hierarchy import single, fcluster
-from scipy.spatial.distance import pdist
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
 from lc2fen.detectboard import debug, image_object
 from lc2fen.detectboard import poly_point_isect
@@ -27,33 +26,47 @@ def __find_intersections(lines):
 
 
 def __cluster_points(points, max_dist=10):
-    """Cluster very similar points."""
-    link_matrix = single(pdist(points))
-    cluster_ids = fcluster(link_matrix, max_dist, "distance")
-
-    clusters = collections.defaultdict(list)
-    for i, cluster_id in enumerate(cluster_ids):
-        clusters[cluster_id].append(points[i])
-    clusters = clusters.values()
-    # If two points are close, they become one mean point
-    clusters = map(
-        lambda arr: (
-            np.mean(np.array(arr)[:, 0]),
-            np.mean(np.array(arr)[:, 1]),
-        ),
-        clusters,
+    """Cluster very similar points.
+
+    Two points end up in the same cluster if they are linked by a chain
+    of points in which every step is at most `max_dist` long (i.e., a
+    single-linkage clustering cut at `max_dist`). Only the neighboring
+    pairs found by a KD-tree are considered, so neither time nor memory
+    grows quadratically with the number of points.
+    """
+    points = np.array(points, dtype=np.float64)
+    pairs = cKDTree(points).query_pairs(max_dist, output_type="ndarray")
+    adjacency = coo_matrix(
+        (np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])),
+        shape=(len(points), len(points)),
     )
-    return list(clusters)
+    _, cluster_ids = connected_components(adjacency, directed=False)
 
+    # Keep the clusters in the order of their first point
+    _, first_idx = np.unique(cluster_ids, return_index=True)
+    order = cluster_ids[np.sort(first_idx)]
 
-def __is_lattice_point(img):
-    """Determine if a point is a lattice point."""
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # If two points are close, they become one mean point
+    sums = np.zeros((len(first_idx), 2))
+    np.add.at(sums, cluster_ids, points)
+    counts = np.bincount(cluster_ids)
+    means = sums[order] / counts[order, np.newaxis]
+    return [(x, y) for x, y in means]
+
+
+def __lattice_point_edges(img):
+    """Compute the 21x21 edge image analyzed by the detectors."""
     img = cv2.threshold(img, 0, 255, cv2.THRESH_OTSU)[1]
     img = cv2.Canny(img, 0, 255)
-    img = cv2.resize(img, (21, 21), interpolation=cv2.INTER_CUBIC)
+    return cv2.resize(img, (21, 21), interpolation=cv2.INTER_CUBIC)
 
-    # Geometric detector to filter easy points
+
+def __is_geometric_lattice_point(img):
+    """Determine if an edge image is a lattice point geometrically.
+
+    This geometric detector only filters the easy points: if it returns
+    `False`, the point must still be checked by the neural detector.
+    """
     img_geo = cv2.dilate(img, None)
     mask = cv2.copyMakeBorder(
         img_geo,
@@ -81,22 +94,44 @@ def __is_lattice_point(img):
         else:
             cv2.drawContours(_c, [cnt], 0, (0, 0, 255), 1)
 
-    if num_rhomboid == 4:
-        return True
+    return num_rhomboid == 4
 
-    # Neural detector if unable to decide using the geometric detector
-    X = [np.where(img > int(255 / 2), 1, 0).ravel()]
-    X = X[0].reshape([-1, 21, 21, 1]).astype("float32")
 
-    pred = __LAPS_SESS.run(None, {__LAPS_SESS.get_inputs()[0].name: X})[0][0]
+def __are_neural_lattice_points(imgs):
+    """Determine which edge images are lattice points with the network.
+
+    All of the images are evaluated in a single inference call.
+
+    :param imgs: List of edge images.
+
+    :return: Boolean array with one element per image.
+    """
+    X = np.where(np.array(imgs) > int(255 / 2), 1, 0)
+    X = X.reshape([-1, 21, 21, 1]).astype("float32")
+
+    pred = __LAPS_SESS.run(None, {__LAPS_SESS.get_inputs()[0].name: X})[0]
+
+    return (
+        (pred[:, 0] > pred[:, 1]) & (pred[:, 1] < 0.03) & (pred[:, 0] > 0.975)
+    )
+
+
+def __is_lattice_point(img):
+    """Determine if a point is a lattice point."""
+    img = __lattice_point_edges(img)
+
+    # Geometric detector to filter easy points
+    if __is_geometric_lattice_point(img):
+        return True
 
-    return pred[0] > pred[1] and pred[1] < 0.03 and pred[0] > 0.975
+    # Neural detector if unable to decide using the geometric detector
+    return bool(__are_neural_lattice_points([img])[0])
 
 
 def laps(img: np.ndarray, lines):
     """Search for the lattice points in the given image.
 
-    :param img: Image to search.
+    :param img: Image to search (in grayscale).
 
     :param lines: Lines detected by slid.
 
@@ -104,9 +139,10 @@ def laps(img: np.ndarray, lines):
     """
     intersection_points = __find_intersections(lines)
 
-    debug.DebugImage(img).lines(lines, color=(0, 0, 255)).points(
-        intersection_points, color=(255, 0, 0), size=2
-    ).save("laps_in_queue")
+    if debug.enabled():
+        debug.DebugImage(img).lines(lines, color=(0, 0, 255)).points(
+            intersection_points, color=(255, 0, 0), size=2
+        ).save("laps_in_queue")
 
     points = []
     for pt in intersection_points:
@@ -139,9 +175,10 @@ def laps(img: np.ndarray, lines):
     if points:
         points = __cluster_points(points)
 
-    debug.DebugImage(img).points(
-        intersection_points, color=(0, 0, 255), size=3
-    ).points(points, color=(0, 255, 0)).save("laps_good_points")
+    if debug.enabled():
+        debug.DebugImage(img).points(
+            intersection_points, color=(0, 0, 255), size=3
+        ).points(points, color=(0, 255, 0)).save("laps_good_points")
 
     return points
 
@@ -151,7 +188,7 @@ def check_board_position(
 ):
     """Check if chessboard is in position given by the board corners.
 
-    :param img: Image to check.
+    :param img: Image to check (in color).
 
     :param board_corners: List of the coordinates of four board corners.
 
@@ -163,26 +200,47 @@ def check_board_position(
     # We will check the interior 6x6 square grid lattice points of the
     # cropped 500x500 image, as done by LAPS
     cropped_img = image_object.image_transform(img, board_corners)
+    gray_img = cv2.cvtColor(cropped_img, cv2.COLOR_BGR2GRAY)
 
+    lattice_points = [
+        (row_corner, col_corner)
+        for row_corner in range(150, 1200, 150)
+        for col_corner in range(150, 1200, 150)
+    ]
+
+    # The geometric detector runs first and we stop as soon as the
+    # result is known. The points it cannot decide are left for a
+    # single call to the neural detector
     correct_points = 0
-    for row_corner in range(150, 1200, 150):
-        for col_corner in range(150, 1200, 150):
-            # Size of our analysis area
-            lx1 = max(0, int(row_corner - __ANALYSIS_RADIUS - 1))
-            lx2 = max(0, int(row_corner + __ANALYSIS_RADIUS))
-            ly1 = max(0, int(col_corner - __ANALYSIS_RADIUS))
-            ly2 = max(0, int(col_corner + __ANALYSIS_RADIUS + 1))
-
-            # Cropping for detector
-            dimg = cropped_img[ly1:ly2, lx1:lx2]
-            dimg_shape = np.shape(dimg)
-
-            # Not valid
-            if dimg_shape[0] <= 0 or dimg_shape[1] <= 0:
-                continue
-
-            # Detect if it is a lattice point
-            if __is_lattice_point(dimg):
+    undecided = []
+    for i, (row_corner, col_corner) in enumerate(lattice_points):
+        # Size of our analysis area
+        lx1 = max(0, int(row_corner - __ANALYSIS_RADIUS - 1))
+        lx2 = max(0, int(row_corner + __ANALYSIS_RADIUS))
+        ly1 = max(0, int(col_corner - __ANALYSIS_RADIUS))
+        ly2 = max(0, int(col_corner + __ANALYSIS_RADIUS + 1))
+
+        # Cropping for detector
+        dimg = gray_img[ly1:ly2, lx1:lx2]
+        dimg_shape = np.shape(dimg)
+
+        # Valid
+        if dimg_shape[0] > 0 and dimg_shape[1] > 0:
+            edges = __lattice_point_edges(dimg)
+            if __is_geometric_lattice_point(edges):
                 correct_points += 1
+            else:
+                undecided.append(edges)
+
+        if correct_points >= tolerance:
+            return True, cropped_img
+        remaining = len(lattice_points) - i - 1
+        if correct_points + len(undecided) + remaining < tolerance:
+            return False, cropped_img
+
+    if undecided:
+        correct_points += np.count_nonzero(
+            __are_neural_lattice_points(undecided)
+        )
 
     return correct_points >= tolerance, cropped_img
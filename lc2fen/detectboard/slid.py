@@ -12,7 +12,7 @@ from lc2fen.detectboard import debug
 def __slid_segments(img):
     """Find all segments in the image using different settings.
 
-    :param img: Image to search.
+    :param img: Image to search (in grayscale).
 
     :return: A list of all the segments found.
     """
@@ -33,16 +33,17 @@ def __slid_segments(img):
         This function simplifies an image using the CLAHE algorithm
         (adaptive histogram equalization).
         """
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         for _ in range(iters):
             img = cv2.createCLAHE(clipLimit=limit, tileGridSize=grid).apply(
                 img
             )
-        debug.DebugImage(img).save("slid_clahe_@1")
+        if debug.enabled():
+            debug.DebugImage(img).save("slid_clahe_@1")
         if limit != 0:
             kernel = np.ones((10, 10), np.uint8)
             img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel)
-            debug.DebugImage(img).save("slid_clahe_@2")
+            if debug.enabled():
+                debug.DebugImage(img).save("slid_clahe_@2")
         return img
 
     def detect_lines(img):
@@ -80,9 +81,10 @@ def __slid_segments(img):
         __segments = detect_lines(detect_edges(tmp))
         segments += __segments
         i += 1
-        debug.DebugImage(detect_edges(tmp)).lines(__segments).save(
-            "pslid_F%d" % i
-        )
+        if debug.enabled():
+            debug.DebugImage(detect_edges(tmp)).lines(__segments).save(
+                "pslid_F%d" % i
+            )
     return segments
 
 
@@ -116,7 +118,7 @@ def __scale_lines(raw_lines) -> list:
 def slid(img):
     """Detect the straight lines in the given image from the segments.
 
-    :param img: Image to search.
+    :param img: Image to search (in grayscale).
 
     :return: List of the detected lines.
 
@@ -238,9 +240,12 @@ def slid(img):
         else:
             vh_segments[1].append(l)
 
-    debug.DebugImage(img.shape).lines(
-        vh_segments[0], color=debug.rand_color()
-    ).lines(vh_segments[1], color=debug.rand_color()).save("slid_pre_groups")
+    if debug.enabled():
+        debug.DebugImage(img.shape).lines(
+            vh_segments[0], color=debug.rand_color()
+        ).lines(vh_segments[1], color=debug.rand_color()).save(
+            "slid_pre_groups"
+        )
 
     for lines in vh_segments:
         for i in range(len(lines)):
@@ -257,7 +262,7 @@ def slid(img):
                 if similar_lines(l1, l2):
                     __un(h1, h2)
 
-    if debug.DEBUG:
+    if debug.enabled():
         __d = debug.DebugImage(img.shape)
         for i in group:
             if X[i] != i:
@@ -275,10 +280,11 @@ def slid(img):
 
     lines = __scale_lines(raw_lines)
 
-    debug.DebugImage(img.shape).points(
-        all_points, color=(0, 255, 0), size=2
-    ).lines(raw_lines).save("slid_raw_lines")
+    if debug.enabled():
+        debug.DebugImage(img.shape).points(
+            all_points, color=(0, 255, 0), size=2
+        ).lines(raw_lines).save("slid_raw_lines")
 
-    debug.DebugImage(img).lines(lines).save("slid_final")
+        debug.DebugImage(img).lines(lines).save("slid_final")
 
     return lines
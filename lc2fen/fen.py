@@ -1,8 +1,50 @@
-"""This module is responsible for FEN-related transformations."""
+"""This module is responsible for FEN-related transformations.
+
+Apart from the board matrices (lists of 8 lists of 8 pieces), the boards
+can be represented compactly as arrays of 64 bytes (see
+`fen_to_array()`), which is what the FEN strings are translated through.
+The board matrices are views of these arrays: they are built from them
+(see `array_to_board()`) and rotated with the same permutations of the
+squares.
+"""
+
+
+import collections
+import functools
+
+import chess
+import numpy as np
 
 
 PIECE_TYPES = ["r", "n", "b", "q", "k", "p", "P", "R", "N", "B", "Q", "K", "_"]
 
+# Whether each square is a light square (from a8 to h1)
+LIGHT_SQUARES = tuple((square // 8 + square) % 2 == 0 for square in range(64))
+_LIGHT_SQUARE_MASK = np.array(LIGHT_SQUARES)
+
+PARSED_FEN_CACHE_SIZE = 128  # Number of parsed FEN strings kept
+
+# Permutations of the squares (from a8 to h1) that rotate a board whose
+# a1 square is in the bottom-left corner so that it ends up in the
+# position of each key (see `rotate_board_from_standard_view()`), i.e.,
+# the i-th square of the rotated board is the `perm[i]`-th square of the
+# board, and the ones that rotate it back
+_ROWS, _COLS = np.divmod(np.arange(64), 8)
+FROM_STANDARD_VIEW = {
+    "BL": np.arange(64),
+    "BR": 8 * _COLS + 7 - _ROWS,  # Counterclockwise rotation
+    "TL": 8 * (7 - _COLS) + _ROWS,  # Clockwise rotation
+    "TR": 63 - np.arange(64),  # 180 degree rotation
+}
+TO_STANDARD_VIEW = {
+    a1_pos: np.argsort(perm) for a1_pos, perm in FROM_STANDARD_VIEW.items()
+}
+
+# Expansion of the digits of the FEN strings into empty squares, and
+# runs of empty squares (from the longest one) with their digits
+_FEN_DIGITS = [(str(n), "_" * n) for n in range(10)]
+_EMPTY_RUNS = [("_" * n, str(n)) for n in range(8, 0, -1)]
+
 
 def fen_to_board(fen: str) -> list[list[str]]:
     """Translate a FEN string to a board matrix.
@@ -15,24 +57,8 @@ def fen_to_board(fen: str) -> list[list[str]]:
 
     :return: Board matrix corresponding to the FEN string.
     """
-    rows = fen.split(sep="/")
-
-    if len(rows) != 8:
-        raise ValueError(f"fen must have 8 rows: {fen}")
-
-    board = []
-    for row in rows:
-        board_row = []
-        for char in row:
-            if char.isdigit():
-                board_row.extend(["_"] * int(char))
-            else:
-                board_row.append(char)
-        if len(board_row) != 8:
-            raise ValueError(f"Each fen row must have 8 positions: {fen}")
-        board.append(board_row)
-
-    return board
+    squares = _expand_fen(fen)
+    return [list(squares[ind : ind + 8]) for ind in range(0, 64, 8)]
 
 
 def board_to_fen(board: list[list[str]]) -> str:
@@ -45,27 +71,93 @@ def board_to_fen(board: list[list[str]]) -> str:
 
     :return: FEN string corresponding to the board matrix.
     """
-    fen = []
-    for row in board:
-        prev_empty = False
-        empty = 0
-        for square in row:
-            if square == "_":
-                empty += 1
-                prev_empty = True
-            else:
-                if prev_empty:
-                    prev_empty = False
-                    fen.append(str(empty))
-                    empty = 0
-                fen.append(square)
+    return _compress_fen("/".join(map("".join, board)))
+
+
+def _expand_fen(fen: str) -> str:
+    """Expand the digits of a FEN string into empty squares.
+
+    :param fen: FEN string to expand.
+
+    :return: String of the 64 pieces (from a8 to h1), where each empty
+    square is represented by a `"_"`.
+    """
+    squares = fen
+    for digit, run in _FEN_DIGITS:
+        squares = squares.replace(digit, run)
+    rows = squares.split(sep="/")
+
+    if len(rows) != 8:
+        raise ValueError(f"fen must have 8 rows: {fen}")
+
+    if any(len(row) != 8 for row in rows):
+        raise ValueError(f"Each fen row must have 8 positions: {fen}")
+
+    return "".join(rows)
+
+
+def _compress_fen(squares: str) -> str:
+    """Replace each run of empty squares (`"_"`) with its length."""
+    for run, digit in _EMPTY_RUNS:
+        squares = squares.replace(run, digit)
+    return squares
+
+
+def fen_to_array(fen: str) -> np.ndarray:
+    """Translate a FEN string to a compact board.
+
+    Note that the FEN string should only contain information of the
+    positions of the pieces.
+
+    :param fen: FEN string to translate.
+
+    :return: Length-64 `np.uint8` array of the pieces (from a8 to h1).
+
+        Each piece is given by the ASCII code of its character in the
+        FEN string, and each empty square by the ASCII code of `"_"`.
+    """
+    return np.frombuffer(
+        _expand_fen(fen).encode("ascii"), dtype=np.uint8
+    ).copy()
+
+
+def array_to_fen(array: np.ndarray) -> str:
+    """Translate a compact board to a FEN string.
+
+    :param array: Length-64 `np.uint8` array of the pieces (see
+    `fen_to_array()`).
+
+    :return: FEN string corresponding to the compact board.
+    """
+    squares = np.asarray(array, dtype=np.uint8).tobytes().decode("ascii")
+    return _compress_fen(
+        "/".join(squares[ind : ind + 8] for ind in range(0, 64, 8))
+    )
+
 
-        if prev_empty:
-            fen.append(str(empty))
+def array_to_board(array: np.ndarray) -> list[list[str]]:
+    """Translate a compact board to a board matrix.
 
-        fen.append("/")
+    :param array: Length-64 `np.uint8` array of the pieces (see
+    `fen_to_array()`).
 
-    return "".join(fen[:-1])  # Remove final /
+    :return: Board matrix corresponding to the compact board.
+    """
+    squares = np.asarray(array, dtype=np.uint8).tobytes().decode("ascii")
+    return [list(squares[ind : ind + 8]) for ind in range(0, 64, 8)]
+
+
+def board_to_array(board: list[list[str]]) -> np.ndarray:
+    """Translate a board matrix to a compact board.
+
+    :param board: Board matrix to translate.
+
+    :return: Length-64 `np.uint8` array of the pieces (see
+    `fen_to_array()`).
+    """
+    return np.frombuffer(
+        "".join(map("".join, board)).encode("ascii"), dtype=np.uint8
+    ).copy()
 
 
 def list_to_board(pieces_list: list[str], a1_pos="BL") -> list[list[str]]:
@@ -87,9 +179,10 @@ def list_to_board(pieces_list: list[str], a1_pos="BL") -> list[list[str]]:
     if len(pieces_list) != 64:
         raise ValueError("Input pieces list must be of length 64")
 
-    board = [pieces_list[ind : ind + 8] for ind in range(0, 64, 8)]
-    board = rotate_board_to_standard_view(board, a1_pos)
-    return board
+    if a1_pos not in TO_STANDARD_VIEW:
+        raise ValueError("a1_pos is not BL, BR, TL or TR")
+
+    return _permute_squares(pieces_list, TO_STANDARD_VIEW[a1_pos])
 
 
 def board_to_list(board: list[list[str]]) -> list[str]:
@@ -117,11 +210,7 @@ def is_light_square(list_pos: int) -> bool:
     """
     if not 0 <= list_pos <= 63:
         raise ValueError("List position must be between 0 and 63")
-
-    if list_pos % 16 < 8:  # Rank 8, 6, 4, or 2
-        return list_pos % 2 == 0  # File a, c, e, or g
-    else:  # Rank 7, 5, 3, or 1
-        return list_pos % 2 == 1  # File b, d, f, or h
+    return LIGHT_SQUARES[list_pos]
 
 
 def rotate_board_from_standard_view(
@@ -139,17 +228,10 @@ def rotate_board_from_standard_view(
 
     :return: Rotated board matrix.
     """
-    if a1_pos == "BL":
-        return board
-    if a1_pos == "BR":  # Counterclockwise rotation
-        return list(map(list, zip(*board)))[::-1]
-    if a1_pos == "TL":  # Clockwise rotation
-        return list(map(list, zip(*board[::-1])))
-    if a1_pos == "TR":  # 180 degree rotation
-        tmp = list(map(list, zip(*board[::-1])))
-        return list(map(list, zip(*tmp[::-1])))
+    if a1_pos not in FROM_STANDARD_VIEW:
+        raise ValueError("a1_pos is not BL, BR, TL or TR")
 
-    raise ValueError("a1_pos is not BL, BR, TL or TR")
+    return _permute_squares(board_to_list(board), FROM_STANDARD_VIEW[a1_pos])
 
 
 def rotate_board_to_standard_view(
@@ -173,15 +255,24 @@ def rotate_board_to_standard_view(
         The rotated board matrix has its a1 square in the bottom-left
         corner.
     """
-    # In the next two comments, C = clockwise and CC = counterclockwise
-    if a1_pos == "BR":
-        a1_pos = "TL"  # Exchange 90-degree C and 90-degree CC rotations
-    elif a1_pos == "TL":
-        a1_pos = "BR"  # Exchange 90-degree C and 90-degree CC rotations
+    if a1_pos not in TO_STANDARD_VIEW:
+        raise ValueError("a1_pos is not BL, BR, TL or TR")
+
+    return _permute_squares(board_to_list(board), TO_STANDARD_VIEW[a1_pos])
+
+
+def _permute_squares(squares: list, perm: np.ndarray) -> list[list]:
+    """Translate a permutation of a list of squares to a board matrix.
+
+    :param squares: List of 64 squares (e.g., pieces or probabilities).
+
+    :param perm: Permutation of the squares (see `FROM_STANDARD_VIEW`).
 
-    return rotate_board_from_standard_view(
-        board, a1_pos
-    )  # The 180-degree rotations stay the same
+    :return: Board matrix whose i-th square (row by row) is the
+    `perm[i]`-th square of `squares`.
+    """
+    squares = [squares[ind] for ind in perm.tolist()]
+    return [squares[ind : ind + 8] for ind in range(0, 64, 8)]
 
 
 def compare_fen(fen1: str, fen2: str) -> int:
@@ -193,11 +284,96 @@ def compare_fen(fen1: str, fen2: str) -> int:
 
     :return: Number of positions that differ for the two FEN strings.
     """
-    board1 = fen_to_board(fen1)
-    board2 = fen_to_board(fen2)
-    count = 0
-    for i in range(8):
-        for j in range(8):
-            if board1[i][j] != board2[i][j]:
-                count += 1
-    return count
+    return int(np.count_nonzero(fen_to_array(fen1) != fen_to_array(fen2)))
+
+
+class ParsedFen:
+    """Represent a FEN string parsed once.
+
+    The compact board (see `fen_to_array()`) and the counts of the
+    pieces are computed when the FEN string is parsed, and the
+    python-chess board and the validity for a standard physical chess
+    set when they are first needed. The instances are shared by all of
+    the callers of `parse_fen()`, so they must not be modified (e.g.,
+    `board` must be copied before pushing any move).
+    """
+
+    def __init__(self, fen: str):
+        """Parse a FEN string.
+
+        :param fen: FEN string to parse.
+
+            It should only contain information of the positions of the
+            pieces (see `fen_to_board()`).
+        """
+        self.fen = fen
+        self.array = fen_to_array(fen)  # Compact board
+        self.array.flags.writeable = False
+        self.piece_counts = collections.Counter(
+            self.array.tobytes().decode("ascii")
+        )
+
+    @functools.cached_property
+    def board(self) -> chess.Board:
+        """Return the python-chess board (with white to move)."""
+        return chess.Board(self.fen)
+
+    @functools.cached_property
+    def is_valid(self) -> bool:
+        """Check validity of FEN assuming a standard physical chess set.
+
+        The board position must be valid with either side to move, and
+        the numbers of pieces must fit in a standard physical chess set,
+        where each promoted queen or (second same-colored) bishop takes
+        the place of a pawn.
+        """
+        # The position must be valid with white or with black to move
+        if not self.board.is_valid():
+            board = self.board.copy(stack=False)
+            board.turn = chess.BLACK
+            if not board.is_valid():
+                return False
+
+        for side in ("PBNRQ", "pbnrq"):
+            pawn, bishop, knight, rook, queen = side
+            num_light_squared_bishops = np.count_nonzero(
+                (self.array == ord(bishop)) & _LIGHT_SQUARE_MASK
+            )
+            num_dark_squared_bishops = (
+                self.piece_counts[bishop] - num_light_squared_bishops
+            )
+            if (
+                max(
+                    self.piece_counts[rook],
+                    self.piece_counts[knight],
+                    self.piece_counts[bishop],
+                    self.piece_counts[queen],
+                )
+                > 2
+            ):  # Too many pieces for a standard physical chess set
+                return False
+
+            num_promoted = (self.piece_counts[queen] == 2) + (
+                num_light_squared_bishops == 2 or num_dark_squared_bishops == 2
+            )  # Number of promoted pawns
+            if self.piece_counts[pawn] + num_promoted > 8:
+                return False
+
+        return True
+
+
+@functools.lru_cache(maxsize=PARSED_FEN_CACHE_SIZE)
+def parse_fen(fen: str) -> ParsedFen:
+    """Parse a FEN string, reusing the parsed recent FEN strings.
+
+    The same FEN string is usually passed around again and again (e.g.,
+    the previous FEN string of each frame in continuous mode), so each
+    one is only parsed once while it stays among the
+    `PARSED_FEN_CACHE_SIZE` most recently used ones.
+
+    :param fen: FEN string to parse.
+
+    :return: Parsed FEN string (see `ParsedFen`), which must not be
+    modified.
+    """
+    return ParsedFen(fen)
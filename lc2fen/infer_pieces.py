@@ -5,14 +5,20 @@ convolutional neural network (CNN).
 """
 
 
+import functools
+
 import numpy as np
 import chess
+from scipy.optimize import linear_sum_assignment
 
 from lc2fen.fen import (
+    board_to_fen,
     board_to_list,
     list_to_board,
-    is_light_square,
+    LIGHT_SQUARES,
+    TO_STANDARD_VIEW,
     fen_to_board,
+    parse_fen,
 )
 
 
@@ -48,532 +54,130 @@ _PIECE_TO_IDX_FULL = {
     "r": 12,
 }
 
-_IDX_TO_PIECE = {
-    0: "B",
-    1: "N",
-    2: "P",
-    3: "Q",
-    4: "R",
-    5: "b",
-    6: "n",
-    7: "p",
-    8: "q",
-    9: "r",
-}
-
-_PIECE_TO_IDX = {
-    "B": 0,
-    "N": 1,
-    "P": 2,
-    "Q": 3,
-    "R": 4,
-    "b": 5,
-    "n": 6,
-    "p": 7,
-    "q": 8,
-    "r": 9,
-}
-
-_WHITE_PIECES = ("P", "B", "N", "R", "K", "Q")
-_BLACK_PIECES = ("p", "b", "n", "r", "k", "q")
+# Permutations of the squares that rotate the piece probabilities so
+# that the a1 square ends up in the bottom-left corner (see
+# `list_to_board()`), by position of the a1 square
+_ROTATIONS = TO_STANDARD_VIEW
 
-_FILES = "abcdefgh"
-_RANKS = "87654321"
+# Light squares and squares that a pawn can be on (from a8 to h1)
+_LIGHT_SQUARES = np.array(LIGHT_SQUARES)
+_PAWN_SQUARES = np.arange(64) // 8 % 7 != 0
+_ALL_SQUARES = np.ones(64, dtype=bool)
 
 
-def _sort_probs_by_piece_type(
-    probs_by_square: list[tuple[list[float], int]]
-) -> list[list[tuple[list[float], int]]]:
-    """Return a length-10 descending-order list of piece probabilities.
-
-    This function returns a length-10 list of piece probabilities sorted
-    in descending order.
-
-    :param probs_by_square: Length-64 list of piece probabilities.
-
-        Each tuple in the list corresponds to a unique square on the
-        chessboard.
-
-        The first element of each tuple is the list of piece
-        probabilities (in the order of `_PIECE_TO_IDX_FULL`) for the
-        corresponding square, while the second is
-        the integer specifying the position of the corresponding square
-        on the chessboard.
-
-    :return: Length-10 list of piece probabilities.
+def _piece_slots(
+    white: bool,
+    num_queens: int,
+    bishop_squares: list[np.ndarray],
+    num_pawns: int,
+) -> list[tuple[str, np.ndarray]]:
+    """Return the slots of the pieces of a side in the piece assignment.
 
-        Each element in the list is a sublist that corresponds to a
-        unique piece type (the piece types are in the order of
-        `_IDX_TO_PIECE`).
+    :param white: Whether the side is white.
 
-        Each sublist is either length-64 (for a nonpawn piece) or
-        length-48 (for a pawn).
+    :param num_queens: Number of queen slots.
 
-        Each tuple in a sublist corresponds to a unique square on the
-        chessboard.
+    :param bishop_squares: Squares that each bishop slot can be on.
 
-        The first element of each tuple is the list of piece
-        probabilities (in the order of `_PIECE_TO_IDX_FULL`) for the
-        corresponding square, while the second is the integer specifying
-        the position of the corresponding square on the chessboard.
+    :param num_pawns: Number of pawn slots.
 
-        The tuples are ordered based on the piece probability; the first
-        tuple in a sublist corresponds to the square on the chessboard
-        that has the highest probability of having the piece type
-        corresponding to the sublist.
+    :return: List of pairs formed by the piece type of each slot and the
+    squares that it can be on.
     """
-    w_bishops = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["B"]],
-        reverse=True,
-    )
-    w_knights = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["N"]],
-        reverse=True,
-    )
-    w_pawns = sorted(
-        probs_by_square[8:-8],  # Pawns can't be in the first or last row
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["P"]],
-        reverse=True,
-    )
-    w_queens = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["Q"]],
-        reverse=True,
-    )
-    w_rooks = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["R"]],
-        reverse=True,
-    )
-    b_bishops = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["b"]],
-        reverse=True,
-    )
-    b_knights = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["n"]],
-        reverse=True,
-    )
-    b_pawns = sorted(
-        probs_by_square[8:-8],  # Pawns can't be in the first or last row
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["p"]],
-        reverse=True,
-    )
-    b_queens = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["q"]],
-        reverse=True,
-    )
-    b_rooks = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["r"]],
-        reverse=True,
+    slots = (
+        [("N", _ALL_SQUARES)] * 2
+        + [("R", _ALL_SQUARES)] * 2
+        + [("Q", _ALL_SQUARES)] * num_queens
+        + [("B", squares) for squares in bishop_squares]
+        + [("P", _PAWN_SQUARES)] * num_pawns
     )
     return [
-        w_bishops,
-        w_knights,
-        w_pawns,
-        w_queens,
-        w_rooks,
-        b_bishops,
-        b_knights,
-        b_pawns,
-        b_queens,
-        b_rooks,
+        (piece if white else piece.lower(), squares)
+        for piece, squares in slots
     ]
 
 
-def _piece_with_highest_prob(
-    top_probs_by_type: list[tuple[list[float], int]]
-) -> int:
-    """Determine the piece that has the highest piece probability.
-
-    This function determines the piece that has the highest piece
-    probability across the entire chessboard.
-
-    See "infer_pieces.png" (in the "docs" folder) for a visualization of
-    the algorithm.
-
-    :param top_probs_by_type: Length-10 list of piece probabilities.
-
-        Each element in the list is a tuple that corresponds to a unique
-        piece type (the piece types are in the order of
-        `_IDX_TO_PIECE`).
-
-        Each tuple also corresponds to the square on the chessboard that
-        has the highest probability of having the corresponding piece
-        type.
-
-        The first element of each tuple is the list of piece
-        probabilities (in the
-        order of `_PIECE_TO_IDX_FULL`) for the corresponding square,
-        while the second is the integer specifying the position of the
-        corresponding square on the chessboard.
-
-    :return: Index (between 0 and 9) specifying which piece has the
-    highest piece probability on any square on the chessboard.
-    """
-    # Set the initial maximum probability and index to the first piece
-    # in the list
-    value = top_probs_by_type[_PIECE_TO_IDX["B"]][0][_PIECE_TO_IDX_FULL["B"]]
-    idx = _PIECE_TO_IDX["B"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["N"]][0][_PIECE_TO_IDX_FULL["N"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["N"]][0][
-            _PIECE_TO_IDX_FULL["N"]
-        ]
-        idx = _PIECE_TO_IDX["N"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["P"]][0][_PIECE_TO_IDX_FULL["P"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["P"]][0][
-            _PIECE_TO_IDX_FULL["P"]
-        ]
-        idx = _PIECE_TO_IDX["P"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["Q"]][0][_PIECE_TO_IDX_FULL["Q"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["Q"]][0][
-            _PIECE_TO_IDX_FULL["Q"]
-        ]
-        idx = _PIECE_TO_IDX["Q"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["R"]][0][_PIECE_TO_IDX_FULL["R"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["R"]][0][
-            _PIECE_TO_IDX_FULL["R"]
-        ]
-        idx = _PIECE_TO_IDX["R"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["b"]][0][_PIECE_TO_IDX_FULL["b"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["b"]][0][
-            _PIECE_TO_IDX_FULL["b"]
-        ]
-        idx = _PIECE_TO_IDX["b"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["n"]][0][_PIECE_TO_IDX_FULL["n"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["n"]][0][
-            _PIECE_TO_IDX_FULL["n"]
-        ]
-        idx = _PIECE_TO_IDX["n"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["p"]][0][_PIECE_TO_IDX_FULL["p"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["p"]][0][
-            _PIECE_TO_IDX_FULL["p"]
+# Slots of the pieces of each side for each number of promoted pieces
+# (a second queen or a second bishop of the same color), which is taken
+# from the number of pawns
+_SIDE_SLOTS = [
+    [
+        _piece_slots(
+            white,
+            num_queens,
+            bishop_squares,
+            9 - num_queens - (bishop_squares[0] is bishop_squares[1]),
+        )
+        for num_queens in (1, 2)
+        for bishop_squares in (
+            [_LIGHT_SQUARES, ~_LIGHT_SQUARES],
+            [_LIGHT_SQUARES, _LIGHT_SQUARES],
+            [~_LIGHT_SQUARES, ~_LIGHT_SQUARES],
+        )
+    ]
+    for white in (True, False)
+]
+# Columns (in the order of `_IDX_TO_PIECE_FULL`) and squares of the
+# slots of both sides, for each combination of promoted pieces and with
+# the slots of all of them at once (which may be unbalanced)
+_SLOT_COLUMNS, _SLOT_SQUARES = zip(
+    *(
+        (
+            np.array([_PIECE_TO_IDX_FULL[piece] for piece, _ in slots]),
+            np.array([squares for _, squares in slots]),
+        )
+        for slots in [
+            _piece_slots(True, 2, [_LIGHT_SQUARES, ~_LIGHT_SQUARES] * 2, 8)
+            + _piece_slots(False, 2, [_LIGHT_SQUARES, ~_LIGHT_SQUARES] * 2, 8)
         ]
-        idx = _PIECE_TO_IDX["p"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["q"]][0][_PIECE_TO_IDX_FULL["q"]]
-        > value
-    ):
-        value = top_probs_by_type[_PIECE_TO_IDX["q"]][0][
-            _PIECE_TO_IDX_FULL["q"]
+        + [
+            white_slots + black_slots
+            for white_slots in _SIDE_SLOTS[0]
+            for black_slots in _SIDE_SLOTS[1]
         ]
-        idx = _PIECE_TO_IDX["q"]
-    if (
-        top_probs_by_type[_PIECE_TO_IDX["r"]][0][_PIECE_TO_IDX_FULL["r"]]
-        > value
-    ):
-        # value = top_probs_by_type[_PIECE_TO_IDX["r"]][0][
-        #     _PIECE_TO_IDX_FULL["r"]
-        # ]
-        idx = _PIECE_TO_IDX["r"]
-    return idx
-
-
-def _check_bishop(
-    max_idx: int,
-    top_probs_by_type: list[tuple[list, int]],
-    w_bishop_sq: list[bool],
-    b_bishop_sq: list[bool],
-) -> bool:
-    """Determine if it makes sense to place a bishop on a square.
-
-    This function determines if it makes sense to place a bishop on the
-    square corresponding to `top_probs_by_type[max_idx][1]`. If
-    `max_idx` is not a bishop index, the function returns `True`
-    immediately. Otherwise, it makes the decision based on the existing
-    bishops on the chessboard. The crucial assumption is that for either
-    side (white or black), there can be at most one dark-squared bishop
-    and at most one light-squared bishop.
-
-    Note: this function is no longer used in the code because
-    theoretically, for either side, there can be two bishops of the same
-    color (via pawn promotion). Since the `max_pieces_left` variable
-    makes sure there are at most two bishops for either side, there is
-    no more additional check that we need to do for bishops; we can
-    safely remove the requirement that if any side (white or black) has
-    two bishops, those two bishops must be opposite-colored.
-
-    :param max_idx: Index specifying the piece of interest.
-
-        This is the index (between 0 and 9) specifying which piece we
-        are about to place on the chessboard.
-
-    :param top_probs_by_type: Length-10 list of piece probabilities.
-
-        Each element in the list is a tuple that corresponds to a unique
-        piece type (the piece types are in the order of
-        `_IDX_TO_PIECE`).
-
-        Each tuple also corresponds to the square on the chessboard that
-        has the highest probability of having the corresponding piece
-        type.
-
-        The first element of each tuple is the list of piece
-        probabilities (in the order of `_PIECE_TO_IDX_FULL`) for the
-        corresponding square, while the second is
-        the integer specifying the position of the corresponding square
-        on the chessboard.
-
-    :param w_bishop_sq: Length-2 list storing what bishops white has.
-
-        The first boolean specifies whether white has a light-squared
-        bishop, while the second boolean specifies whether white has a
-        dark-squared bishop.
-
-    :param b_bishop_sq: Length-2 list storing what bishops black has.
-
-        The first boolean specifies whether black has a light-squared
-        bishop, while the second boolean specifies whether black has a
-        dark-squared bishop.
-
-    :return: Boolean specifying whether it makes sense to place a bishop
-    on the square.
-    """
-    if max_idx == _PIECE_TO_IDX["B"]:  # We want to place a white bishop
-        if is_light_square(top_probs_by_type[max_idx][1]):
-            if not w_bishop_sq[
-                0
-            ]:  # White does not have a light-squared bishop yet
-                w_bishop_sq[0] = True  # Now white has a light-squared bishop
-                return True
-            return False
-        if not w_bishop_sq[1]:  # White does not have a dark-squared bishop yet
-            w_bishop_sq[1] = True  # Now white has a dark-squared bishop
-            return True
-        return False
-    elif max_idx == _PIECE_TO_IDX["b"]:  # We want to place a black bishop
-        if is_light_square(top_probs_by_type[max_idx][1]):
-            if not b_bishop_sq[
-                0
-            ]:  # Black does not have a light-squared bishop yet
-                b_bishop_sq[0] = True  # Now black has a light-squared bishop
-                return True
-            return False
-        if not b_bishop_sq[1]:  # Black does not have a dark-squared bishop yet
-            b_bishop_sq[1] = True  # Now black has a dark-squared bishop
-            return True
-        return False
-
-    return True  # If it is not a bishop, there is nothing to check
-
-
-def _determine_promoted_piece(
-    previous_fen: str,
-    probs_with_no_indices: list[list[float]],
-    final_sq: int,
-    color: str,
-) -> str:
-    """Determine the promoted piece.
-
-    :param previous_fen: FEN string of the previous board position.
-
-    :param probs_with_no_indices: Length-64 list of piece probabilities.
-
-        Each element in the list is a length-13 sublist that corresponds
-        to a unique square on the chessboard.
-
-        Each sublist contains 13 piece probabilities (in the order of
-        `_IDX_TO_PIECE_FULL`) for the corresponding square.
-
-        The probabilities come from the convolutional neural network
-        (see the `obtain_piece_probs_for_all_64_squares()` function
-        in "predict_board.py").
-
-    :param final_sq: Integer specifying the square of interest.
-
-        This integer specifies which square we are interested in
-        determining the piece type for.
-
-        Since we are determining the promoted piece, the integer must be
-        between 0 and 7 or between 56 and 63.
-
-    :param color: String specifying the piece color.
-
-        This string (`"white"` or `"black"`) specifies the color of the
-        piece on the square corresponding to `final_sq`.
-
-    :return: Which piece is most likely to be on the square.
-    """
-    highest_prob = 0
-    if color == "white":
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["Q"]]
-            > highest_prob
-            and previous_fen.count("Q") < 2
-        ):
-            promoted_piece = "Q"
-            highest_prob = probs_with_no_indices[final_sq][
-                _PIECE_TO_IDX_FULL["Q"]
-            ]
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["N"]]
-            > highest_prob
-            and previous_fen.count("N") < 2
-        ):
-            promoted_piece = "N"
-            highest_prob = probs_with_no_indices[final_sq][
-                _PIECE_TO_IDX_FULL["N"]
-            ]
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["R"]]
-            > highest_prob
-            and previous_fen.count("R") < 2
-        ):
-            promoted_piece = "R"
-            highest_prob = probs_with_no_indices[final_sq][
-                _PIECE_TO_IDX_FULL["R"]
-            ]
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["B"]]
-            > highest_prob
-            and previous_fen.count("B") < 2
-        ):
-            promoted_piece = "B"
-    else:
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["q"]]
-            > highest_prob
-            and previous_fen.count("q") < 2
-        ):
-            promoted_piece = "q"
-            highest_prob = probs_with_no_indices[final_sq][
-                _PIECE_TO_IDX_FULL["q"]
-            ]
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["n"]]
-            > highest_prob
-            and previous_fen.count("n") < 2
-        ):
-            promoted_piece = "n"
-            highest_prob = probs_with_no_indices[final_sq][
-                _PIECE_TO_IDX_FULL["n"]
-            ]
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["r"]]
-            > highest_prob
-            and previous_fen.count("r") < 2
-        ):
-            promoted_piece = "r"
-            highest_prob = probs_with_no_indices[final_sq][
-                _PIECE_TO_IDX_FULL["r"]
-            ]
-        if (
-            probs_with_no_indices[final_sq][_PIECE_TO_IDX_FULL["b"]]
-            > highest_prob
-            and previous_fen.count("b") < 2
-        ):
-            promoted_piece = "b"
-    # Note that if the provided previous FEN is correct,
-    # `promoted_piece` should be defined at this point
-    return promoted_piece
-
-
-def _generate_fen_based_on_previous_fen_and_detected_move(
-    previous_fen: str,
-    move: tuple[int, int, str],
-    probs_with_no_indices: list[list[float]],
-) -> str:
-    """Generate the FEN based on the previous FEN and detected move.
-
-    :param previous_fen: FEN string of the previous board position.
-
-    :param move: Tuple containing information on the detected move.
-
-        The first element of the tuple specifies the initial square, the
-        second specifies the final square, and the third describes the
-        action.
-
-    :param probs_with_no_indices: Length-64 list of piece probabilities.
-
-        Each element in the list is a length-13 sublist that corresponds
-        to a unique square on the chessboard.
-
-        Each sublist contains 13 piece probabilities (in the order of
-        `_IDX_TO_PIECE_FULL`) for the corresponding square.
-
-        The probabilities come from the convolutional neural network
-        (see the `obtain_piece_probs_for_all_64_squares()` function
-        in "predict_board.py").
+    )
+)
 
-    :return: FEN string of the current board position.
-    """
-    assert previous_fen is not None
-    assert move is not None
-    previous_list = board_to_list(fen_to_board(previous_fen))
-    previous_board = chess.Board(previous_fen)
-    initial_sq, final_sq, action = move
-    initial_coordinates = _FILES[initial_sq % 8] + _RANKS[initial_sq // 8]
-    final_coordinates = _FILES[final_sq % 8] + _RANKS[final_sq // 8]
-    move_uci = initial_coordinates + final_coordinates
-    if action.startswith("white"):
-        previous_board.turn = chess.WHITE
-    else:
-        previous_board.turn = chess.BLACK
-    if (
-        previous_list[initial_sq] == "P" and initial_coordinates[1] == "7"
-    ):  # White promotes (and we have to figure out the promoted piece)
-        promoted_piece = _determine_promoted_piece(
-            previous_fen, probs_with_no_indices, final_sq, "white"
-        )
-        move_uci = move_uci + promoted_piece.lower()
-        previous_board.push_uci(move_uci)
-        return previous_board.board_fen()
-    elif (
-        previous_list[initial_sq] == "p" and initial_coordinates[1] == "2"
-    ):  # Black promotes (and we have to figure out the promoted piece)
-        promoted_piece = _determine_promoted_piece(
-            previous_fen, probs_with_no_indices, final_sq, "black"
-        )
-        move_uci = move_uci + promoted_piece
-        previous_board.push_uci(move_uci)
-        return previous_board.board_fen()
-    elif action.endswith("en_passants"):
-        previous_board.ep_square = chess.parse_square(final_coordinates)
-        previous_board.push_uci(move_uci)
-        return previous_board.board_fen()
-    elif action.startswith("white") and action[6:13] == "castles":
-        if action.endswith("kingside"):
-            previous_board.set_castling_fen("K")
-        else:
-            previous_board.set_castling_fen("Q")
-        previous_board.push_uci(move_uci)
-        return previous_board.board_fen()
-    elif action.startswith("black") and action[6:13] == "castles":
-        if action.endswith("kingside"):
-            previous_board.set_castling_fen("k")
-        else:
-            previous_board.set_castling_fen("q")
-        previous_board.push_uci(move_uci)
-        return previous_board.board_fen()
-    else:
-        previous_board.push_uci(move_uci)
-        return previous_board.board_fen()
+# Cost of assigning a piece to a square that it can't be on (or of not
+# assigning any piece to a square), which is larger than the cost of any
+# assignment of pieces to the squares that they can be on
+_INFEASIBLE_COST = 1e6
+
+# Pieces of python-chess in the order of the piece probabilities
+_CHESS_PIECES = [
+    chess.Piece.from_symbol(_IDX_TO_PIECE_FULL[i])
+    for i in range(13)
+    if _IDX_TO_PIECE_FULL[i] != "_"
+]
+_CHESS_PIECE_COLUMNS = [
+    _PIECE_TO_IDX_FULL[piece.symbol()] for piece in _CHESS_PIECES
+]
+_CHESS_WHITE_PIECES = [piece.color == chess.WHITE for piece in _CHESS_PIECES]
+# Index (from a8 to h1) of each square of python-chess (from a1 to h8)
+_CHESS_SQUARE_INDICES = np.arange(64) ^ 56
+
+# A detected move is only accepted if the position after it is at least
+# this much more likely (in log-likelihood) than the position after any
+# other candidate move and if the state (empty, white, or black) of at
+# most this many squares of the position differs from their state
+# according to the piece probabilities
+_MOVE_LOG_LIKELIHOOD_MARGIN = 2.0
+_MAX_MOVE_STATE_MISMATCHES = 1
+
+# Max. number of plies detected since the previous board position and
+# number of positions expanded in each ply of the search for them
+_MAX_MOVE_PLIES = 4
+_MOVE_BEAM_WIDTH = 8
+
+# Number of previous FEN strings whose candidate positions are kept
+_CANDIDATE_CACHE_SIZE = 16
+
+# Log-probability of a move between two consecutive frames in the
+# temporal decoding (see `TemporalDecoder`)
+_DECODER_MOVE_LOG_PROB = -5.0
+
+# Min. piece probability in the log-likelihoods (to avoid `log(0)`)
+_MIN_PROB = 1e-6
 
 
 def _determine_most_probable_white_piece(
@@ -706,175 +310,8 @@ def _determine_most_probable_black_piece(
     return most_probable_piece
 
 
-def _check_balance_among_pawns_queens_and_bishops(
-    piece_type: str,
-    max_pieces_left: list[int],
-    B_light_squared: int,
-    B_dark_squared: int,
-    b_light_squared: int,
-    b_dark_squared: int,
-    square: int,
-) -> bool:
-    """Check the balance among pawns, queens, and bishops on the board.
-
-    This function determines whether the numbers of pawns, queens, and
-    bishops make sense for a standard physical chess set after placing
-    another piece. For example, if there are 2 light-squared bishops and
-    2 queens for white, then the number of pawns that white has must be
-    at most 6 (so if there are already 6 pawns on the board, we cannot
-    place another pawn on the board).
-
-    :param piece_type: Which piece we are about to place on the board.
-
-    :param max_pieces_left: Length-10 list of integers.
-
-        The 10 integers, in the order of `_IDX_TO_PIECE`, specifies how
-        many additional pieces we may place on the rest of the board.
-
-    :param B_light_squared: Number of white's light-squared bishops.
-
-        This is the number of light-squared bishops that white already
-        has.
-
-    :param B_dark_squared: Number of  white's dark-squared bishops.
-
-        This is the number of dark-squared bishops that white already
-        has.
-
-    :param b_light_squared: Number of black's light-squared bishops.
-
-        This is the number of light-squared bishops that black already
-        has.
-
-    :param b_dark_squared: Number of black's dark-squared bishops.
-
-        This is the number of dark-squared bishops that black already
-        has.
-
-    :param square: Integer specifying the square of interest.
-
-        This integer specifies which square we are interested in placing
-        the piece on.
-
-    :return: Whether placing the piece would affect the balance among
-    pawns, queens, and bishops on the chessboard.
-    """
-    if not piece_type in ["P", "p", "Q", "q", "B", "b"]:
-        return True
-    elif piece_type == "P" and (
-        (
-            (
-                max_pieces_left[_PIECE_TO_IDX["Q"]] == 0
-            )  # Whether a white pawn has promoted into a queen
-            + max(
-                B_dark_squared == 2, B_light_squared == 2
-            )  # Whether a white pawn has promoted into a bishop
-        )
-        <= (max_pieces_left[_PIECE_TO_IDX["P"]] - 1)
-    ):
-        return True
-    elif piece_type == "p" and (
-        (
-            (
-                max_pieces_left[_PIECE_TO_IDX["q"]] == 0
-            )  # Whether a black pawn has promoted into a queen
-            + max(
-                b_dark_squared == 2, b_light_squared == 2
-            )  # Whether a black pawn has promoted into a bishop
-        )
-        <= (max_pieces_left[_PIECE_TO_IDX["p"]] - 1)
-    ):
-        return True
-    elif piece_type == "Q" and (
-        (
-            ((max_pieces_left[_PIECE_TO_IDX["Q"]] - 1) == 0)
-            + max(
-                B_dark_squared == 2, B_light_squared == 2
-            )  # Whether a white pawn has promoted into a bishop
-        )
-        <= max_pieces_left[_PIECE_TO_IDX["P"]]
-    ):
-        return True
-    elif piece_type == "q" and (
-        (
-            ((max_pieces_left[_PIECE_TO_IDX["q"]] - 1) == 0)
-            + max(
-                b_dark_squared == 2, b_light_squared == 2
-            )  # Whether a black pawn has promoted into a bishop
-        )
-        <= max_pieces_left[_PIECE_TO_IDX["p"]]
-    ):
-        return True
-    elif (
-        piece_type == "B"
-        and not is_light_square(square)
-        and (
-            (
-                (
-                    max_pieces_left[_PIECE_TO_IDX["Q"]] == 0
-                )  # Whether a white pawn has promoted into a queen
-                + max(
-                    (B_dark_squared + 1) == 2, B_light_squared == 2
-                )  # Whether white is about to have 2 dark-squared bishops
-            )
-            <= max_pieces_left[_PIECE_TO_IDX["P"]]
-        )
-    ):
-        return True
-    elif (
-        piece_type == "B"
-        and is_light_square(square)
-        and (
-            (
-                (
-                    max_pieces_left[_PIECE_TO_IDX["Q"]] == 0
-                )  # Whether a white pawn has promoted into a queen
-                + max(
-                    B_dark_squared == 2, (B_light_squared + 1) == 2
-                )  # Whether white is about to have 2 light-squared bishops
-            )
-            <= max_pieces_left[_PIECE_TO_IDX["P"]]
-        )
-    ):
-        return True
-    elif (
-        piece_type == "b"
-        and not is_light_square(square)
-        and (
-            (
-                (
-                    max_pieces_left[_PIECE_TO_IDX["q"]] == 0
-                )  # Whether a black pawn has promoted into a queen
-                + max(
-                    (b_dark_squared + 1) == 2, b_light_squared == 2
-                )  # Whether black is about to have 2 dark-squared bishops
-            )
-            <= max_pieces_left[_PIECE_TO_IDX["p"]]
-        )
-    ):
-        return True
-    elif (
-        piece_type == "b"
-        and is_light_square(square)
-        and (
-            (
-                (
-                    max_pieces_left[_PIECE_TO_IDX["q"]] == 0
-                )  # Whether a black pawn has promoted into a queen
-                + max(
-                    b_dark_squared == 2, (b_light_squared + 1) == 2
-                )  # Whether black is about to have 2 light-squared bishops
-            )
-            <= max_pieces_left[_PIECE_TO_IDX["p"]]
-        )
-    ):
-        return True
-    else:
-        return False
-
-
 def infer_chess_pieces(
-    probs_with_no_indices: list[list[float]],
+    probs_with_no_indices: (list[list[float]] | np.ndarray),
     a1_pos: str,
     previous_fen: (str | None) = None,
 ) -> list[str]:
@@ -895,6 +332,10 @@ def infer_chess_pieces(
         (see the `obtain_piece_probs_for_all_64_squares()` function
         in "predict_board.py").
 
+        The probabilities can also be given as a (64, 13) array (e.g.,
+        of float32 probabilities), which is used without converting it
+        into lists.
+
     :param a1_pos: Position of the a1 square of list of probabilities.
 
         This is the position of the a1 square (`"BL"`, `"BR"`, `"TL"`,
@@ -903,7 +344,8 @@ def infer_chess_pieces(
     :param previous_fen: FEN string of the previous board position.
 
         If it is not `None`, it could significantly improve the accuracy
-        of piece inference.
+        of piece inference. Up to `_MAX_MOVE_PLIES` plies made since
+        this position (e.g., in dropped frames) can be detected.
 
     :return: Length-64 list of the inferred chess pieces in FEN-notation
     order (the first element corresponds to the a8 square, the second to
@@ -912,10 +354,315 @@ def infer_chess_pieces(
         If a square is inferred to be empty, it is given a `"_"` in the
         list.
     """
-    probs_with_no_indices = board_to_list(
-        list_to_board(probs_with_no_indices, a1_pos)
+    if len(probs_with_no_indices) != 64:
+        raise ValueError("Input pieces list must be of length 64")
+    return infer_chess_pieces_batch(
+        np.asarray(probs_with_no_indices)[np.newaxis], a1_pos, [previous_fen]
+    )[0]
+
+
+def infer_chess_pieces_batch(
+    probs_batch: np.ndarray,
+    a1_pos: str,
+    previous_fens: (list[str | None] | None) = None,
+) -> list[list[str]]:
+    """Infer the exact piece positions on several chessboards.
+
+    This function infers the pieces of each chessboard as
+    `infer_chess_pieces()` does, with the same results, but the empty
+    squares, the kings, and the costs of the pieces are determined for
+    all of the chessboards at once. Only the assignment of the pieces
+    under the constraints on their numbers (and the move detection) is
+    done board by board.
+
+    :param probs_batch: Array of piece probabilities of shape
+    (N, 64, 13).
+
+        Each element along the first axis contains the piece
+        probabilities of a chessboard (see `infer_chess_pieces()`).
+
+    :param a1_pos: Position of the a1 square of the chessboards.
+
+        This is the position of the a1 square (`"BL"`, `"BR"`, `"TL"`,
+        or `"TR"`) corresponding to the piece probabilities.
+
+    :param previous_fens: Length-N list of FEN strings of the previous
+    board position of each chessboard (`None` if it is unknown).
+
+    :return: Length-N list of the length-64 lists of inferred chess
+    pieces of the chessboards (see `infer_chess_pieces()`).
+    """
+    probs_batch = np.asarray(probs_batch)
+    if probs_batch.ndim != 3 or probs_batch.shape[1:] != (64, 13):
+        raise ValueError("Input probabilities must be of shape (N, 64, 13)")
+    if a1_pos not in _ROTATIONS:
+        raise ValueError("a1_pos is not BL, BR, TL or TR")
+    if previous_fens is None:
+        previous_fens = [None] * len(probs_batch)
+    probs_batch = probs_batch[:, _ROTATIONS[a1_pos]]
+    boards = np.arange(len(probs_batch))
+
+    # Determine the king locations (one white king and one black king),
+    # taking the first square in case of a tie
+    white_kings = np.argmax(probs_batch[:, :, _PIECE_TO_IDX_FULL["K"]], axis=1)
+    black_king_probs = probs_batch[:, :, _PIECE_TO_IDX_FULL["k"]].astype(float)
+    black_kings = np.argmax(black_king_probs, axis=1)
+    black_king_probs[boards, white_kings] = -np.inf
+    black_kings = np.where(
+        black_kings == white_kings,
+        np.argmax(black_king_probs, axis=1),
+        black_kings,
     )
 
+    # Identify the empty squares (the CNN has a very high accuracy of
+    # detecting empty squares)
+    empty_squares = np.argmax(probs_batch, axis=2) == _PIECE_TO_IDX_FULL["_"]
+
+    # Cost of each piece on each square (see `_assign_pieces()`)
+    costs = -np.log(np.maximum(probs_batch, _MIN_PROB))
+
+    return [
+        _infer_board_pieces(
+            probs_batch[board],
+            previous_fens[board],
+            int(white_kings[board]),
+            int(black_kings[board]),
+            empty_squares[board],
+            costs[board],
+        )
+        for board in boards
+    ]
+
+
+class TemporalDecoder:
+    """Decode the moves of a game from the piece probabilities.
+
+    This class decodes the board positions of consecutive frames (e.g.,
+    of a camera) online, as the most likely sequence of positions
+    connected by legal moves (Viterbi decoding of a hidden Markov model
+    whose hidden states are the board positions).
+
+    It keeps a small set of hypotheses, i.e., the most likely sequence
+    of moves that ends in each of a few positions. For each frame, every
+    hypothesis either stays or makes one of the legal moves of its
+    position, and the resulting positions are scored against the piece
+    probabilities of the frame all at once (see `_detect_legal_move()`).
+    Only the `max_hypotheses` most likely positions within
+    `max_log_likelihood_gap` of the most likely one are kept.
+
+    The moves that all of the hypotheses share are committed, since the
+    following frames can no longer change them. So a bad frame (e.g., a
+    hand over the board) does not propagate, and the moves are committed
+    as soon as they are stable. The oldest moves of the most likely
+    hypothesis are committed anyway if there are more than `max_lag` of
+    them, which bounds both the memory and the cost per frame.
+
+    If no hypothesis is consistent with a frame, the moves made since
+    the most likely position are searched for (e.g., several plies if
+    frames have been dropped). If they are not found in
+    `max_doubtful_frames` consecutive frames either, the decoding starts
+    over from the pieces inferred in the last frame.
+    """
+
+    def __init__(
+        self,
+        fen: str,
+        max_hypotheses: int = 16,
+        max_log_likelihood_gap: float = 10.0,
+        max_lag: int = 8,
+        max_doubtful_frames: int = 10,
+    ):
+        """Initialize an instance of the `TemporalDecoder`.
+
+        :param fen: FEN string of the initial board position.
+
+            Either side may move first.
+
+        :param max_hypotheses: Max. number of hypotheses.
+
+        :param max_log_likelihood_gap: Max. difference between the
+        log-likelihoods of the most likely hypothesis and of the rest.
+
+        :param max_lag: Max. number of moves not yet committed.
+
+        :param max_doubtful_frames: Max. number of consecutive frames
+        that no hypothesis is consistent with.
+        """
+        self.max_hypotheses = max_hypotheses
+        self.max_log_likelihood_gap = max_log_likelihood_gap
+        self.max_lag = max_lag
+        self.max_doubtful_frames = max_doubtful_frames
+        self.__start(fen)
+
+    def __start(self, fen: str):
+        """Start the decoding from a board position."""
+        self.board = chess.Board(fen)  # Committed board position
+        self.board.set_castling_fen("KQkq")
+        self.board.castling_rights = self.board.clean_castling_rights()
+        self.doubtful_frames = 0
+
+        # Hypotheses given as tuples formed by their log-likelihood
+        # (relative to the most likely one), position, and moves not yet
+        # committed
+        self.hypotheses = []
+        for turn in (chess.WHITE, chess.BLACK):
+            position = self.board.copy(stack=False)
+            position.turn = turn
+            self.hypotheses.append((0.0, position, ()))
+
+    def get_fen(self) -> str:
+        """Return the FEN string of the committed board position."""
+        return self.board.board_fen()
+
+    def update(
+        self,
+        probs_with_no_indices: (list[list[float]] | np.ndarray),
+        a1_pos: str,
+    ) -> list[chess.Move] | None:
+        """Update the hypotheses with the piece probabilities.
+
+        :param probs_with_no_indices: Length-64 list of piece
+        probabilities of the frame (see `infer_chess_pieces()`).
+
+        :param a1_pos: Position of the a1 square of list of
+        probabilities.
+
+        :return: List of the moves committed in this frame or `None` if
+        the decoding has started over (see `get_fen()`).
+        """
+        if a1_pos not in _ROTATIONS:
+            raise ValueError("a1_pos is not BL, BR, TL or TR")
+        probs = np.asarray(probs_with_no_indices)[_ROTATIONS[a1_pos]]
+        log_probs = np.log(np.maximum(probs, _MIN_PROB))[_CHESS_SQUARE_INDICES]
+
+        # Most likely hypothesis leading to each position (with its side
+        # to move) before this frame
+        candidates = {}
+
+        def add(log_likelihood, position, moves):
+            key = (_piece_placement(position), position.turn)
+            if key not in candidates or candidates[key][0] < log_likelihood:
+                candidates[key] = (log_likelihood, position, moves)
+
+        for log_likelihood, position, moves in self.hypotheses:
+            add(log_likelihood, position, moves)
+            for child in _positions_after_moves(
+                position.copy(stack=False), list(position.legal_moves)
+            ):
+                add(
+                    log_likelihood + _DECODER_MOVE_LOG_PROB,
+                    child,
+                    moves + (child.peek(),),
+                )
+
+        candidates = list(candidates.values())
+        log_likelihoods = np.array(
+            [log_likelihood for log_likelihood, _, _ in candidates]
+        ) + _position_log_likelihoods(
+            [position for _, position, _ in candidates], log_probs
+        )
+        order = np.argsort(-log_likelihoods, kind="stable")
+        best_log_likelihood = log_likelihoods[order[0]]
+        self.hypotheses = [
+            (
+                float(log_likelihoods[i] - best_log_likelihood),
+                candidates[i][1],
+                candidates[i][2],
+            )
+            for i in order[: self.max_hypotheses]
+            if best_log_likelihood - log_likelihoods[i]
+            <= self.max_log_likelihood_gap
+        ]
+
+        _, best, best_moves = self.hypotheses[0]
+        if (
+            _count_state_mismatches(best, _square_states(probs))
+            <= _MAX_MOVE_STATE_MISMATCHES
+        ):
+            self.doubtful_frames = 0
+        else:
+            position = _detect_legal_move(best, probs, _MAX_MOVE_PLIES)
+            if position is not None:
+                self.hypotheses = [
+                    (0.0, position, best_moves + tuple(position.move_stack))
+                ]
+                self.doubtful_frames = 0
+            elif self.doubtful_frames < self.max_doubtful_frames:
+                self.doubtful_frames += 1
+            else:
+                self.__start(
+                    board_to_fen(
+                        list_to_board(
+                            infer_chess_pieces(probs_with_no_indices, a1_pos)
+                        )
+                    )
+                )
+                return None
+
+        return self.__commit()
+
+    def __commit(self) -> list[chess.Move]:
+        """Commit the moves that all of the hypotheses share.
+
+        :return: List of the committed moves.
+        """
+        _, _, moves = self.hypotheses[0]
+
+        # The oldest moves beyond `max_lag` are committed anyway
+        num_committed = max(len(moves) - self.max_lag, 0)
+        self.hypotheses = [
+            hypothesis
+            for hypothesis in self.hypotheses
+            if hypothesis[2][:num_committed] == moves[:num_committed]
+        ]
+        while num_committed < len(moves) and all(
+            hypothesis[2][num_committed : num_committed + 1]
+            == moves[num_committed : num_committed + 1]
+            for hypothesis in self.hypotheses
+        ):
+            num_committed += 1
+
+        committed_moves = list(moves[:num_committed])
+        for move in committed_moves:
+            # The side to move is only known from the first move
+            self.board.turn = self.board.color_at(move.from_square)
+            self.board.push(move)
+        self.board = self.board.copy(stack=False)
+        self.hypotheses = [
+            (log_likelihood, position, moves[num_committed:])
+            for log_likelihood, position, moves in self.hypotheses
+        ]
+
+        return committed_moves
+
+
+def _infer_board_pieces(
+    probs_with_no_indices: np.ndarray,
+    previous_fen: str | None,
+    white_king: int,
+    black_king: int,
+    empty_squares: np.ndarray,
+    costs: np.ndarray,
+) -> list[str]:
+    """Place the pieces of a chessboard under the piece constraints.
+
+    :param probs_with_no_indices: (64, 13) array of piece probabilities
+    of the chessboard, with its a1 square in the bottom-left corner.
+
+    :param previous_fen: FEN string of the previous board position.
+
+    :param white_king: Square of the white king.
+
+    :param black_king: Square of the black king.
+
+    :param empty_squares: Length-64 boolean array of the empty squares.
+
+    :param costs: (64, 13) array of the costs of the pieces (see
+    `_assign_pieces()`).
+
+    :return: Length-64 list of the inferred chess pieces (see
+    `infer_chess_pieces()`).
+    """
     # Initialize the output list of predicted piece types (from a8, b8,
     # ..., to h1)
     # (`None` represents that the piece type of that square has not been
@@ -923,147 +670,49 @@ def infer_chess_pieces(
     predicted_piece_list = [None] * 64
 
     if previous_fen is not None:  # Perform move detection
-        changed_squares = _determine_changed_squares(
-            previous_fen, probs_with_no_indices
+        position = _detect_legal_move(
+            previous_fen, probs_with_no_indices, _MAX_MOVE_PLIES
         )
-        move = _detect_move(
-            previous_fen, probs_with_no_indices, changed_squares
-        )
-        if move is not None:  # A move has been successfully detected
+        if position is not None:  # A move has been detected
             return board_to_list(
-                fen_to_board(
-                    _generate_fen_based_on_previous_fen_and_detected_move(
-                        previous_fen, move, probs_with_no_indices
-                    )
-                )
+                fen_to_board(position.board_fen())
             )  # Conclude the FEN immediately
 
     # Move detection was either not invoked or not successful, so the
-    # pieces on the board will now be inferred one at a time
-    probs_by_square = [
-        (probs, i) for i, probs in enumerate(probs_with_no_indices)
-    ]
-
-    # First determine the king locations (one white king and one black
-    # king)
-    white_king = max(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["K"]],
-    )
-    black_kings = sorted(
-        probs_by_square,
-        key=lambda prob: prob[0][_PIECE_TO_IDX_FULL["k"]],
-        reverse=True,
-    )  # Descending order
-
-    black_king = black_kings[0]
-    if black_king[1] == white_king[1]:
-        black_king = black_kings[1]
-
-    predicted_piece_list[white_king[1]] = "K"
-    predicted_piece_list[black_king[1]] = "k"
-
-    num_of_undetermined_squares = (
-        62  # We have already determined the king locations
-    )
+    # pieces on the board will now be inferred, starting with the kings
+    # and the empty squares
+    predicted_piece_list[white_king] = "K"
+    predicted_piece_list[black_king] = "k"
 
-    # Then identify the empty squares (the CNN has a very high accuracy
-    # of detecting empty squares)
-    for idx, piece in enumerate(probs_with_no_indices):
+    for idx in np.flatnonzero(empty_squares).tolist():
         if predicted_piece_list[idx] is None:
-            if _is_empty_square(piece):
-                predicted_piece_list[idx] = "_"
-                num_of_undetermined_squares -= 1
-
-    # Determine the locations of the other pieces in order of
-    # probability (there is a total of
-    # (`num_of_undetermined_squares` * 10) probabilities)
-    probs_by_type = _sort_probs_by_piece_type(probs_by_square)
-    # Keep track of the indices to the squares, whose piece types have
-    # not been determined, with the highest probabilities in
-    # `probs_by_type` (there are 10 piece types left, so we need to keep
-    # track of 10 indices)
-    idx = [0] * 10
-    # Keep track of the top entry of each sorted piece list
-    # (corresponding to the square with the highest probability)
-    top_probs_by_type = [
-        probs_for_a_specific_type[0]
-        for probs_for_a_specific_type in probs_by_type
+            predicted_piece_list[idx] = "_"
+
+    # The rest of the pieces are assigned at once
+    squares = [
+        square
+        for square, piece_type in enumerate(predicted_piece_list)
+        if piece_type is None
     ]
-    # Maximum number of pieces of each type in the same order as
-    # `top_probs_by_type`
-    max_pieces_left = [2, 2, 8, 2, 2, 2, 2, 8, 2, 2]
-    # Keep track of the numbers of light-squared and dark-squared
-    # bishops for both sides
-    B_light_squared = 0  # Number of light-squared bishops for white
-    B_dark_squared = 0  # Number of dark-squared bishops for white
-    b_light_squared = 0  # Number of light-squared bishops for black
-    b_dark_squared = 0  # Number of dark-squared bishops for black
-    # Occasionally, the model is not accurate enough to predict a
-    # balanced board configuration (balanced in terms of the numbers of
-    # pawns, queens, and bishops)
-    failed_to_complete_prediction = False
-
-    # See "infer_pieces.png" (in the "docs" folder) for a visualization
-    # of the following `while` loop
-    while num_of_undetermined_squares > 0:
-        # Determine the piece type of the square that has the piece with
-        # the highest probability across the entire board
-        max_idx = _piece_with_highest_prob(top_probs_by_type)
-        square = top_probs_by_type[max_idx][1]
-        # If we haven't maxed that piece type and the piece type of that
-        # square hasn't been determined, then we conclude that that
-        # square has exactly that piece
-        if (
-            max_pieces_left[max_idx] > 0
-            and predicted_piece_list[square] is None
-        ):
-            piece_type = _IDX_TO_PIECE[max_idx]
-            if _check_balance_among_pawns_queens_and_bishops(
-                piece_type,
-                max_pieces_left,
-                B_light_squared,
-                B_dark_squared,
-                b_light_squared,
-                b_dark_squared,
-                square,
-            ):
-                predicted_piece_list[square] = piece_type
-                num_of_undetermined_squares -= 1
-                max_pieces_left[max_idx] -= 1
-
-                if piece_type == "B" and is_light_square(square):
-                    B_light_squared += 1
-                elif piece_type == "B" and not is_light_square(square):
-                    B_dark_squared += 1
-                elif piece_type == "b" and is_light_square(square):
-                    b_light_squared += 1
-                elif piece_type == "b" and not is_light_square(square):
-                    b_dark_squared += 1
-
-        # In any case, for the piece type we have tried above, we must
-        # replace the entry in `top_probs_by_type` with the
-        # next-highest-probability entry
-        try:
-            idx[max_idx] += 1
-            top_probs_by_type[max_idx] = probs_by_type[max_idx][idx[max_idx]]
-        except (
-            IndexError
-        ):  # Model is not accurate enough to predict a balanced configuration
-            # (balance in terms of the numbers of pawns, queens, and bishops)
-            print(
-                "Warning: the selected model is not accurate enough to predict"
-                " a balanced board configuration"
-            )
-            print(
-                "\tPlease consider providing the previous FEN, selecting a "
-                "different model, or performing\n\ttransfer learning on that "
-                "model"
-            )
-            failed_to_complete_prediction = True
-            break
+    pieces = _assign_pieces(costs, np.array(squares, dtype=int))
+    for square, piece in zip(squares, pieces.tolist()):
+        if piece >= 0:
+            predicted_piece_list[square] = _IDX_TO_PIECE_FULL[piece]
+
+    if np.any(pieces < 0):
+        # Model is not accurate enough to predict a balanced
+        # configuration (balance in terms of the numbers of pawns,
+        # queens, and bishops)
+        print(
+            "Warning: the selected model is not accurate enough to predict"
+            " a balanced board configuration"
+        )
+        print(
+            "\tPlease consider providing the previous FEN, selecting a "
+            "different model, or performing\n\ttransfer learning on that "
+            "model"
+        )
 
-    if failed_to_complete_prediction:
         # For every undetermined square, rather than give up on that
         # square, we will determine the piece on that square by brute
         # force
@@ -1082,40 +731,91 @@ def infer_chess_pieces(
                         probs_with_no_indices, square
                     )
 
-    if previous_fen is not None:  # We will now give move detection another try
-        changed_squares = _determine_changed_squares_after_piece_inference(
-            previous_fen, predicted_piece_list
+    return predicted_piece_list
+
+
+def _assign_pieces(costs: np.ndarray, squares: np.ndarray) -> np.ndarray:
+    """Assign the most likely pieces to the squares of a board.
+
+    This function assigns pieces to the squares so that the sum of their
+    costs (the negative log-probabilities of the pieces) is minimal,
+    i.e., the assignment is the most likely one, under the constraints
+    on the pieces of a standard physical chess set: at most 2 knights,
+    rooks, queens, and bishops and 8 pawns per side, with no pawns in
+    the first or last row and with each second queen or second bishop of
+    the same color taking the place of a pawn.
+
+    Each piece is a slot that can be assigned to one square (see
+    `_piece_slots()`), so the assignment is a linear sum assignment
+    problem, which is solved in polynomial time. The slots of all of the
+    pieces are assigned at once first. Only if that assignment is
+    unbalanced (e.g., it has 2 queens and 8 pawns), the slots of each
+    combination of promoted pieces are assigned and the best assignment
+    is taken.
+
+    :param costs: (64, 13) array of the costs of the pieces (in the
+    order of `_IDX_TO_PIECE_FULL`) on the squares (from a8 to h1).
+
+    :param squares: Array of the squares to which to assign pieces.
+
+    :return: Array of the pieces (indices of `_IDX_TO_PIECE_FULL`)
+    assigned to the squares.
+
+        If there are not enough pieces for all of the squares, the
+        squares left (with the lowest total cost) are given a `-1`.
+    """
+    best_cost = None
+    for i, (columns, slot_squares) in enumerate(
+        zip(_SLOT_COLUMNS, _SLOT_SQUARES)
+    ):
+        assignment_costs = costs[squares[:, np.newaxis], columns] + np.where(
+            slot_squares[:, squares].T, 0, _INFEASIBLE_COST
         )
-        move = _detect_move(
-            previous_fen, probs_with_no_indices, changed_squares
+        rows, slots = linear_sum_assignment(assignment_costs)
+        assigned_costs = assignment_costs[rows, slots]
+        pieces = np.full(len(squares), -1)
+        is_feasible = assigned_costs < _INFEASIBLE_COST
+        pieces[rows[is_feasible]] = columns[slots[is_feasible]]
+
+        # The first assignment is only unbalanced in a few cases
+        if i == 0 and _is_balanced(pieces, squares):
+            return pieces
+
+        cost = np.sum(assigned_costs) + _INFEASIBLE_COST * (
+            len(squares) - len(rows)
         )
-        if move is not None:  # Finally a move has been successfully detected
-            return board_to_list(
-                fen_to_board(
-                    _generate_fen_based_on_previous_fen_and_detected_move(
-                        previous_fen, move, probs_with_no_indices
-                    )
-                )
-            )
+        if i > 0 and (best_cost is None or cost < best_cost):
+            best_cost = cost
+            best_pieces = pieces
 
-    return predicted_piece_list
+    return best_pieces
 
 
-def _is_empty_square(probs_for_a_specific_square: list) -> bool:
-    """Infer if a square is empty or not.
+def _is_balanced(pieces: np.ndarray, squares: np.ndarray) -> bool:
+    """Check the balance among pawns, queens, and bishops.
 
-    This function infers, based on piece probabilities, whether a square
-    is empty or not.
+    :param pieces: Array of the pieces (indices of `_IDX_TO_PIECE_FULL`)
+    on the squares (see `_assign_pieces()`).
 
-    :param probs_for_a_specific_square: Length-13 list of probabilities.
+    :param squares: Array of the squares.
 
-        The 13 piece probabilities in the list are in the order of
-        `_IDX_TO_PIECE_FULL`.
-
-    :return: Whether the square whose piece probabilities are given by
-    `probs_for_a_specific_square` is empty or not.
+    :return: Whether there are at most 2 bishops per side and whether
+    the promoted pieces (a second queen or a second bishop of the same
+    color) of each side can be taken from its missing pawns.
     """
-    return _PIECE_TO_IDX_FULL["_"] == np.argmax(probs_for_a_specific_square)
+    for bishop, queen, pawn in (("B", "Q", "P"), ("b", "q", "p")):
+        is_bishop = pieces == _PIECE_TO_IDX_FULL[bishop]
+        light_bishops = np.count_nonzero(is_bishop & _LIGHT_SQUARES[squares])
+        dark_bishops = np.count_nonzero(is_bishop) - light_bishops
+        if light_bishops + dark_bishops > 2:
+            return False
+        num_promoted = (
+            np.count_nonzero(pieces == _PIECE_TO_IDX_FULL[queen]) == 2
+        ) + (light_bishops == 2 or dark_bishops == 2)
+        num_pawns = np.count_nonzero(pieces == _PIECE_TO_IDX_FULL[pawn])
+        if num_promoted > 8 - num_pawns:
+            return False
+    return True
 
 
 def _is_white_piece(probs_for_a_specific_square: list) -> bool:
@@ -1142,656 +842,375 @@ def _is_white_piece(probs_for_a_specific_square: list) -> bool:
     )
 
 
-def _determine_changed_squares(
-    previous_fen: str, probs_with_no_indices: list[list]
-) -> list[int]:
-    """Determine the squares that experienced a state change.
+def _possible_ep_squares(board: chess.Board) -> list[int]:
+    """Determine the possible en passant squares of a board position.
 
-    A square has three states: white (if it has a white piece on it),
-    black (if it has a black piece on it), and empty (if it is empty).
+    An en passant capture is only possible if the captured pawn could
+    have just moved two squares forward, i.e., if the square it moved
+    through and the square it moved from are empty.
 
-    This function determines the squares whose current states are
-    different from the previous ones.
+    :param board: Board position with the side to move set.
 
-    :param previous_fen: FEN string of the previous board position.
+    :return: List of the squares (of python-chess) behind the pawns of
+    the side not to move that could be captured en passant.
+    """
+    step = 8 if board.turn == chess.WHITE else -8
+    ep_rank = 5 if board.turn == chess.WHITE else 2
+    return [
+        square + step
+        for square in board.pieces(chess.PAWN, not board.turn)
+        if chess.square_rank(square + step) == ep_rank
+        and board.piece_at(square + step) is None
+        and board.piece_at(square + 2 * step) is None
+    ]
 
-    :param probs_with_no_indices: Length-64 list of piece probabilities.
 
-        Each element in the list is a length-13 sublist that corresponds
-        to a unique square on the chessboard.
+def _positions_after_moves(
+    board: chess.Board, moves: list[chess.Move]
+) -> list[chess.Board]:
+    """Determine the board positions after each of the given moves.
 
-        Each sublist contains 13 piece probabilities (in the order of
-        `_IDX_TO_PIECE_FULL`) for the corresponding square.
+    Promotions to a third piece of the same type are excluded, since a
+    standard physical chess set does not have it.
 
-        The probabilities come from the convolutional neural network
-        (see the `obtain_piece_probs_for_all_64_squares()` function
-        in "predict_board.py").
+    :param board: Board position before the moves.
+
+    :param moves: List of legal moves of the board position.
 
-    :return: List of integers specifying which squares on the chessboard
-    experienced a state change.
+    :return: List of the board positions after the moves.
 
-        `0` corresponds to the a8 square, `1` corresponds to the b8
-        square, ..., `63` corresponds to the h1 square.
+        The move stack of each position is that of `board` followed by
+        the move that leads to the position.
     """
-    previous_list = board_to_list(fen_to_board(previous_fen))
-    changed_squares = []
-    for idx, previous_piece in enumerate(previous_list):
-        # If a square's previous state is the same as its current one,
-        # ignore that square
-        if previous_piece == "_" and _is_empty_square(
-            probs_with_no_indices[idx]
-        ):
-            continue
+    positions = []
+    for move in moves:
+        position = board.copy()
+        position.push(move)
         if (
-            previous_piece in _WHITE_PIECES
-            and not _is_empty_square(probs_with_no_indices[idx])
-            and _is_white_piece(probs_with_no_indices[idx])
+            move.promotion is None
+            or chess.popcount(position.pieces_mask(move.promotion, board.turn))
+            <= 2
         ):
-            continue
-        if (
-            previous_piece in _BLACK_PIECES
-            and not _is_empty_square(probs_with_no_indices[idx])
-            and not _is_white_piece(probs_with_no_indices[idx])
-        ):
-            continue
-        # If the state of a square has changed, store the index of that
-        # square
-        changed_squares.append(idx)
-
-    return changed_squares
-
+            positions.append(position)
+    return positions
 
-def _determine_changed_squares_after_piece_inference(
-    previous_fen: str, predicted_piece_list: list[str]
-) -> list[int]:
-    """Determine, after piece inference, the changed-state squares.
 
-    This function determines, based on the piece-inference result, the
-    squares that experienced a state change.
+def _candidate_positions(previous_fen: str | chess.Board) -> list[chess.Board]:
+    """Determine the board positions that may follow the previous one.
 
-    A square has three states: white (if it has a white piece on it),
-    black (if it has a black piece on it), and empty (if it is empty).
-
-    This function determines the squares whose current states are
-    different from the previous ones.
+    The candidate positions are the previous board position itself (if
+    no move has been made) and the positions after each legal move of
+    either side (see `_positions_after_moves()`). Castling is legal if
+    the king and the rook are on their initial squares and en passant if
+    the captured pawn could have just moved (see
+    `_possible_ep_squares()`).
 
     :param previous_fen: FEN string of the previous board position.
 
-    :param predicted_piece_list: Length-64 list of inferred pieces.
-
-        The 64 inferred chess pieces are in the FEN-notation order (the
-        first element corresponds to the a8 square, the second to the b8
-        square, and so on).
+        The previous board position can also be given as a
+        `chess.Board`, in which case only the legal moves of its side to
+        move (with its castling rights and en passant square) are made.
 
-    :return: List of integers specifying which squares on the chessboard
-    experienced a state change.
+    :return: List of candidate board positions.
 
-        `0` corresponds to the a8 square, `1` corresponds to the b8
-        square, ..., `63` corresponds to the h1 square.
+        The move that leads to each position (if any) is in its move
+        stack.
     """
-    previous_list = board_to_list(fen_to_board(previous_fen))
-    changed_squares = []
-    for idx, previous_piece in enumerate(previous_list):
-        # If a square's previous state is the same as its current one,
-        # ignore that square
-        if previous_piece == "_" and predicted_piece_list[idx] == "_":
-            continue
-        if (
-            previous_piece in _WHITE_PIECES
-            and predicted_piece_list[idx] in _WHITE_PIECES
-        ):
-            continue
-        if (
-            previous_piece in _BLACK_PIECES
-            and predicted_piece_list[idx] in _BLACK_PIECES
-        ):
-            continue
-        # If the state of a square has changed, store the index of that
-        # square
-        changed_squares.append(idx)
-
-    return changed_squares
+    if isinstance(previous_fen, chess.Board):
+        board = previous_fen.copy(stack=False)
+        return [board] + _positions_after_moves(board, list(board.legal_moves))
+
+    positions = [parse_fen(previous_fen).board.copy()]
+    for turn in (chess.WHITE, chess.BLACK):
+        board = parse_fen(previous_fen).board.copy()
+        board.turn = turn
+        board.set_castling_fen("KQkq")
+        board.castling_rights = board.clean_castling_rights()
+        positions += _positions_after_moves(board, list(board.legal_moves))
+        for ep_square in _possible_ep_squares(board):
+            board.ep_square = ep_square
+            positions += _positions_after_moves(
+                board, list(board.generate_legal_ep())
+            )
+            board.ep_square = None
 
+    return positions
 
-def _detect_move(
-    previous_fen: str,
-    probs_with_no_indices: list[list],
-    changed_squares: list[int],
-) -> (tuple[int, int, str]) | None:
-    """Detect the move made.
-
-    This function detects what move (initial square, final square, and
-    action) was made by comparing the previous board position and the
-    current board position. Only the states of the squares are used for
-    inferring the move. A square has three states: white (if it has a
-    white piece on it), black (if it has a black piece on it), and empty
-    (if it is empty). If the function fails to detect the move, it
-    returns `None`.
 
-    :param previous_fen: FEN string of the previous board position.
+def _new_placements(
+    positions: list[chess.Board], scores: dict[tuple[int, ...], float]
+) -> dict[tuple[int, ...], chess.Board]:
+    """Group the board positions by their piece placement.
 
-    :param probs_with_no_indices: Length-64 list of piece probabilities.
+    :param positions: List of board positions.
 
-        Each element in the list is a length-13 sublist that corresponds
-        to a unique square on the chessboard.
+    :param scores: Log-likelihood of each piece placement scored so far.
 
-        Each sublist contains 13 piece probabilities (in the order of
-        `_IDX_TO_PIECE_FULL`) for the corresponding square.
+    :return: Dict that maps each piece placement (see
+    `_piece_placement()`) that is not in `scores` to the first of the
+    positions with it.
+    """
+    new_positions = {}
+    for position in positions:
+        placement = _piece_placement(position)
+        if placement not in scores:
+            new_positions.setdefault(placement, position)
+    return new_positions
 
-        The probabilities come from the convolutional neural network
-        (see the `obtain_piece_probs_for_all_64_squares()` function
-        in "predict_board.py").
 
-    :param changed_squares: List specifying changed-state squares.
+@functools.lru_cache(maxsize=_CANDIDATE_CACHE_SIZE)
+def _previous_fen_placements(
+    previous_fen: str,
+) -> tuple[dict[tuple[int, ...], chess.Board], np.ndarray]:
+    """Group the candidate positions of a FEN string by piece placement.
 
-        This list of integers specifies which squares on the chessboard
-        experienced a state change.
+    The previous FEN string usually stays the same for many frames, so
+    its candidate positions (see `_candidate_positions()`) and their
+    occupancy are only computed once while it stays among the
+    `_CANDIDATE_CACHE_SIZE` most recently used ones. They are shared, so
+    they must not be modified.
 
-    :return: (Initial-square index, final-square index, and action) or
-    `None`.
+    :param previous_fen: FEN string of the previous board position.
 
-        The inferred action is one of the following: `"white_moves"`,
-        `"white_captures"`, `"black_moves"`, `"black_captures"`,
-        `"white_en_passants"`, `"black_en_passants"`,
-        `"white_castles_kingside"`, `"white_castles_queenside"`,
-        `"black_castles_kingside"`, and `"black_castles_queenside"`.
+    :return: A pair formed by the candidate positions grouped by piece
+    placement (see `_new_placements()`) and their occupancy (see
+    `_position_occupancy()`).
     """
-    previous_list = board_to_list(fen_to_board(previous_fen))
-
-    if len(changed_squares) == 2:
-        # Determine which square is the initial and which is the final
-        if _is_empty_square(probs_with_no_indices[changed_squares[0]]):
-            initial_sq = changed_squares[0]
-            if not _is_empty_square(probs_with_no_indices[changed_squares[1]]):
-                final_sq = changed_squares[1]
-            else:
-                return None
-        elif _is_empty_square(probs_with_no_indices[changed_squares[1]]):
-            initial_sq = changed_squares[1]
-            if not _is_empty_square(probs_with_no_indices[changed_squares[0]]):
-                final_sq = changed_squares[0]
-            else:
-                return None
-        else:
-            return None
-
-        # We know that in the previous board, the initial square was
-        # occupied (now it is empty) and in the current board the final
-        # square is occupied
-        if previous_list[initial_sq] in _WHITE_PIECES:
-            if previous_list[final_sq] == "_":
-                if _is_white_piece(probs_with_no_indices[final_sq]):
-                    action = "white_moves"
-                    return initial_sq, final_sq, action
-                else:
-                    # A white piece can't suddenly turn into a black
-                    # piece after moving
-                    return None
-            elif previous_list[final_sq] in _BLACK_PIECES:
-                if _is_white_piece(probs_with_no_indices[final_sq]):
-                    action = "white_captures"
-                    return initial_sq, final_sq, action
-                else:
-                    # A white piece can't suddenly turn into a black
-                    # piece after capturing
-                    return None
-            else:
-                return None  # A white piece can't capture another white piece
-        else:  # The initial square is a black piece
-            if previous_list[final_sq] == "_":
-                if not _is_white_piece(probs_with_no_indices[final_sq]):
-                    action = "black_moves"
-                    return initial_sq, final_sq, action
-                else:
-                    # A black piece can't suddenly turn into a white
-                    # piece after moving
-                    return None
-            elif previous_list[final_sq] in _WHITE_PIECES:
-                if not _is_white_piece(probs_with_no_indices[final_sq]):
-                    action = "black_captures"
-                    return initial_sq, final_sq, action
-                else:
-                    # A black piece can't suddenly turn into a white
-                    # piece after capturing
-                    return None
-            else:
-                return None  # A black piece can't capture another black piece
-
-    elif len(changed_squares) == 3:  # An en passant move may have been made
-        # Determine the initial square, the final square, and the third
-        # square
-        if not _is_empty_square(probs_with_no_indices[changed_squares[0]]):
-            final_sq = changed_squares[0]
-            if previous_list[changed_squares[1]] == "P" and _is_white_piece(
-                probs_with_no_indices[final_sq]
-            ):
-                initial_sq = changed_squares[1]
-                third_sq = changed_squares[2]
-            elif previous_list[
-                changed_squares[1]
-            ] == "p" and not _is_white_piece(probs_with_no_indices[final_sq]):
-                initial_sq = changed_squares[1]
-                third_sq = changed_squares[2]
-            elif previous_list[changed_squares[2]] == "P" and _is_white_piece(
-                probs_with_no_indices[final_sq]
-            ):
-                initial_sq = changed_squares[2]
-                third_sq = changed_squares[1]
-            elif previous_list[
-                changed_squares[2]
-            ] == "p" and not _is_white_piece(probs_with_no_indices[final_sq]):
-                initial_sq = changed_squares[2]
-                third_sq = changed_squares[1]
-            else:
-                return None
-        elif not _is_empty_square(probs_with_no_indices[changed_squares[1]]):
-            final_sq = changed_squares[1]
-            if previous_list[changed_squares[0]] == "P" and _is_white_piece(
-                probs_with_no_indices[final_sq]
-            ):
-                initial_sq = changed_squares[0]
-                third_sq = changed_squares[2]
-            elif previous_list[
-                changed_squares[0]
-            ] == "p" and not _is_white_piece(probs_with_no_indices[final_sq]):
-                initial_sq = changed_squares[0]
-                third_sq = changed_squares[2]
-            elif previous_list[changed_squares[2]] == "P" and _is_white_piece(
-                probs_with_no_indices[final_sq]
-            ):
-                initial_sq = changed_squares[2]
-                third_sq = changed_squares[0]
-            elif previous_list[
-                changed_squares[2]
-            ] == "p" and not _is_white_piece(probs_with_no_indices[final_sq]):
-                initial_sq = changed_squares[2]
-                third_sq = changed_squares[0]
-            else:
-                return None
-        elif not _is_empty_square(probs_with_no_indices[changed_squares[2]]):
-            final_sq = changed_squares[2]
-            if previous_list[changed_squares[0]] == "P" and _is_white_piece(
-                probs_with_no_indices[final_sq]
-            ):
-                initial_sq = changed_squares[0]
-                third_sq = changed_squares[1]
-            elif previous_list[
-                changed_squares[0]
-            ] == "p" and not _is_white_piece(probs_with_no_indices[final_sq]):
-                initial_sq = changed_squares[0]
-                third_sq = changed_squares[1]
-            elif previous_list[changed_squares[1]] == "P" and _is_white_piece(
-                probs_with_no_indices[final_sq]
-            ):
-                initial_sq = changed_squares[1]
-                third_sq = changed_squares[0]
-            elif previous_list[
-                changed_squares[1]
-            ] == "p" and not _is_white_piece(probs_with_no_indices[final_sq]):
-                initial_sq = changed_squares[1]
-                third_sq = changed_squares[0]
-            else:
-                return None
-        else:
-            return None
-
-        # Determine the action
-        if previous_list[initial_sq] == "P" and previous_list[third_sq] == "p":
-            action = "white_en_passants"
-            return initial_sq, final_sq, action
-        elif (
-            previous_list[initial_sq] == "p" and previous_list[third_sq] == "P"
-        ):
-            action = "black_en_passants"
-            return initial_sq, final_sq, action
-        else:
-            return None
-
-    elif len(changed_squares) == 4:  # A castling move may have been made
-        # Determine which square is the initial and which is the final
-        # (the initial and final squares of the king, not the rook, as
-        # per the UCI notation)
-        if previous_list[changed_squares[0]] in ["K", "k"]:
-            initial_sq = changed_squares[0]
-            if (
-                previous_list[changed_squares[1]] == "_"
-                and abs(changed_squares[1] - changed_squares[0]) == 2
-            ):
-                final_sq = changed_squares[1]
-            elif (
-                previous_list[changed_squares[2]] == "_"
-                and abs(changed_squares[2] - changed_squares[0]) == 2
-            ):
-                final_sq = changed_squares[2]
-            elif (
-                previous_list[changed_squares[3]] == "_"
-                and abs(changed_squares[3] - changed_squares[0]) == 2
-            ):
-                final_sq = changed_squares[3]
-            else:
-                return None
-        elif previous_list[changed_squares[1]] in ["K", "k"]:
-            initial_sq = changed_squares[1]
-            if (
-                previous_list[changed_squares[0]] == "_"
-                and abs(changed_squares[0] - changed_squares[1]) == 2
-            ):
-                final_sq = changed_squares[0]
-            elif (
-                previous_list[changed_squares[2]] == "_"
-                and abs(changed_squares[2] - changed_squares[1]) == 2
-            ):
-                final_sq = changed_squares[2]
-            elif (
-                previous_list[changed_squares[3]] == "_"
-                and abs(changed_squares[3] - changed_squares[1]) == 2
-            ):
-                final_sq = changed_squares[3]
-            else:
-                return None
-        elif previous_list[changed_squares[2]] in ["K", "k"]:
-            initial_sq = changed_squares[2]
-            if (
-                previous_list[changed_squares[0]] == "_"
-                and abs(changed_squares[0] - changed_squares[2]) == 2
-            ):
-                final_sq = changed_squares[0]
-            elif (
-                previous_list[changed_squares[1]] == "_"
-                and abs(changed_squares[1] - changed_squares[2]) == 2
-            ):
-                final_sq = changed_squares[1]
-            elif (
-                previous_list[changed_squares[3]] == "_"
-                and abs(changed_squares[3] - changed_squares[2]) == 2
-            ):
-                final_sq = changed_squares[3]
-            else:
-                return None
-        elif previous_list[changed_squares[3]] in ["K", "k"]:
-            initial_sq = changed_squares[3]
-            if (
-                previous_list[changed_squares[0]] == "_"
-                and abs(changed_squares[0] - changed_squares[3]) == 2
-            ):
-                final_sq = changed_squares[0]
-            elif (
-                previous_list[changed_squares[1]] == "_"
-                and abs(changed_squares[1] - changed_squares[3]) == 2
-            ):
-                final_sq = changed_squares[1]
-            elif (
-                previous_list[changed_squares[2]] == "_"
-                and abs(changed_squares[2] - changed_squares[3]) == 2
-            ):
-                final_sq = changed_squares[2]
-            else:
-                return None
-        else:
-            return None
-
-        # Determine the action
-        if previous_list[initial_sq] == "K" and final_sq == 62:
-            action = "white_castles_kingside"
-            return initial_sq, final_sq, action
-        elif previous_list[initial_sq] == "K" and final_sq == 58:
-            action = "white_castles_queenside"
-            return initial_sq, final_sq, action
-        elif previous_list[initial_sq] == "k" and final_sq == 6:
-            action = "black_castles_kingside"
-            return initial_sq, final_sq, action
-        elif previous_list[initial_sq] == "k" and final_sq == 2:
-            action = "black_castles_queenside"
-            return initial_sq, final_sq, action
-        else:
-            return None
-
-    else:  # The number of changed-state squares is neither 2, 3, nor 4
-        return None
+    positions = _new_placements(_candidate_positions(previous_fen), {})
+    occupancy = _position_occupancy(list(positions.values()))
+    occupancy.flags.writeable = False
+    return positions, occupancy
 
 
-def _is_king_move(
-    initial_sq: tuple[int, int], final_sq: tuple[int, int]
-) -> bool:
-    """Determine if the move could have been a king move.
+def _position_occupancy(positions: list[chess.Board]) -> np.ndarray:
+    """Compute the occupancy of each square by each piece type.
 
-    A king can move at most one square in any direction (horizontally,
-    vertically, or diagonally).
+    :param positions: List of board positions.
 
-    :param initial_sq: Row and column indices of the initial square.
-
-        The `0` row index corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+    :return: Array of shape (len(positions), 12, 64) whose element
+    (i, j, k) specifies whether the k-th square (of python-chess) of the
+    i-th position has the j-th piece of `_CHESS_PIECES`.
+    """
+    bitboards = np.array(
+        [
+            [
+                position.pieces_mask(piece.piece_type, piece.color)
+                for piece in _CHESS_PIECES
+            ]
+            for position in positions
+        ],
+        dtype="<u8",
+    )
+    return np.unpackbits(
+        bitboards.view(np.uint8).reshape(len(positions), 12, 8),
+        axis=2,
+        bitorder="little",
+    )
 
-    :param final_sq: Row and column indices of the final square.
 
-        The `0` row index of corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+def _piece_placement(position: chess.Board) -> tuple[int, ...]:
+    """Return the bitboards of the piece placement of a board position.
 
-    :return: Whether the move given by the initial and final squares
-    could have been a king move.
+    Unlike `chess.Board.board_fen()`, this is cheap enough to identify
+    each of the many positions of the move search.
     """
     return (
-        abs(initial_sq[0] - final_sq[0]) <= 1
-        and abs(initial_sq[1] - final_sq[1]) <= 1
+        position.occupied_co[chess.WHITE],
+        position.pawns,
+        position.knights,
+        position.bishops,
+        position.rooks,
+        position.queens,
+        position.kings,
     )
 
 
-def _is_rook_move(
-    initial_sq: tuple[int, int], final_sq: tuple[int, int]
-) -> bool:
-    """Determine if the move could have been a rook move.
-
-    A rook can move any number of squares (without jumping over any
-    piece) along the same rank or file.
-
-    :param initial_sq: Row and column indices of the initial square.
+def _position_log_likelihoods(
+    positions: list[chess.Board], log_probs: np.ndarray
+) -> np.ndarray:
+    """Compute the log-likelihoods of the board positions.
 
-        The `0` row index corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+    :param positions: List of board positions.
 
-    :param final_sq: Row and column indices of the final square.
+    :param log_probs: (64, 13) array of piece log-probabilities of the
+    squares of python-chess (from a1 to h8).
 
-        The `0` row index of corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
-
-    :return: Whether the move given by the initial and final squares
-    could have been a rook move.
+    :return: Array of the log-likelihoods of the positions.
     """
-    return initial_sq[0] == final_sq[0] or initial_sq[1] == final_sq[1]
-
-
-def _is_bishop_move(
-    initial_sq: tuple[int, int], final_sq: tuple[int, int]
-) -> bool:
-    """Determine if the move could have been a bishop move.
-
-    A bishop can move any number of squares (without jumping over any
-    piece) diagonally.
+    return _occupancy_log_likelihoods(
+        _position_occupancy(positions), log_probs
+    )
 
-    :param initial_sq: Row and column indices of the initial square.
 
-        The `0` row index corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+def _occupancy_log_likelihoods(
+    occupancy: np.ndarray, log_probs: np.ndarray
+) -> np.ndarray:
+    """Compute the log-likelihoods of the board positions.
 
-    :param final_sq: Row and column indices of the final square.
+    :param occupancy: Occupancy of the board positions (see
+    `_position_occupancy()`).
 
-        The `0` row index of corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+    :param log_probs: (64, 13) array of piece log-probabilities of the
+    squares of python-chess (from a1 to h8).
 
-    :return: Whether the move given by the initial and final squares
-    could have been a bishop move.
+    :return: Array of the log-likelihoods of the positions.
     """
     return (
-        (initial_sq[0] - initial_sq[1] == final_sq[0] - final_sq[1])
-        # The move is parallel to the a8-h1 diagonal
-    ) or (
-        (initial_sq[0] + initial_sq[1] == final_sq[0] + final_sq[1])
-        # The move is parallel to the a1-h8 diagonal
+        np.einsum("ijk,kj->i", occupancy, log_probs[:, _CHESS_PIECE_COLUMNS])
+        + (1 - np.sum(occupancy, axis=1))
+        @ log_probs[:, _PIECE_TO_IDX_FULL["_"]]
     )
 
 
-def _is_knight_move(
-    initial_sq: tuple[int, int], final_sq: tuple[int, int]
-) -> bool:
-    """Determine if the move could have been a knight move.
-
-    A knight moves in an L-shape (diagonal of a 2x3 rectangle) fashion.
-
-    :param initial_sq: Row and column indices of the initial square.
+def _square_states(probs_with_no_indices: np.ndarray) -> np.ndarray:
+    """Determine the states of the squares from their probabilities.
 
-        The `0` row index corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+    :param probs_with_no_indices: (64, 13) array of piece probabilities
+    of the squares (from a8 to h1).
 
-    :param final_sq: Row and column indices of the final square.
-
-        The `0` row index of corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
-
-    :return: Whether the move given by the initial and final squares
-    could have been a knight move.
+    :return: Length-64 array of the states of the squares of
+    python-chess (0 for empty, 1 for white, and 2 for black).
     """
-    row_d = abs(initial_sq[0] - final_sq[0])  # This is the distance in ranks
-    col_d = abs(initial_sq[1] - final_sq[1])  # This is the distance in files
-    return (row_d == 1 and col_d == 2) or (row_d == 2 and col_d == 1)
-
-
-def _is_pawn_move(
-    initial_sq: tuple[int, int],
-    final_sq: tuple[int, int],
-    capturing: bool,
-    white: bool,
-) -> bool:
-    """Determine if the move could have been a pawn move.
-
-    A pawn can move one square (or two squares if it hasn't moved yet)
-    forward along the same file (or two if it hasn't moved yet) and
-    capture one square forward diagonally.
-
-    :param initial_sq: Row and column indices of the initial square.
-
-        The `0` row index corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+    probs = np.asarray(probs_with_no_indices)[_CHESS_SQUARE_INDICES]
+    return np.where(
+        np.argmax(probs, axis=1) == _PIECE_TO_IDX_FULL["_"],
+        0,
+        np.where(
+            np.sum(probs[:, :6], axis=1) >= np.sum(probs[:, 7:], axis=1), 1, 2
+        ),
+    )
 
-    :param final_sq: Row and column indices of the final square.
 
-        The `0` row index of corresponds to the 8th rank, and the `0`
-        column index corresponds to the a file.
+def _count_state_mismatches(position: chess.Board, states: np.ndarray) -> int:
+    """Count the squares whose state differs from the given states.
 
-    :param capturing: Whether the move was a capture.
+    :param position: Board position.
 
-    :param white: Whether it was white to move.
+    :param states: Length-64 array of the states of the squares of
+    python-chess (0 for empty, 1 for white, and 2 for black).
 
-    :return: Whether the move given by the initial and final squares
-    could have been a pawn move.
+    :return: Number of squares of `position` whose state differs from
+    the one in `states`.
     """
-    if white:
-        if capturing:
-            return (
-                initial_sq[0] - final_sq[0] == 1
-                and abs(initial_sq[1] - final_sq[1]) == 1
-            )
-        else:
-            return initial_sq[1] == final_sq[1] and (
-                initial_sq[0] - final_sq[0] == 1
-                or (initial_sq[0] - final_sq[0] == 2 and initial_sq[0] == 6)
-            )
-    else:
-        if capturing:
-            return (
-                initial_sq[0] - final_sq[0] == -1
-                and abs(initial_sq[1] - final_sq[1]) == 1
-            )
-        else:
-            return initial_sq[1] == final_sq[1] and (
-                initial_sq[0] - final_sq[0] == -1
-                or (initial_sq[0] - final_sq[0] == -2 and initial_sq[0] == 1)
-            )
-
+    occupancy = _position_occupancy([position])[0]
+    white = np.any(occupancy[_CHESS_WHITE_PIECES], axis=0)
+    black = np.any(occupancy[np.logical_not(_CHESS_WHITE_PIECES)], axis=0)
+    position_states = np.where(white, 1, np.where(black, 2, 0))
+    return np.count_nonzero(states != position_states)
+
+
+def _detect_legal_move(
+    previous_fen: str | chess.Board,
+    probs_with_no_indices: np.ndarray,
+    max_plies: int = 1,
+    beam_width: int = _MOVE_BEAM_WIDTH,
+) -> chess.Board | None:
+    """Detect the move made by scoring the legal moves.
+
+    This function scores the board position after each legal move of
+    either side (see `_candidate_positions()`) by its log-likelihood
+    given the piece probabilities, all at once, and accepts the most
+    likely one if it is clearly more likely than the rest and consistent
+    with the states of the squares. It covers all of the moves
+    (including promotions, castling, and en passant) in one pass and
+    tolerates a misclassified square. If the function fails to detect
+    the move, it returns `None`.
+
+    Several plies may have been made since the previous board position
+    (e.g., if frames have been dropped). If no position is accepted, a
+    beam search goes on from the `beam_width` most likely positions of
+    the last ply, with the other side to move, for up to `max_plies`
+    plies in total. Each piece placement is scored only once, however
+    many move sequences lead to it, and all of the positions found so
+    far compete for acceptance, so the fewest plies that explain the
+    probabilities are preferred.
 
-def _infer_possible_pieces_from_move(
-    initial_sq: int, final_sq: int, action: str
-) -> list[str]:
-    """Infer the possible piece types that could occupy a square.
-
-    This function infers, based on the detected move, the possible piece
-    types that could occupy the final square.
+    :param previous_fen: FEN string of the previous board position.
 
-    Note: since the conclude-fen-immediately-after-move-detection
-    feature has been added, this function is no longer used in the code.
+        The previous board position can also be given as a
+        `chess.Board` (see `_candidate_positions()`).
 
-    :param initial_sq: Integer specifying the initial square.
+    :param probs_with_no_indices: (64, 13) array of piece probabilities.
 
-        The integer must be between `0` and `63`.
+        Each row contains the 13 piece probabilities (in the order of
+        `_IDX_TO_PIECE_FULL`) for the corresponding square (from a8 to
+        h1).
 
-    :param final_sq: Integer specifying the final square.
+    :param max_plies: Max. number of plies since the previous position.
 
-        The integer must be between `0` and `63`.
+    :param beam_width: Number of positions expanded in each ply.
 
-    :param action: What action was detected.
+    :return: Board position after the detected moves or `None`.
 
-    :return: List of distinct piece types that could possibly occupy the
-    final square.
+        The detected moves are in the move stack of the position, which
+        is empty if the position has not changed. The position may be
+        shared with later calls (see `_previous_fen_placements()`), so
+        it must not be modified.
     """
-    initial_row_and_col = (
-        initial_sq // 8,
-        initial_sq % 8,
-    )  # (row index, column index)
-    final_row_and_col = (final_sq // 8, final_sq % 8)
+    # Log-probabilities of the squares of python-chess
+    log_probs = np.log(np.maximum(probs_with_no_indices, _MIN_PROB))[
+        _CHESS_SQUARE_INDICES
+    ]
 
-    capturing = action.endswith("captures") | action.endswith("en_passants")
-    white = action.startswith("white")
-    castling = action[6:13] == "castles"
+    states = _square_states(probs_with_no_indices)
 
-    possible_pieces = []  # There can't be duplicates
+    # Log-likelihood and first position found of each piece placement
+    scores = {}
+    positions = {}
 
-    if white:
-        if castling:
-            possible_pieces.append("K")
-            return possible_pieces
+    for ply in range(max_plies):
+        if ply == 0 and isinstance(previous_fen, str):
+            # We reuse the candidate positions of the previous FEN
+            new_positions, occupancy = _previous_fen_placements(previous_fen)
+        else:
+            if ply == 0:
+                beam = _candidate_positions(previous_fen)
+            else:
+                beam = [
+                    child
+                    for position in beam
+                    for child in _positions_after_moves(
+                        position, list(position.legal_moves)
+                    )
+                ]
+            new_positions = _new_placements(beam, scores)
+            occupancy = _position_occupancy(list(new_positions.values()))
+
+        if new_positions:
+            positions.update(new_positions)
+            scores.update(
+                zip(
+                    new_positions,
+                    _occupancy_log_likelihoods(occupancy, log_probs).tolist(),
+                )
+            )
 
-        if _is_pawn_move(
-            initial_row_and_col, final_row_and_col, capturing, white
-        ):
-            if final_row_and_col[0] == 0:
-                # If the move ends in the last row, promotions apply, so
-                # the result no longer is a pawn. This move also
-                # corresponds with a king, so the result can be all
-                # pieces except for the pawn. In this case we don't need
-                # to check the rest of the pieces.
-                return ["K", "R", "B", "Q", "N"]
-            possible_pieces.append("P")
-        if _is_king_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("K")
-        if _is_rook_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("R")
-            possible_pieces.append("Q")
-        if _is_bishop_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("B")
-            # Bishop and rook moves are exclusive, so Q is not in
-            # possible pieces
-            possible_pieces.append("Q")
-        if _is_knight_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("N")
-    else:  # black
-        if castling:
-            possible_pieces.append("k")
-            return possible_pieces
-
-        if _is_pawn_move(
-            initial_row_and_col, final_row_and_col, capturing, white
+        placements = list(scores)
+        log_likelihoods = np.array(list(scores.values()))
+        order = np.argsort(-log_likelihoods, kind="stable")
+        best = positions[placements[order[0]]]
+        is_clearly_best = (
+            len(order) == 1
+            or log_likelihoods[order[0]] - log_likelihoods[order[1]]
+            >= _MOVE_LOG_LIKELIHOOD_MARGIN
+        )
+        if (
+            is_clearly_best
+            and _count_state_mismatches(best, states)
+            <= _MAX_MOVE_STATE_MISMATCHES
         ):
-            if final_row_and_col[0] == 7:
-                return ["k", "r", "b", "q", "n"]
-            possible_pieces.append("p")
-        if _is_king_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("k")
-        if _is_rook_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("r")
-            possible_pieces.append("q")
-        if _is_bishop_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("b")
-            possible_pieces.append("q")
-        if _is_knight_move(initial_row_and_col, final_row_and_col):
-            possible_pieces.append("n")
-    return possible_pieces
+            return best
+
+        # The previous position itself is not expanded, since the
+        # positions after its moves have already been scored
+        beam = sorted(
+            (
+                position
+                for position in new_positions.values()
+                if position.move_stack
+            ),
+            key=lambda position: -scores[_piece_placement(position)],
+        )[:beam_width]
+
+    return None
+
@@ -0,0 +1,118 @@
+"""This module is responsible for streaming the moves of a game.
+
+Specifically, it keeps the state of a game whose moves are detected
+frame by frame (see `TemporalDecoder`) and prints each move as soon as
+it is committed, as a line with its UCI and SAN notations, instead of
+the FEN string of every board position. The FEN string is only printed
+when a game starts.
+
+The game is also written to a PGN file, to which the moves are appended
+in batches so that the disk is not written for every move.
+"""
+
+
+import time
+
+import chess
+import chess.pgn
+
+
+FLUSH_MOVES = 8  # Number of moves appended to the PGN file at once
+
+
+class MoveStream:
+    """Represent the move stream of the games of an image source.
+
+    The side to move in the initial board position of a game is only
+    known once its first move is committed, so the game state is created
+    then.
+    """
+
+    def __init__(
+        self, pgn_path: (str | None) = None, flush_moves: int = FLUSH_MOVES
+    ):
+        """Initialize an instance of the `MoveStream`.
+
+        :param pgn_path: Path to the PGN file to which the games are
+        appended.
+
+            If it is `None`, the games are only printed.
+
+        :param flush_moves: Number of moves appended to the PGN file at
+        once.
+        """
+        self.pgn_path = pgn_path
+        self.flush_moves = flush_moves
+        self.fen = None  # FEN string of the initial board position
+        self.board = None  # Game state (`None` until the first move)
+        self.pending = []  # PGN text not yet written to the file
+        self.num_pending_moves = 0
+
+    def start(self, fen: str):
+        """Start a new game, ending the current one (if any).
+
+        :param fen: FEN string of the initial board position.
+        """
+        self.end()
+        self.fen = fen
+        print(fen)
+
+    def push(self, moves: list[chess.Move]):
+        """Print the moves and add them to the game.
+
+        :param moves: List of legal moves of the game (e.g., the moves
+        committed by `TemporalDecoder.update()`).
+        """
+        for move in moves:
+            if self.board is None:
+                self.__start_board(move)
+
+            san = self.board.san(move)
+            print(move.uci(), san)
+            if self.board.turn == chess.WHITE:
+                self.pending.append(f"{self.board.fullmove_number}. {san}")
+            elif not self.board.move_stack:
+                self.pending.append(f"{self.board.fullmove_number}... {san}")
+            else:
+                self.pending.append(san)
+            self.board.push(move)
+            self.num_pending_moves += 1
+
+        if self.num_pending_moves >= self.flush_moves:
+            self.flush()
+
+    def __start_board(self, first_move: chess.Move):
+        """Create the game state and the PGN headers of the game."""
+        self.board = chess.Board(self.fen)
+        self.board.set_castling_fen("KQkq")
+        self.board.castling_rights = self.board.clean_castling_rights()
+        self.board.turn = self.board.color_at(first_move.from_square)
+
+        game = chess.pgn.Game()
+        game.headers["Date"] = time.strftime("%Y.%m.%d")
+        game.setup(self.board)
+        self.pending += [
+            f'[{tag} "{value}"]\n' for tag, value in game.headers.items()
+        ]
+        self.pending.append("\n")
+
+    def flush(self):
+        """Append the pending moves to the PGN file."""
+        if self.pgn_path is not None and self.pending:
+            with open(self.pgn_path, "a") as pgn_file:
+                pgn_file.write(
+                    " ".join(self.pending).replace("\n ", "\n") + "\n"
+                )
+        self.pending = []
+        self.num_pending_moves = 0
+
+    def end(self):
+        """End the current game (if any has started).
+
+        The result of the game is unknown (`"*"`), since the headers of
+        the game are written before it ends.
+        """
+        if self.board is not None:
+            self.pending.append("*\n")
+            self.flush()
+        self.board = None
@@ -7,12 +7,10 @@ import re
 import shutil
 import time
 
-import cv2
 import numpy as np
 import onnxruntime
 from keras.models import load_model
 from keras.utils.image_utils import load_img, img_to_array
-import chess
 
 try:
     import pycuda.driver as cuda
@@ -25,16 +23,27 @@ except ImportError:
     cuda = None
     trt = None
 
-from lc2fen.detectboard.detect_board import detect, compute_corners
+from lc2fen.corner_cache import load_corners, save_corners
+from lc2fen.detectboard.detect_board import (
+    BOARDS_LAYER_HEIGHTS,
+    LAYER_HEIGHTS,
+    compute_corners,
+    detect,
+    detect_boards,
+)
+from lc2fen.detectboard.image_object import quad_side
 from lc2fen.fen import (
     list_to_board,
     board_to_fen,
     compare_fen,
-    is_light_square,
-    fen_to_board,
-    board_to_list,
+    parse_fen,
+)
+from lc2fen.infer_pieces import (
+    TemporalDecoder,
+    infer_chess_pieces,
+    infer_chess_pieces_batch,
 )
-from lc2fen.infer_pieces import infer_chess_pieces
+from lc2fen.move_stream import MoveStream
 from lc2fen.split_board import split_board_image_trivial
 
 
@@ -66,7 +75,15 @@ def predict_board_keras(
     a1_pos="",
     test=False,
     previous_fen: (str | None) = None,
-) -> tuple[str, list[list[int]]] | None:
+    corner_cache: (str | None) = None,
+    pgn_path: (str | None) = None,
+    max_boards: int = 1,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: (tuple[int, ...] | None) = None,
+) -> (
+    tuple[str, list[list[int]]] | list[tuple[str, list[list[int]]]] | None
+):
     """Predict FEN(s) from board image(s) using Keras for inference.
 
     This function predicts FEN string(s) from chessboard image(s) using
@@ -102,10 +119,40 @@ def predict_board_keras(
         This parameter is only used when `path` points to a single image
         and `test` is `False`.
 
+    :param corner_cache: Path to the board-corner cache file.
+
+        This parameter is only used when `path` points to a folder and
+        `test` is `False` (see `continuous_predictions()`).
+
+    :param pgn_path: Path to the PGN file of the detected games.
+
+        This parameter is only used when `path` points to a folder and
+        `test` is `False` (see `continuous_predictions()`).
+
+    :param max_boards: Max. number of boards detected.
+
+        If it is greater than 1, up to `max_boards` boards are detected
+        in the image (see `predict_boards()`). This parameter is only
+        used when `path` points to a single image and `test` is `False`.
+
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect()`).
+
+        If it is `None`, the default of `detect()` (or of
+        `detect_boards()` if several boards are detected) is used.
+
     :return: A pair formed by the predicted FEN string, the coordinates
     of the corners of the chessboard in the input image for single-FEN
     prediction.
 
+        If `max_boards` is greater than 1, the function returns a list
+        of such pairs, one for each board detected.
+
         If `test` is `True`, the function returns `None`.
 
         If `path` points to a folder, the function does not return.
@@ -126,7 +173,24 @@ def predict_board_keras(
     else:
         if os.path.isdir(path):
             return continuous_predictions(
-                path, a1_pos, obtain_piece_probs_for_all_64_squares
+                path,
+                a1_pos,
+                obtain_piece_probs_for_all_64_squares,
+                corner_cache,
+                pgn_path,
+                min_layers,
+                max_layers,
+                layer_heights or LAYER_HEIGHTS,
+            )
+        elif max_boards > 1:
+            return predict_boards(
+                path,
+                a1_pos,
+                obtain_piece_probs_for_all_64_squares,
+                max_boards=max_boards,
+                min_layers=min_layers,
+                max_layers=max_layers,
+                layer_heights=layer_heights or BOARDS_LAYER_HEIGHTS,
             )
         else:
             return predict_board(
@@ -134,6 +198,9 @@ def predict_board_keras(
                 a1_pos,
                 obtain_piece_probs_for_all_64_squares,
                 previous_fen=previous_fen,
+                min_layers=min_layers,
+                max_layers=max_layers,
+                layer_heights=layer_heights or LAYER_HEIGHTS,
             )
 
 
@@ -145,7 +212,15 @@ def predict_board_onnx(
     a1_pos="",
     test=False,
     previous_fen: (str | None) = None,
-) -> tuple[str, list[list[int]]] | None:
+    corner_cache: (str | None) = None,
+    pgn_path: (str | None) = None,
+    max_boards: int = 1,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: (tuple[int, ...] | None) = None,
+) -> (
+    tuple[str, list[list[int]]] | list[tuple[str, list[list[int]]]] | None
+):
     """Predict FEN(s) from board image(s) using ONNX for inference.
 
     This function predicts FEN string(s) from chessboard image(s) using
@@ -181,10 +256,40 @@ def predict_board_onnx(
         This parameter is only used when `path` points to a single image
         and `test` is `False`.
 
+    :param corner_cache: Path to the board-corner cache file.
+
+        This parameter is only used when `path` points to a folder and
+        `test` is `False` (see `continuous_predictions()`).
+
+    :param pgn_path: Path to the PGN file of the detected games.
+
+        This parameter is only used when `path` points to a folder and
+        `test` is `False` (see `continuous_predictions()`).
+
+    :param max_boards: Max. number of boards detected.
+
+        If it is greater than 1, up to `max_boards` boards are detected
+        in the image (see `predict_boards()`). This parameter is only
+        used when `path` points to a single image and `test` is `False`.
+
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect()`).
+
+        If it is `None`, the default of `detect()` (or of
+        `detect_boards()` if several boards are detected) is used.
+
     :return: A pair formed by the predicted FEN string, the coordinates
     of the corners of the chessboard in the input image for single-FEN
     prediction.
 
+        If `max_boards` is greater than 1, the function returns a list
+        of such pairs, one for each board detected.
+
         If `test` is `True`, the function returns `None`.
 
         If `path` points to a folder, the function does not return.
@@ -207,7 +312,24 @@ def predict_board_onnx(
     else:
         if os.path.isdir(path):
             return continuous_predictions(
-                path, a1_pos, obtain_piece_probs_for_all_64_squares
+                path,
+                a1_pos,
+                obtain_piece_probs_for_all_64_squares,
+                corner_cache,
+                pgn_path,
+                min_layers,
+                max_layers,
+                layer_heights or LAYER_HEIGHTS,
+            )
+        elif max_boards > 1:
+            return predict_boards(
+                path,
+                a1_pos,
+                obtain_piece_probs_for_all_64_squares,
+                max_boards=max_boards,
+                min_layers=min_layers,
+                max_layers=max_layers,
+                layer_heights=layer_heights or BOARDS_LAYER_HEIGHTS,
             )
         else:
             return predict_board(
@@ -215,6 +337,9 @@ def predict_board_onnx(
                 a1_pos,
                 obtain_piece_probs_for_all_64_squares,
                 previous_fen=previous_fen,
+                min_layers=min_layers,
+                max_layers=max_layers,
+                layer_heights=layer_heights or LAYER_HEIGHTS,
             )
 
 
@@ -226,7 +351,15 @@ def predict_board_trt(
     a1_pos="",
     test=False,
     previous_fen: (str | None) = None,
-) -> tuple[str, list[list[int]]] | None:
+    corner_cache: (str | None) = None,
+    pgn_path: (str | None) = None,
+    max_boards: int = 1,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: (tuple[int, ...] | None) = None,
+) -> (
+    tuple[str, list[list[int]]] | list[tuple[str, list[list[int]]]] | None
+):
     """Predict FEN(s) from board image(s) using TensorRT for inference.
 
     This function predicts FEN string(s) from chessboard image(s) using
@@ -264,10 +397,40 @@ def predict_board_trt(
         This parameter is only used when `path` points to a single image
         and `test` is `False`.
 
+    :param corner_cache: Path to the board-corner cache file.
+
+        This parameter is only used when `path` points to a folder and
+        `test` is `False` (see `continuous_predictions()`).
+
+    :param pgn_path: Path to the PGN file of the detected games.
+
+        This parameter is only used when `path` points to a folder and
+        `test` is `False` (see `continuous_predictions()`).
+
+    :param max_boards: Max. number of boards detected.
+
+        If it is greater than 1, up to `max_boards` boards are detected
+        in the image (see `predict_boards()`). This parameter is only
+        used when `path` points to a single image and `test` is `False`.
+
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect()`).
+
+        If it is `None`, the default of `detect()` (or of
+        `detect_boards()` if several boards are detected) is used.
+
     :return: A pair formed by the predicted FEN string, the coordinates
     of the corners of the chessboard in the input image for single-FEN
     prediction.
 
+        If `max_boards` is greater than 1, the function returns a list
+        of such pairs, one for each board detected.
+
         If `test` is `True`, the function returns `None`.
 
         If `path` points to a folder, the function does not return.
@@ -358,7 +521,24 @@ def predict_board_trt(
         else:
             if os.path.isdir(path):
                 return continuous_predictions(
-                    path, a1_pos, obtain_piece_probs_for_all_64_squares
+                    path,
+                    a1_pos,
+                    obtain_piece_probs_for_all_64_squares,
+                    corner_cache,
+                    pgn_path,
+                    min_layers,
+                    max_layers,
+                    layer_heights or LAYER_HEIGHTS,
+                )
+            elif max_boards > 1:
+                return predict_boards(
+                    path,
+                    a1_pos,
+                    obtain_piece_probs_for_all_64_squares,
+                    max_boards=max_boards,
+                    min_layers=min_layers,
+                    max_layers=max_layers,
+                    layer_heights=layer_heights or BOARDS_LAYER_HEIGHTS,
                 )
             else:
                 return predict_board(
@@ -366,6 +546,9 @@ def predict_board_trt(
                     a1_pos,
                     obtain_piece_probs_for_all_64_squares,
                     previous_fen=previous_fen,
+                    min_layers=min_layers,
+                    max_layers=max_layers,
+                    layer_heights=layer_heights or LAYER_HEIGHTS,
                 )
 
 
@@ -375,6 +558,9 @@ def predict_board(
     obtain_piece_probs_for_all_64_squares,
     board_corners: (list[list[int]] | None) = None,
     previous_fen: (str | None) = None,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: tuple[int, ...] = LAYER_HEIGHTS,
 ) -> tuple[str, list[list[int]]]:
     """Predict the FEN string from a chessboard image.
 
@@ -413,37 +599,169 @@ def predict_board(
         If it is not `None`, it could significantly improve the accuracy
         of FEN prediction.
 
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect()`).
+
     :return: A pair formed by the predicted FEN string and the
     coordinates of the corners of the chessboard in the input image.
     """
-    board_corners = detect_input_board(board_path, board_corners)
+    board_corners = detect_input_board(
+        board_path, board_corners, min_layers, max_layers, layer_heights
+    )
     pieces = obtain_individual_pieces(board_path)
     probs_with_no_indices = obtain_piece_probs_for_all_64_squares(pieces)
-    if previous_fen is not None and not check_validity_of_fen(previous_fen):
-        print(
-            "Warning: the previous FEN is ignored because it is invalid for a "
-            "standard physical chess set"
-        )
+    fen = __infer_fens([probs_with_no_indices], a1_pos, [previous_fen])[0]
+
+    return fen, board_corners
+
+
+def predict_boards(
+    board_path: str,
+    a1_pos: str,
+    obtain_piece_probs_for_all_64_squares,
+    previous_boards: (list[tuple[str, list[list[int]]]] | None) = None,
+    max_boards: int = 6,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: tuple[int, ...] = BOARDS_LAYER_HEIGHTS,
+) -> list[tuple[str, list[list[int]]]]:
+    """Predict the FEN strings of several boards in a chessboard image.
+
+    Each board keeps its own state across images: the FEN string of a
+    board predicted in the previous image is used as its previous FEN
+    (see `predict_board()`) if the board is still in the same place.
+
+    :param board_path: Path to the chessboard image of interest.
+
+        The path must have rw permission.
+
+        Example: `"../data/predictions/boards.jpg"`.
+
+    :param a1_pos: Position of the a1 square of the chessboards.
+
+    :param obtain_piece_probs_for_all_64_squares: Path-to-prob function
+    (see `predict_board()`).
+
+    :param previous_boards: Boards predicted in the previous image.
+
+        This is the list returned by the previous call of this function
+        for the same camera.
+
+    :param max_boards: Max. number of boards detected.
+
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect_boards()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect_boards()`).
+
+    :return: List of pairs formed by the predicted FEN string and the
+    coordinates of the corners of each chessboard in the input image,
+    ranked by the detection score of the boards.
+    """
+    previous_boards = list(previous_boards or [])
+    boards_corners = detect_input_boards(
+        board_path, max_boards, min_layers, max_layers, layer_heights
+    )
+    if not boards_corners:
+        return []
+
+    probs_batch = []
+    previous_fens = []
+    for board, board_corners in enumerate(boards_corners):
         previous_fen = None
-    predictions = infer_chess_pieces(
-        probs_with_no_indices, a1_pos, previous_fen
+        previous_board = __matching_board(board_corners, previous_boards)
+        if previous_board is not None:
+            previous_fen, _ = previous_boards.pop(previous_board)
+        previous_fens.append(previous_fen)
+
+        pieces = obtain_individual_pieces(board_path, board)
+        probs_batch.append(obtain_piece_probs_for_all_64_squares(pieces))
+
+    # The pieces of all of the boards are inferred at once
+    fens = __infer_fens(probs_batch, a1_pos, previous_fens)
+    return list(zip(fens, boards_corners))
+
+
+def __infer_fens(
+    probs_batch: list[list[list[float]]],
+    a1_pos: str,
+    previous_fens: list[str | None],
+) -> list[str]:
+    """Infer the FEN strings of boards from the piece probabilities."""
+    for i, previous_fen in enumerate(previous_fens):
+        if previous_fen is not None and not check_validity_of_fen(
+            previous_fen
+        ):
+            print(
+                "Warning: the previous FEN is ignored because it is invalid "
+                "for a standard physical chess set"
+            )
+            previous_fens[i] = None
+    predictions = infer_chess_pieces_batch(
+        np.asarray(probs_batch), a1_pos, previous_fens
     )
 
-    board = list_to_board(predictions)
-    fen = board_to_fen(board)
+    return [
+        board_to_fen(list_to_board(board_predictions))
+        for board_predictions in predictions
+    ]
 
-    return fen, board_corners
+
+def __matching_board(
+    board_corners: list[list[int]],
+    previous_boards: list[tuple[str, list[list[int]]]],
+) -> int | None:
+    """Find the board of the previous image in the same place.
+
+    :param board_corners: Corners of a board in the current image.
+
+    :param previous_boards: List of pairs formed by the FEN string and
+    the corners of each board in the previous image.
+
+    :return: Index of the previous board whose center is the closest to
+    the center of the board, or `None` if there is no previous board
+    closer than half of the side of the board.
+    """
+    if not previous_boards:
+        return None
+    center = np.mean(board_corners, axis=0)
+    dists = [
+        np.linalg.norm(np.mean(corners, axis=0) - center)
+        for _, corners in previous_boards
+    ]
+    previous_board = int(np.argmin(dists))
+    if dists[previous_board] > quad_side(board_corners) / 2:
+        return None
+    return previous_board
 
 
 def continuous_predictions(
-    path: str, a1_pos: str, obtain_piece_probs_for_all_64_squares
+    path: str,
+    a1_pos: str,
+    obtain_piece_probs_for_all_64_squares,
+    corner_cache: (str | None) = None,
+    pgn_path: (str | None) = None,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: tuple[int, ...] = LAYER_HEIGHTS,
 ):
-    """Predict FEN strings from chessboard images continuously.
+    """Predict the moves from chessboard images continuously.
 
-    This function continuously monitors a folder and predicts the FEN
-    strings for new jpg images added to the folder. The FEN string is
-    printed out every time a prediction is completed. Note that this
-    function does not return.
+    This function continuously monitors a folder and predicts the moves
+    for new jpg images added to the folder. The images are decoded as
+    consecutive frames of a game (see `TemporalDecoder`), so a bad image
+    does not affect the following predictions. The FEN string of the
+    first image is printed out, and then each move is printed out (see
+    `MoveStream`) as soon as it is stable. Note that this function does
+    not return.
 
     :param path: Path to the folder that contains chessboard image(s).
 
@@ -460,6 +778,27 @@ def continuous_predictions(
         chess-piece images and returns a length-64 list of the
         corresponding piece probabilities (each element of the list is a
         length-13 sublist that contains 13 piece probabilities).
+
+    :param corner_cache: Path to the board-corner cache file.
+
+        If it is not `None`, the board corners found in the folder (one
+        folder per camera) are saved in this file, and the detection in
+        the first image starts from the saved corners (see
+        `lc2fen.corner_cache`). This avoids the full board detection
+        after a restart if the camera did not move.
+
+    :param pgn_path: Path to the PGN file of the detected games.
+
+        If it is not `None`, the detected games are appended to this
+        file.
+
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect()`).
     """
     if not os.path.isdir(path):
         raise ValueError("The input path must point to a folder")
@@ -468,24 +807,59 @@ def continuous_predictions(
         return [int(c) if c.isdigit() else c for c in re.split(r"(\d+)", text)]
 
     print("Done loading. Monitoring " + path)
+    source_id = os.path.abspath(path)
     board_corners = None
-    fen = None
+    cached_corners = None
+    decoder = None
+    move_stream = MoveStream(pgn_path)
     processed_board = False
-    while True:
-        for board_path in sorted(glob.glob(path + "*.jpg"), key=natural_key):
-            fen, board_corners = predict_board(
-                board_path,
-                a1_pos,
-                obtain_piece_probs_for_all_64_squares,
-                board_corners,
-                fen,
-            )
-            print(fen)
-            processed_board = True
-            os.remove(board_path)
-
-        if not processed_board:
-            time.sleep(0.1)
+    try:
+        while True:
+            for board_path in sorted(
+                glob.glob(path + "*.jpg"), key=natural_key
+            ):
+                if corner_cache is not None and not processed_board:
+                    board_corners = load_corners(
+                        corner_cache, source_id, board_path
+                    )
+                    cached_corners = board_corners
+                board_corners = detect_input_board(
+                    board_path,
+                    board_corners,
+                    min_layers,
+                    max_layers,
+                    layer_heights,
+                )
+                pieces = obtain_individual_pieces(board_path)
+                probs_with_no_indices = obtain_piece_probs_for_all_64_squares(
+                    pieces
+                )
+                if decoder is None:
+                    fens = __infer_fens(
+                        [probs_with_no_indices], a1_pos, [None]
+                    )
+                    decoder = TemporalDecoder(fens[0])
+                    move_stream.start(decoder.get_fen())
+                else:
+                    moves = decoder.update(probs_with_no_indices, a1_pos)
+                    if moves is None:  # The decoding has started over
+                        move_stream.start(decoder.get_fen())
+                    else:
+                        move_stream.push(moves)
+                if corner_cache is not None and not np.array_equal(
+                    board_corners, cached_corners
+                ):
+                    save_corners(
+                        corner_cache, source_id, board_path, board_corners
+                    )
+                    cached_corners = board_corners
+                processed_board = True
+                os.remove(board_path)
+
+            if not processed_board:
+                time.sleep(0.1)
+    finally:
+        move_stream.end()
 
 
 def test_predict_board(obtain_piece_probs_for_all_64_squares):
@@ -537,7 +911,11 @@ def test_predict_board(obtain_piece_probs_for_all_64_squares):
 
 
 def detect_input_board(
-    board_path: str, board_corners: (list[list[int]] | None) = None
+    board_path: str,
+    board_corners: (list[list[int]] | None) = None,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: tuple[int, ...] = LAYER_HEIGHTS,
 ) -> list[list[int]]:
     """Detect the input board.
 
@@ -564,23 +942,84 @@ def detect_input_board(
         enough, the neural-network-based board-detection step is skipped
         (which means the total processing time is reduced).
 
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect()`).
+
     :return: Length-4 list of the (new) coordinates of the four board
     corners detected.
     """
-    input_image = cv2.imread(board_path)
     head, tail = os.path.split(board_path)
     tmp_dir = os.path.join(head, "tmp/")
     if os.path.exists(tmp_dir):
         shutil.rmtree(tmp_dir)
     os.mkdir(tmp_dir)
     image_object = detect(
-        input_image, os.path.join(head, "tmp", tail), board_corners
+        board_path,
+        os.path.join(head, "tmp", tail),
+        board_corners,
+        min_layers,
+        max_layers,
+        layer_heights,
     )
     board_corners, _ = compute_corners(image_object)
     return board_corners
 
 
-def obtain_individual_pieces(board_path: str) -> list[str]:
+def detect_input_boards(
+    board_path: str,
+    max_boards: int = 6,
+    min_layers: int = 1,
+    max_layers: int = 3,
+    layer_heights: tuple[int, ...] = BOARDS_LAYER_HEIGHTS,
+) -> list[list[list[int]]]:
+    """Detect several input boards.
+
+    This function works as `detect_input_board()`, but it detects up to
+    `max_boards` boards and stores the image of the i-th detected board
+    in the "tmp/board<i>" subfolder of the folder containing the input
+    image (e.g., "tmp/board0/image.jpg").
+
+    :param board_path: Path to the chessboard image of interest.
+
+        The path must have rw permission.
+
+        Example: `"../data/predictions/boards.jpg"`.
+
+    :param max_boards: Max. number of boards detected.
+
+    :param min_layers: Minimum number of layers of the board detection.
+
+    :param max_layers: Maximum number of layers of the board detection
+    (see `detect_boards()`).
+
+    :param layer_heights: Normalized side of the image of each layer of
+    the board detection (see `detect_boards()`).
+
+    :return: List of length-4 lists of coordinates of the four corners
+    of each board detected, ranked by the detection score of the boards.
+    """
+    head, tail = os.path.split(board_path)
+    tmp_dir = os.path.join(head, "tmp/")
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    output_boards = []
+    for board in range(max_boards):
+        os.makedirs(os.path.join(tmp_dir, f"board{board}"))
+        output_boards.append(os.path.join(tmp_dir, f"board{board}", tail))
+    image_objects = detect_boards(
+        board_path, output_boards, min_layers, max_layers, layer_heights
+    )
+    return [compute_corners(image_object)[0] for image_object in image_objects]
+
+
+def obtain_individual_pieces(
+    board_path: str, board: (int | None) = None
+) -> list[str]:
     """Obtain the individual pieces of a board.
 
     :param board_path: Path to the chessboard image of interest.
@@ -592,10 +1031,15 @@ def obtain_individual_pieces(board_path: str) -> list[str]:
 
         Example: `"../data/predictions/board.jpg"`.
 
+    :param board: Index of the board if several boards were detected
+    (see `detect_input_boards()`).
+
     :return: Length-64 list of paths to chess-piece images
     """
     head, tail = os.path.split(board_path)
     tmp_dir = os.path.join(head, "tmp/")
+    if board is not None:
+        tmp_dir = os.path.join(tmp_dir, f"board{board}/")
     pieces_dir = os.path.join(tmp_dir, "pieces/")
     os.mkdir(pieces_dir)
     split_board_image_trivial(os.path.join(tmp_dir, tail), "", pieces_dir)
@@ -756,90 +1200,12 @@ def check_validity_of_fen(fen: str) -> bool:
     """Check validity of FEN assuming a standard physical chess set.
 
     This function checks the validity of a FEN string assuming a
-    standard physical chess set.
+    standard physical chess set (see `ParsedFen.is_valid`). The FEN
+    string is only parsed and checked once while it stays in the cache
+    of `parse_fen()`.
 
     :param fen: FEN string whose validity is to be checked.
 
     :return: Whether the input FEN string is valid or not.
     """
-    board = chess.Board(fen)
-    if not board.is_valid():  # If it's white to move, the FEN is invalid
-        board.turn = chess.BLACK
-        if (
-            not board.is_valid()
-        ):  # If it's black to move, the FEN is also invalid
-            return False
-
-    num_of_P = fen.count("P")  # Number of white pawns
-    num_of_Q = fen.count("Q")  # Number of white queens
-    num_of_R = fen.count("R")  # Number of white rooks
-    num_of_N = fen.count("N")  # Number of white knights
-    num_of_p = fen.count("p")  # Number of black pawns
-    num_of_q = fen.count("q")  # Number of black queens
-    num_of_r = fen.count("r")  # Number of black rooks
-    num_of_n = fen.count("n")  # Number of black knights
-    fen_list = board_to_list(fen_to_board(fen))
-    num_of_light_squared_B = sum(
-        [
-            is_light_square(square)
-            for (square, piece_type) in enumerate(fen_list)
-            if piece_type == "B"
-        ]
-    )  # Number of light-squared bishops for white
-    num_of_dark_squared_B = (
-        fen.count("B") - num_of_light_squared_B
-    )  # Number of dark-squared bishops for white
-    num_of_light_squared_b = sum(
-        [
-            is_light_square(square)
-            for (square, piece_type) in enumerate(fen_list)
-            if piece_type == "b"
-        ]
-    )  # Number of light-squared bishops for black
-    num_of_dark_squared_b = (
-        fen.count("b") - num_of_light_squared_b
-    )  # Number of dark-squared bishops for black
-
-    if (
-        num_of_R > 2
-        or num_of_r > 2
-        or num_of_N > 2
-        or num_of_n > 2
-        or (num_of_light_squared_B + num_of_dark_squared_B) > 2
-        or (num_of_light_squared_b + num_of_dark_squared_b) > 2
-        or num_of_Q > 2
-        or num_of_q > 2
-    ):  # Number of any piece is too large for a standard physical chess set
-        return False
-
-    if (
-        num_of_P == 7
-        and num_of_Q == 2  # A white pawn has promoted into a queen
-        and (
-            num_of_light_squared_B == 2 or num_of_dark_squared_B == 2
-        )  # A white pawn has promoted into a bishop
-    ):
-        return False
-
-    if num_of_P == 8 and (
-        num_of_Q == 2  # A white pawn has promoted into a queen
-        or (num_of_light_squared_B == 2 or num_of_dark_squared_B == 2)
-    ):  # A white pawn has promoted into a bishop
-        return False
-
-    if (
-        num_of_p == 7
-        and num_of_q == 2  # A black pawn has promoted into a queen
-        and (
-            num_of_light_squared_b == 2 or num_of_dark_squared_b == 2
-        )  # A black pawn has promoted into a bishop
-    ):
-        return False
-
-    if num_of_p == 8 and (
-        num_of_q == 2  # A black pawn has promoted into a queen
-        or (num_of_light_squared_b == 2 or num_of_dark_squared_b == 2)
-    ):  # A black pawn has promoted into a bishop
-        return False
-
-    return True
+    return parse_fen(fen).is_valid
@@ -0,0 +1,69 @@
+"""This script benchmarks the `__polyscore()` function of "cps.py".
+
+It times the scoring of a batch of frames around a synthetic 7x7 lattice
+in a single call against scoring them one by one with the single-frame
+implementation of "test_cps.py". Run it from the root of the repository
+with `PYTHONPATH=. python test/bench_polyscore.py`.
+"""
+
+
+import timeit
+
+import numpy as np
+
+from lc2fen.detectboard.cps import __polyscore as polyscore
+from test_cps import reference_polyscore
+
+
+N_FRAMES = 1000
+REPEAT = 5
+
+
+def lattice_frames(n_frames: int, side: int = 30, seed: int = 0):
+    """Return the arguments of `__polyscore()` for a 7x7 lattice.
+
+    :param n_frames: Number of frames around the lattice.
+
+    :param side: Side of the lattice squares.
+
+    :param seed: Seed of the random jitter.
+
+    :return: Tuple of the frames, points, centroid, alfa, and beta.
+    """
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.arange(7) * side, np.arange(7) * side)
+    pts = np.stack((x.ravel(), y.ravel()), axis=1) + 100
+    pts = (pts + rng.integers(-2, 3, pts.shape)).astype(np.float64)
+    cen = tuple(np.mean(pts, axis=0))
+
+    low = 100 - side + rng.integers(-side, side, (n_frames, 2))
+    high = 100 + 7 * side + rng.integers(-side, side, (n_frames, 2))
+    cnts = np.stack(
+        (
+            low,
+            np.stack((high[:, 0], low[:, 1]), axis=1),
+            high,
+            np.stack((low[:, 0], high[:, 1]), axis=1),
+        ),
+        axis=1,
+    )
+    return cnts, pts, cen, side / 2, pts.shape[0] * 0.05
+
+
+def main():
+    """Print the time taken to score the frames in each way."""
+    cnts, pts, cen, alfa, beta = lattice_frames(N_FRAMES)
+    benchmarks = {
+        "batch call": lambda: polyscore(cnts, pts, cen, alfa, beta),
+        "per-frame calls": lambda: [
+            reference_polyscore(cnt, pts, cen, alfa, beta) for cnt in cnts
+        ],
+    }
+    print(f"Scoring {N_FRAMES} frames around a 7x7 lattice (best of {REPEAT})")
+    for name, benchmark in benchmarks.items():
+        elapsed = min(timeit.repeat(benchmark, number=1, repeat=REPEAT))
+        print(f"{name}: {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""This module is responsible for testing "corner_cache.py" module.
+
+Specifically, it tests that the `save_corners()` and `load_corners()`
+functions in the module round-trip the corners of each source without
+touching those of the other sources, that the cached corners are
+discarded for an image that does not resemble their fingerprint, and
+that a missing or corrupt cache file is treated as an empty cache.
+"""
+
+
+import json
+
+import cv2
+import numpy as np
+
+from lc2fen.corner_cache import load_corners, save_corners
+
+
+BOARD_CORNERS = [[100, 50], [500, 60], [520, 440], [90, 430]]
+
+
+def write_board_image(path: str, seed: int, inverted: bool = False):
+    """Write a noisy image with a chessboard in `BOARD_CORNERS`.
+
+    If `inverted` is `True`, the colors of the squares are swapped.
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    squares = np.kron(
+        ((np.indices((8, 8)).sum(axis=0) + inverted) % 2) * 255,
+        np.ones((50, 50)),
+    )
+    board = np.uint8(np.stack((squares,) * 3, axis=2))
+    transform = cv2.getPerspectiveTransform(
+        np.float32([[0, 0], [400, 0], [400, 400], [0, 400]]),
+        np.float32(BOARD_CORNERS),
+    )
+    mask = cv2.warpPerspective(
+        np.ones((400, 400), np.uint8), transform, (640, 480)
+    )
+    board = cv2.warpPerspective(board, transform, (640, 480))
+    img[mask > 0] = board[mask > 0]
+    cv2.imwrite(path, img)
+
+
+def test_corner_cache(tmp_path):
+    """Test `save_corners()` and `load_corners()`."""
+    cache_file = str(tmp_path / "corners.json")
+    board_path = str(tmp_path / "board.jpg")
+    other_path = str(tmp_path / "other.jpg")
+    write_board_image(board_path, 0)
+    cv2.imwrite(other_path, np.full((480, 640, 3), 128, np.uint8))
+
+    assert load_corners(cache_file, "camera1", board_path) is None
+
+    save_corners(cache_file, "camera1", board_path, np.int32(BOARD_CORNERS))
+    save_corners(cache_file, "camera2", board_path, BOARD_CORNERS[::-1])
+
+    # A new image of the same scene (with different noise outside the
+    # board) is accepted
+    write_board_image(board_path, 1)
+    assert load_corners(cache_file, "camera1", board_path) == BOARD_CORNERS
+    assert load_corners(cache_file, "camera2", board_path) == (
+        BOARD_CORNERS[::-1]
+    )
+    assert load_corners(cache_file, "camera3", board_path) is None
+    assert load_corners(cache_file, "camera1", other_path) is None
+
+
+def test_fingerprint_mismatch(tmp_path):
+    """Test `load_corners()` with images of other boards."""
+    cache_file = str(tmp_path / "corners.json")
+    board_path = str(tmp_path / "board.jpg")
+    write_board_image(board_path, 0)
+    save_corners(cache_file, "camera1", board_path, BOARD_CORNERS)
+
+    # The board area of the image is negatively correlated with the
+    # fingerprint
+    write_board_image(board_path, 1, inverted=True)
+    assert load_corners(cache_file, "camera1", board_path) is None
+
+    # The corners are kept in the cache
+    write_board_image(board_path, 2)
+    assert load_corners(cache_file, "camera1", board_path) == BOARD_CORNERS
+
+
+def test_save_corners(tmp_path):
+    """Test that `save_corners()` only updates its source's entry."""
+    cache_file = str(tmp_path / "corners.json")
+    board_path = str(tmp_path / "board.jpg")
+    write_board_image(board_path, 0)
+    save_corners(cache_file, "camera1", board_path, BOARD_CORNERS)
+    with open(cache_file, "r") as cache_fd:
+        camera1 = json.load(cache_fd)["camera1"]
+
+    moved_corners = (np.int32(BOARD_CORNERS) + 5).tolist()
+    save_corners(cache_file, "camera2", board_path, moved_corners)
+    with open(cache_file, "r") as cache_fd:
+        cache = json.load(cache_fd)
+    assert sorted(cache) == ["camera1", "camera2"]
+    assert cache["camera1"] == camera1
+    assert cache["camera2"]["board_corners"] == moved_corners
+    assert not (tmp_path / "corners.json.tmp").exists()
+
+
+def test_corrupt_cache(tmp_path):
+    """Test `load_corners()` and `save_corners()` on a corrupt file."""
+    cache_file = str(tmp_path / "corners.json")
+    board_path = str(tmp_path / "board.jpg")
+    write_board_image(board_path, 0)
+
+    for contents in ('{"camera1": {"board_corners": [[1', "[]"):
+        with open(cache_file, "w") as cache_fd:
+            cache_fd.write(contents)
+        assert load_corners(cache_file, "camera1", board_path) is None
+
+    # The corrupt file is overwritten
+    save_corners(cache_file, "camera1", board_path, BOARD_CORNERS)
+    assert load_corners(cache_file, "camera1", board_path) == BOARD_CORNERS
@@ -0,0 +1,124 @@
+"""This module is responsible for testing "cps.py" module.
+
+Specifically, it tests that the vectorized `__polyscore()` function in
+the module gives the same scores as a single-frame implementation based
+on `pyclipper`, `matplotlib`, and `scipy`, and that the `cps_boards()`
+function finds every board of an image.
+"""
+
+
+import math
+
+import cv2
+import matplotlib.path
+import numpy as np
+import pyclipper
+from scipy.spatial import ConvexHull
+
+from lc2fen.detectboard.cps import __polyscore as polyscore, cps_boards
+
+
+def reference_polyscore(cnt, pts, cen, alfa, beta):
+    """Calculate the polyscore value of a single frame."""
+    frame_area = cv2.contourArea(cnt)
+    if frame_area < (4 * alfa * alfa) * 5:
+        return 0
+
+    gamma = alfa / 1.5
+
+    pco = pyclipper.PyclipperOffset()
+    pco.AddPath(cnt, pyclipper.JT_MITER, pyclipper.ET_CLOSEDPOLYGON)
+    pcnt = matplotlib.path.Path(pco.Execute(gamma)[0])
+    wtfs = pcnt.contains_points(pts)
+    pts_in_frame = min(np.count_nonzero(wtfs), 49)
+    if pts_in_frame < min(pts.shape[0], 49) - 2 * beta - 1:
+        return 0
+
+    points = pts[wtfs][ConvexHull(pts[wtfs]).vertices]
+    cen2 = np.sum(points, axis=0) / points.shape[0]
+    cen_dist = math.sqrt((cen[0] - cen2[0]) ** 2 + (cen[1] - cen2[1]) ** 2)
+
+    i = 0
+    j = 0
+    for side in range(4):
+        p0, p1 = cnt[side], cnt[(side + 1) % 4]
+        d = math.sqrt((p0[0] - p1[0]) ** 2 + (p0[1] - p1[1]) ** 2)
+        for p in points:
+            r = (
+                abs(
+                    (p1[0] - p0[0]) * (p0[1] - p[1])
+                    - (p1[1] - p0[1]) * (p0[0] - p[0])
+                )
+                / d
+            )
+            if r < gamma:
+                i += r
+                j += 1
+    if j == 0:
+        return 0
+
+    w_points = 1 + (i / j / pts_in_frame) ** (1 / 3)
+    w_centroid = 1 + (cen_dist / pts_in_frame) ** (1 / 5)
+    return (pts_in_frame**4) / ((frame_area**2) * w_points * w_centroid)
+
+
+def test_polyscore():
+    """Test `__polyscore()` against `reference_polyscore()`."""
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        # A jittered lattice of 7x7 points with some noise points
+        side = rng.integers(15, 40)
+        x, y = np.meshgrid(np.arange(7) * side, np.arange(7) * side)
+        lattice = np.stack((x.ravel(), y.ravel()), axis=1) + 100
+        lattice = lattice + rng.integers(-2, 3, lattice.shape)
+        noise = rng.integers(0, 500, (rng.integers(0, 15), 2))
+        pts = np.concatenate((lattice, noise)).astype(np.float64)
+        cen = tuple(np.mean(pts, axis=0))
+        alfa, beta = side / 2, pts.shape[0] * 0.05
+
+        # Frames around the lattice in both orientations
+        low = 100 - side + rng.integers(-side, side, (30, 2))
+        high = 100 + 7 * side + rng.integers(-side, side, (30, 2))
+        cnts = np.stack(
+            (
+                low,
+                np.stack((high[:, 0], low[:, 1]), axis=1),
+                high,
+                np.stack((low[:, 0], high[:, 1]), axis=1),
+            ),
+            axis=1,
+        )
+        cnts = cnts + rng.integers(-10, 10, cnts.shape)
+        cnts[::5] = cnts[::5, ::-1]
+
+        scores = polyscore(cnts, pts, cen, alfa, beta)
+        for cnt, score in zip(cnts, scores):
+            expected = reference_polyscore(cnt, pts, cen, alfa, beta)
+            assert math.isclose(score, expected, rel_tol=1e-12)
+        assert polyscore(cnts[0], pts, cen, alfa, beta) == scores[0]
+
+
+def test_cps_boards():
+    """Test `cps_boards()` on the lattices of two boards."""
+    # Top left corner and square of each board
+    boards = [(50, 80, 40), (520, 120, 35)]
+    points, lines = [], []
+    for x0, y0, side in boards:
+        x, y = np.meshgrid(np.arange(1, 8) * side, np.arange(1, 8) * side)
+        points += np.stack((x.ravel() + x0, y.ravel() + y0), axis=1).tolist()
+        for i in range(9):
+            lines.append([[x0 + i * side, y0], [x0 + i * side, y0 + 8 * side]])
+            lines.append([[x0, y0 + i * side], [x0 + 8 * side, y0 + i * side]])
+
+    img = np.zeros((500, 900), np.uint8)
+    found = cps_boards(img, points, lines, padding=0)
+    assert len(found) == 2
+    for x0, y0, side in boards:
+        expected = np.float32(
+            [[1, 1], [7, 1], [7, 7], [1, 7]]
+        ) * side + np.float32([x0, y0])
+        assert any(
+            np.max(np.abs(np.float32(board) - expected)) <= 1
+            for board in found
+        )
+    assert len(cps_boards(img, points, lines, padding=0, max_boards=1)) == 1
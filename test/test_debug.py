@@ -0,0 +1,39 @@
+"""This module is responsible for testing "debug.py" module.
+
+Specifically, it tests that the debug images are only saved inside
+`debugging()` and that an image that cannot be saved does not stop the
+background thread that saves the rest.
+"""
+
+
+import os
+import threading
+
+import numpy as np
+
+from lc2fen.detectboard import debug
+
+
+def test_debugging(tmp_path, capsys):
+    """Test `debugging()` with images that cannot be saved."""
+    save_dir = str(tmp_path / "debug_steps") + "/"
+    assert not debug.enabled()
+
+    def save_images():
+        with debug.debugging(save_dir, max_queued_images=1):
+            assert debug.enabled()
+            for i in range(8):
+                # The empty images raise an error when they are written
+                img = np.zeros((0, 0, 3) if i % 2 else (10, 10, 3), np.uint8)
+                debug.DebugImage(img).save(f"image{i}")
+
+    thread = threading.Thread(target=save_images, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert not debug.enabled()
+
+    assert sorted(os.listdir(save_dir)) == [
+        f"__debug_{i:04d}_image{i}.jpg" for i in range(0, 8, 2)
+    ]
+    assert capsys.readouterr().out.count("Warning") == 4
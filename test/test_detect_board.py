@@ -0,0 +1,141 @@
+"""This module is responsible for testing "detect_board.py" module.
+
+Specifically, it tests that the `compute_corners()` function in the
+module maps the cropped board of each layer back to the original image,
+that the `detect()` function only falls back to larger regions (and,
+finally, to the whole image) when no plausible board is found around the
+given board corners, and that the `detect_boards()` function finds every
+board of an image.
+"""
+
+
+import cv2
+import numpy as np
+
+from lc2fen.detectboard import detect_board
+from lc2fen.detectboard.detect_board import (
+    compute_corners,
+    detect,
+    detect_boards,
+)
+from lc2fen.detectboard.image_object import BOARD_FRAME, ImageObject
+
+
+# Board corners in the original image and in the first cropped image
+BOARD_CORNERS = [[400, 200], [1600, 260], [1660, 1300], [350, 1250]]
+CROP_CORNERS = [[30, 20], [1170, 40], [1150, 1180], [10, 1160]]
+
+# Board corners in the image searched in `test_detect_empty_roi()`
+EMPTY_ROI_CORNERS = [[150, 150], [790, 150], [790, 790], [150, 790]]
+
+
+def test_compute_corners():
+    """Test `compute_corners()` with a board found in two layers."""
+    image_object = ImageObject()
+    image_object.add_points(BOARD_CORNERS)
+    image_object.add_points(CROP_CORNERS)
+
+    to_original = cv2.getPerspectiveTransform(
+        BOARD_FRAME, np.float32(BOARD_CORNERS)
+    )
+    expected_corners = cv2.perspectiveTransform(
+        np.float32(CROP_CORNERS).reshape(-1, 1, 2), to_original
+    ).reshape(-1, 2)
+    to_original = to_original @ cv2.getPerspectiveTransform(
+        BOARD_FRAME, np.float32(CROP_CORNERS)
+    )
+    expected_squares = cv2.perspectiveTransform(
+        np.float32(
+            [[150 * i, 150 * j] for i in range(9) for j in range(9)]
+        ).reshape(-1, 1, 2),
+        to_original,
+    ).reshape(-1, 2)
+
+    board_corners, square_corners = compute_corners(image_object)
+    assert board_corners.dtype == np.int32
+    assert square_corners.shape == (81, 2)
+    assert np.max(np.abs(board_corners - expected_corners)) < 1
+    assert np.max(np.abs(square_corners - expected_squares)) < 1
+    assert board_corners.tolist() == square_corners[[0, 72, 80, 8]].tolist()
+
+
+def board_image():
+    """Return an image of a board with corners `EMPTY_ROI_CORNERS`."""
+    img = np.full((1000, 1400, 3), 128, np.uint8)
+    for row in range(8):
+        for col in range(8):
+            y, x = 150 + 80 * row, 150 + 80 * col
+            img[y : y + 80, x : x + 80] = 230 if (row + col) % 2 == 0 else 30
+    return img
+
+
+def test_detect_empty_roi(tmp_path):
+    """Test `detect()` with board corners pointing at an empty area."""
+    img = board_image()
+
+    expected_corners, _ = compute_corners(
+        detect(img, str(tmp_path / "board.png"))
+    )
+
+    # No lattice points are found in the padded region of the corners
+    board_corners = [[1100, 700], [1300, 700], [1300, 900], [1100, 900]]
+    board_corners, _ = compute_corners(
+        detect(
+            img,
+            str(tmp_path / "cached_board.png"),
+            board_corners,
+            roi_paddings=(0.1,),
+        )
+    )
+    assert board_corners.tolist() == expected_corners.tolist()
+    assert np.max(np.abs(board_corners - EMPTY_ROI_CORNERS)) < 10
+
+
+def test_detect_boards(tmp_path):
+    """Test `detect_boards()` with an image of two boards."""
+    img = np.full((900, 1700, 3), 128, np.uint8)
+    # Top left corner and square of each board
+    boards = [(100, 150, 75), (950, 200, 70)]
+    for x0, y0, side in boards:
+        for row in range(8):
+            for col in range(8):
+                y, x = y0 + side * row, x0 + side * col
+                img[y : y + side, x : x + side] = (
+                    230 if (row + col) % 2 == 0 else 30
+                )
+
+    output_boards = [str(tmp_path / f"board{i}.png") for i in range(3)]
+    image_objects = detect_boards(img, output_boards)
+    assert len(image_objects) == 2
+    assert cv2.imread(output_boards[1]).shape == (1200, 1200, 3)
+
+    found = [compute_corners(image)[0] for image in image_objects]
+    for x0, y0, side in boards:
+        expected = np.float32([[0, 0], [8, 0], [8, 8], [0, 8]]) * side
+        expected += np.float32([x0, y0])
+        assert any(
+            np.max(np.abs(corners - expected)) < 10 for corners in found
+        )
+
+
+def test_detect_moved_board(tmp_path, monkeypatch):
+    """Test `detect()` with board corners near the board."""
+    # We count the layers executed, none of which converges
+    layers = []
+    original_slid = detect_board.slid
+
+    def slid(img):
+        layers.append(img.shape)
+        return original_slid(img)
+
+    monkeypatch.setattr(detect_board, "slid", slid)
+    monkeypatch.setattr(detect_board, "__has_converged", lambda *_: False)
+
+    # The board is kept from the first region, whose three layers are
+    # the only ones executed
+    board_corners = (np.float32(EMPTY_ROI_CORNERS) + 60).tolist()
+    board_corners, _ = compute_corners(
+        detect(board_image(), str(tmp_path / "board.png"), board_corners)
+    )
+    assert len(layers) == 3
+    assert np.max(np.abs(board_corners - EMPTY_ROI_CORNERS)) < 10
@@ -0,0 +1,109 @@
+"""This module is responsible for testing "fen.py" module.
+
+Specifically, it tests that the compact boards (arrays of 64 bytes) in
+the module are translated to and from FEN strings and board matrices and
+rotated as a list-based implementation does, that the `parse_fen()`
+function parses each FEN string once, and that the parsed FEN strings
+are checked for validity assuming a standard physical chess set.
+"""
+
+
+import chess
+import numpy as np
+import pytest
+
+from lc2fen.fen import (
+    FROM_STANDARD_VIEW,
+    array_to_board,
+    array_to_fen,
+    board_to_array,
+    board_to_fen,
+    board_to_list,
+    compare_fen,
+    fen_to_array,
+    fen_to_board,
+    list_to_board,
+    parse_fen,
+    rotate_board_from_standard_view,
+    rotate_board_to_standard_view,
+)
+
+
+FEN = "r1bqkb1r/ppp2ppp/2n2n2/1N1pp3/3P1B2/8/PPP1PPPP/R2QKBNR"
+
+
+def reference_rotate_board(board, a1_pos):
+    """Rotate a board matrix by transposing and reversing its rows."""
+    if a1_pos == "BL":
+        return board
+    if a1_pos == "BR":  # Counterclockwise rotation
+        return list(map(list, zip(*board)))[::-1]
+    if a1_pos == "TL":  # Clockwise rotation
+        return list(map(list, zip(*board[::-1])))
+    return [row[::-1] for row in board[::-1]]  # 180 degree rotation
+
+
+def test_fen_to_array():
+    """Test the translations and the rotations of the compact boards."""
+    array = fen_to_array(FEN)
+    assert array.dtype == np.uint8 and array.shape == (64,)
+    assert array.tobytes() == b"".join(
+        "".join(row).encode() for row in fen_to_board(FEN)
+    )
+    assert fen_to_board(FEN)[2] == ["_", "_", "n", "_", "_", "n", "_", "_"]
+    assert array_to_fen(array) == FEN
+    assert board_to_fen(fen_to_board(FEN)) == FEN
+    assert array_to_board(array) == fen_to_board(FEN)
+    assert np.array_equal(board_to_array(fen_to_board(FEN)), array)
+
+    for fen in ("8/8/8/8/8/8/8", "9/8/8/8/8/8/8/8", "7p/8/8/8/8/8/8/p7/"):
+        with pytest.raises(ValueError):
+            fen_to_array(fen)
+
+    board = fen_to_board(FEN)
+    for a1_pos in ("BL", "BR", "TL", "TR"):
+        rotated = reference_rotate_board(board, a1_pos)
+        assert rotate_board_from_standard_view(board, a1_pos) == rotated
+        assert rotate_board_to_standard_view(rotated, a1_pos) == board
+        assert list_to_board(board_to_list(rotated), a1_pos) == board
+        assert array_to_board(array[FROM_STANDARD_VIEW[a1_pos]]) == rotated
+
+        other_fen = board_to_fen(rotated)
+        assert compare_fen(FEN, other_fen) == sum(
+            square != other_square
+            for square, other_square in zip(
+                board_to_list(board), board_to_list(rotated)
+            )
+        )
+
+
+def test_parse_fen():
+    """Test `parse_fen()`."""
+    fen = FEN
+    parsed_fen = parse_fen(fen)
+    assert parse_fen(fen) is parsed_fen  # The FEN string is parsed once
+    assert np.array_equal(parsed_fen.array, fen_to_array(fen))
+    assert parsed_fen.piece_counts["p"] == 8
+    assert parsed_fen.piece_counts["_"] == 32
+    assert parsed_fen.board.board_fen() == fen
+    assert parsed_fen.board.turn == chess.WHITE
+    assert parsed_fen.is_valid
+
+    cases = [
+        # Black is in check, so it is black to move
+        ("4k3/8/8/8/8/8/8/4R2K", True),
+        # Both kings are in check
+        ("4k3/8/8/8/8/8/4R3/r3K3", False),
+        # Two queens and eight pawns
+        ("4k3/8/8/8/8/8/PPPPPPPP/QQ2K3", False),
+        # Two queens, two light-squared bishops, and six or seven pawns
+        ("4k3/8/8/8/8/8/PPPPPP2/QQ1BKB2", True),
+        ("4k3/8/8/8/8/8/PPPPPPP1/QQ1BKB2", False),
+        # Two bishops (of different or same color) and eight pawns
+        ("2b1kb2/pppppppp/8/8/8/8/8/4K3", True),
+        ("4kb2/pppppppp/8/8/8/8/8/2b1K3", False),
+        # Three knights
+        ("4k3/8/8/8/8/8/8/NNN1K3", False),
+    ]
+    for fen, is_valid in cases:
+        assert parse_fen(fen).is_valid == is_valid, fen
@@ -0,0 +1,59 @@
+"""This module is responsible for testing "image_object.py" module.
+
+Specifically, it tests that the `image_shape()` function in the module
+reads from the header of a JPEG image the shape with which the image is
+decoded, also when the image is rotated by its Exif orientation.
+"""
+
+
+import struct
+
+import cv2
+import numpy as np
+
+from lc2fen.detectboard.image_object import (
+    REDUCED_FLAGS,
+    image_read,
+    image_shape,
+)
+
+
+def exif_segment(orientation, byteorder):
+    """Return a JPEG APP1 segment with the given Exif orientation."""
+    fmt = "<" if byteorder == b"II" else ">"
+    tiff = (
+        byteorder
+        + struct.pack(fmt + "HIH", 42, 8, 1)  # Header and 1 tag
+        + struct.pack(fmt + "HHIHH", 0x0112, 3, 1, orientation, 0)
+        + struct.pack(fmt + "I", 0)  # No next IFD
+    )
+    segment = b"Exif\x00\x00" + tiff
+    return b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment
+
+
+def test_image_shape(tmp_path):
+    """Test `image_shape()` with JPEG images of every orientation."""
+    img = np.zeros((300, 500, 3), np.uint8)
+    img[:50, :100] = 255
+    jpeg = cv2.imencode(".jpg", img)[1].tobytes()
+
+    path = str(tmp_path / "board.jpg")
+    cv2.imwrite(path, img)
+    assert image_shape(path) == (300, 500)
+
+    for orientation in range(1, 9):
+        for byteorder in (b"II", b"MM"):
+            with open(path, "wb") as file:
+                file.write(
+                    jpeg[:2] + exif_segment(orientation, byteorder) + jpeg[2:]
+                )
+            shape = image_shape(path)
+            assert shape == ((500, 300) if orientation > 4 else (300, 500))
+            for factor in REDUCED_FLAGS:
+                for grayscale in (False, True):
+                    reduced = image_read(path, factor, grayscale).shape[:2]
+                    assert reduced == tuple(-(-np.array(shape) // factor))
+
+    path = str(tmp_path / "board.png")
+    cv2.imwrite(path, img)
+    assert image_shape(path) is None
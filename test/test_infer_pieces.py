@@ -1,15 +1,31 @@
 """This module is responsible for testing "infer_pieces.py" module.
 
-Specifically, it tests the `_determine_changed_squares()` and
-`_detect_move()` functions in the module.
+Specifically, it tests the `_detect_legal_move()` function and the
+`TemporalDecoder` class in the module and that the
+`infer_chess_pieces()` function infers balanced pieces at least as
+likely as a list-based implementation of the greedy inference and the
+same pieces as the batched `infer_chess_pieces_batch()` function.
 """
 
+import chess
+import numpy as np
 
-from lc2fen.fen import fen_to_board, board_to_list
+from lc2fen.fen import (
+    fen_to_board,
+    board_to_list,
+    is_light_square,
+    list_to_board,
+)
 from lc2fen.infer_pieces import (
     _PIECE_TO_IDX_FULL,
-    _determine_changed_squares,
-    _detect_move,
+    _determine_most_probable_black_piece,
+    _determine_most_probable_white_piece,
+    _detect_legal_move,
+    _is_white_piece,
+    _previous_fen_placements,
+    TemporalDecoder,
+    infer_chess_pieces,
+    infer_chess_pieces_batch,
 )
 
 
@@ -47,194 +63,335 @@ def generate_probs_with_no_indices_from_fen(fen: str):
     return probs_with_no_indices
 
 
-def test_determine_changed_squares_and_detect_move():
-    """Test `_determine_changed_squares()` and `_detect_move()`."""
-    # Test detection of a white (pawn) move
-    previous_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
-    current_fen = "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
-
-    changed_squares = [35, 51]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
-
-    move = (51, 35, "white_moves")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
-
-    # Test detection of a black (knight) move
-    previous_fen = "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR"
-    current_fen = "rnbqkb1r/pppppppp/5n2/8/3P4/8/PPP1PPPP/RNBQKBNR"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
-
-    changed_squares = [6, 21]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
-
-    move = (6, 21, "black_moves")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
-
-    # Test detection of a white (pawn) capture
-    previous_fen = "r1bqkb1r/ppp2ppp/2n2n2/1N1pp3/3P1B2/8/PPP1PPPP/R2QKBNR"
-    current_fen = "r1bqkb1r/ppp2ppp/2n2n2/1N1pP3/5B2/8/PPP1PPPP/R2QKBNR"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
-
-    changed_squares = [28, 35]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
-
-    move = (35, 28, "white_captures")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
-
-    # Test detection of a black (knight) capture
-    previous_fen = "r1bqkb1r/ppp2ppp/2n5/1N1pP2n/5B2/4P3/PPP2PPP/R2QKBNR"
-    current_fen = "r1bqkb1r/ppp2ppp/2n5/1N1pP3/5n2/4P3/PPP2PPP/R2QKBNR"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
-
-    changed_squares = [31, 37]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
-
-    move = (31, 37, "black_captures")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
-
-    # Test detection of a white en passant
-    previous_fen = "rnbqkbnr/ppp2ppp/3p4/3Pp3/8/8/PPP1PPPP/RNBQKBNR"
-    current_fen = "rnbqkbnr/ppp2ppp/3pP3/8/8/8/PPP1PPPP/RNBQKBNR"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
-
-    changed_squares = [20, 27, 28]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
-
-    move = (27, 20, "white_en_passants")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
-
-    # Test detection of a black en passant
-    previous_fen = "rnbqkbnr/ppp1pppp/8/8/3pP3/3P1N2/PPP2PPP/RNBQKB1R"
-    current_fen = "rnbqkbnr/ppp1pppp/8/8/8/3PpN2/PPP2PPP/RNBQKB1R"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
-
-    changed_squares = [35, 36, 44]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
-
-    move = (35, 44, "black_en_passants")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
-
-    # Test detection of a white kingside castling
-    previous_fen = "r1bq1rk1/ppn2ppp/2p1pn2/3p4/1b1P1B2/2NBPN2/PPP2PPP/R2QK2R"
-    current_fen = "r1bq1rk1/ppn2ppp/2p1pn2/3p4/1b1P1B2/2NBPN2/PPP2PPP/R2Q1RK1"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
-
-    changed_squares = [60, 61, 62, 63]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
-
-    move = (60, 62, "white_castles_kingside")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
+# Piece types placed by the greedy inference (apart from the kings)
+GREEDY_PIECES = "BNPQRbnpqr"
 
-    # Test detection of a black kingside castling
-    previous_fen = "r1bqk2r/ppn2ppp/2p1pn2/3p4/1b1P1B2/2NBPN2/PPP2PPP/R2QK2R"
-    current_fen = "r1bq1rk1/ppn2ppp/2p1pn2/3p4/1b1P1B2/2NBPN2/PPP2PPP/R2QK2R"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
 
-    changed_squares = [4, 5, 6, 7]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
+def reference_infer_chess_pieces(probs_with_no_indices, a1_pos):
+    """Infer the pieces by merging the sorted lists of each piece type.
 
-    move = (4, 6, "black_castles_kingside")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
-    )
+    This is the greedy inference, which places the most probable piece
+    that keeps the board balanced one at a time. It returns the pieces
+    and whether it has failed to place all of them in that way.
+    """
+    probs = board_to_list(list_to_board(probs_with_no_indices, a1_pos))
+    probs_by_square = [(prob, i) for i, prob in enumerate(probs)]
+    pieces = [None] * 64
 
-    # Test detection of a white queenside castling
-    previous_fen = "rnbq1rk1/ppp1ppbp/3p1np1/8/3PPB2/2N5/PPPQ1PPP/R3KBNR"
-    current_fen = "rnbq1rk1/ppp1ppbp/3p1np1/8/3PPB2/2N5/PPPQ1PPP/2KR1BNR"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
+    white_king = max(
+        probs_by_square, key=lambda p: p[0][_PIECE_TO_IDX_FULL["K"]]
     )
-
-    changed_squares = [56, 58, 59, 60]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
+    black_kings = sorted(
+        probs_by_square,
+        key=lambda p: p[0][_PIECE_TO_IDX_FULL["k"]],
+        reverse=True,
     )
-
-    move = (60, 58, "white_castles_queenside")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
+    black_king = black_kings[0]
+    if black_king[1] == white_king[1]:
+        black_king = black_kings[1]
+    pieces[white_king[1]], pieces[black_king[1]] = "K", "k"
+    for i, prob in enumerate(probs):
+        if pieces[i] is None and np.argmax(prob) == _PIECE_TO_IDX_FULL["_"]:
+            pieces[i] = "_"
+
+    probs_by_type = [
+        sorted(
+            probs_by_square[8:-8] if piece in "Pp" else probs_by_square,
+            key=lambda p, col=_PIECE_TO_IDX_FULL[piece]: p[0][col],
+            reverse=True,
+        )
+        for piece in GREEDY_PIECES
+    ]
+    idx = [0] * 10
+    max_pieces_left = [2, 2, 8, 2, 2, 2, 2, 8, 2, 2]
+    failed = False
+    while None in pieces:
+        max_idx = max(
+            range(10),
+            key=lambda t: (
+                probs_by_type[t][idx[t]][0][
+                    _PIECE_TO_IDX_FULL[GREEDY_PIECES[t]]
+                ],
+                -t,
+            ),
+        )
+        square = probs_by_type[max_idx][idx[max_idx]][1]
+        if max_pieces_left[max_idx] > 0 and pieces[square] is None:
+            pieces[square] = GREEDY_PIECES[max_idx]
+            if is_balanced_board(pieces):
+                max_pieces_left[max_idx] -= 1
+            else:  # The piece would not fit in a physical chess set
+                pieces[square] = None
+        idx[max_idx] += 1
+        if idx[max_idx] == len(probs_by_type[max_idx]):
+            failed = True
+            break
+
+    if failed:
+        for square, piece in enumerate(pieces):
+            if piece is None and _is_white_piece(probs[square]):
+                pieces[square] = _determine_most_probable_white_piece(
+                    probs, square
+                )
+            elif piece is None:
+                pieces[square] = _determine_most_probable_black_piece(
+                    probs, square
+                )
+    return pieces, failed
+
+
+def is_balanced_board(pieces):
+    """Check the pieces against a standard physical chess set."""
+    for side in ("BNPQR", "bnpqr"):
+        bishop, knight, pawn, queen, rook = side
+        bishops = [square for square, p in enumerate(pieces) if p == bishop]
+        num_light = sum(is_light_square(square) for square in bishops)
+        num_promoted = (pieces.count(queen) == 2) + (
+            num_light == 2 or len(bishops) - num_light == 2
+        )
+        if (
+            max(pieces.count(knight), pieces.count(rook), len(bishops)) > 2
+            or pieces.count(queen) > 2
+            or pieces.count(pawn) + num_promoted > 8
+            or pawn in pieces[:8] + pieces[56:]
+        ):
+            return False
+    return True
+
+
+def log_likelihood(probs, pieces):
+    """Compute the log-likelihood of the pieces (from a8 to h1)."""
+    return sum(
+        np.log(max(probs[square][_PIECE_TO_IDX_FULL[piece]], 1e-6))
+        for square, piece in enumerate(pieces)
     )
 
-    # Test detection of a black queenside castling
-    previous_fen = "r3kb1r/pp2pppp/2n5/2q2b2/Q4B2/2P5/PP3PPP/R3KBNR"
-    current_fen = "2kr1b1r/pp2pppp/2n5/2q2b2/Q4B2/2P5/PP3PPP/R3KBNR"
-    probs_with_no_indices = generate_probs_with_no_indices_from_fen(
-        current_fen
-    )
 
-    changed_squares = [0, 2, 3, 4]
-    assert (
-        _determine_changed_squares(previous_fen, probs_with_no_indices)
-        == changed_squares
-    )
+def test_infer_chess_pieces():
+    """Test `infer_chess_pieces()` against the reference inference.
 
-    move = (4, 2, "black_castles_queenside")
-    assert (
-        _detect_move(previous_fen, probs_with_no_indices, changed_squares)
-        == move
+    The inferred pieces must be balanced and at least as likely as the
+    pieces of the greedy reference inference (whenever it succeeds).
+    """
+    rng = np.random.default_rng(0)
+    fen = "r1bqkb1r/ppp2ppp/2n2n2/1N1pp3/3P1B2/8/PPP1PPPP/R2QKBNR"
+    probs = generate_probs_with_no_indices_from_fen(fen)
+    assert list_to_board(infer_chess_pieces(probs, "BL")) == fen_to_board(fen)
+
+    for i in range(40):
+        if i % 2 == 0:
+            # Noisy probabilities of an actual board position
+            probs = np.float32(generate_probs_with_no_indices_from_fen(fen))
+            probs += rng.random((64, 13), dtype=np.float32) * 0.4
+        else:
+            # Random probabilities with many ties
+            probs = np.float32(rng.integers(1, 4, (64, 13)))
+        probs /= np.sum(probs, axis=1, keepdims=True)
+        a1_pos = ("BL", "BR", "TL", "TR")[i % 4]
+
+        pieces = infer_chess_pieces(probs, a1_pos)
+        assert infer_chess_pieces(list(probs), a1_pos) == pieces
+
+        expected, failed = reference_infer_chess_pieces(list(probs), a1_pos)
+        if not failed:
+            rotated_probs = board_to_list(list_to_board(list(probs), a1_pos))
+            assert is_balanced_board(pieces)
+            assert log_likelihood(rotated_probs, pieces) >= (
+                log_likelihood(rotated_probs, expected) - 1e-3
+            )
+
+
+def test_infer_chess_pieces_batch():
+    """Test `infer_chess_pieces_batch()` with `infer_chess_pieces()`."""
+    rng = np.random.default_rng(0)
+    previous_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
+    fen = "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR"
+    probs_batch = np.float32(
+        [generate_probs_with_no_indices_from_fen(fen)] * 12
     )
+    probs_batch += rng.random(probs_batch.shape, dtype=np.float32) * 0.6
+    probs_batch[::3] = rng.integers(1, 4, probs_batch[::3].shape)
+    probs_batch /= np.sum(probs_batch, axis=2, keepdims=True)
+    previous_fens = [previous_fen if i % 2 else None for i in range(12)]
+
+    for a1_pos in ("BL", "BR", "TL", "TR"):
+        assert infer_chess_pieces_batch(
+            probs_batch, a1_pos, previous_fens
+        ) == [
+            infer_chess_pieces(probs, a1_pos, previous_fen)
+            for probs, previous_fen in zip(probs_batch, previous_fens)
+        ]
+
+
+def test_detect_legal_move():
+    """Test `_detect_legal_move()`."""
+    cases = [
+        # White pawn move
+        (
+            "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR",
+            "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR",
+            "d2d4",
+        ),
+        # Black knight move
+        (
+            "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR",
+            "rnbqkb1r/pppppppp/5n2/8/3P4/8/PPP1PPPP/RNBQKBNR",
+            "g8f6",
+        ),
+        # White pawn capture
+        (
+            "r1bqkb1r/ppp2ppp/2n2n2/1N1pp3/3P1B2/8/PPP1PPPP/R2QKBNR",
+            "r1bqkb1r/ppp2ppp/2n2n2/1N1pP3/5B2/8/PPP1PPPP/R2QKBNR",
+            "d4e5",
+        ),
+        # Black knight capture
+        (
+            "r1bqkb1r/ppp2ppp/2n5/1N1pP2n/5B2/4P3/PPP2PPP/R2QKBNR",
+            "r1bqkb1r/ppp2ppp/2n5/1N1pP3/5n2/4P3/PPP2PPP/R2QKBNR",
+            "h5f4",
+        ),
+        # White (kingside) castling
+        (
+            "r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R",
+            "r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQ1RK1",
+            "e1g1",
+        ),
+        # Black kingside and queenside castling
+        (
+            "r1bqk2r/ppn2ppp/2p1pn2/3p4/1b1P1B2/2NBPN2/PPP2PPP/R2QK2R",
+            "r1bq1rk1/ppn2ppp/2p1pn2/3p4/1b1P1B2/2NBPN2/PPP2PPP/R2QK2R",
+            "e8g8",
+        ),
+        (
+            "r3kbnr/pppqpppp/2n5/3p1b2/3P1B2/2N5/PPPQPPPP/R3KBNR",
+            "2kr1bnr/pppqpppp/2n5/3p1b2/3P1B2/2N5/PPPQPPPP/R3KBNR",
+            "e8c8",
+        ),
+        # White queenside castling
+        (
+            "rnbq1rk1/ppp1ppbp/3p1np1/8/3PPB2/2N5/PPPQ1PPP/R3KBNR",
+            "rnbq1rk1/ppp1ppbp/3p1np1/8/3PPB2/2N5/PPPQ1PPP/2KR1BNR",
+            "e1c1",
+        ),
+        # White and black en passant captures
+        (
+            "rnbqkbnr/ppp2ppp/3p4/3Pp3/8/8/PPP1PPPP/RNBQKBNR",
+            "rnbqkbnr/ppp2ppp/3pP3/8/8/8/PPP1PPPP/RNBQKBNR",
+            "d5e6",
+        ),
+        (
+            "rnbqkbnr/ppp1pppp/8/8/3pP3/3P1N2/PPP2PPP/RNBQKB1R",
+            "rnbqkbnr/ppp1pppp/8/8/8/3PpN2/PPP2PPP/RNBQKB1R",
+            "d4e3",
+        ),
+        # Black promotion (with capture) to a knight
+        (
+            "4k3/8/8/8/8/8/p7/1R2K3",
+            "4k3/8/8/8/8/8/8/1n2K3",
+            "a2b1n",
+        ),
+        # No move
+        (
+            "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR",
+            "rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR",
+            None,
+        ),
+    ]
+    for previous_fen, current_fen, move in cases:
+        probs = np.float32(
+            generate_probs_with_no_indices_from_fen(current_fen)
+        )
+        position = _detect_legal_move(previous_fen, probs)
+        assert position.board_fen() == current_fen
+        assert [m.uci() for m in position.move_stack] == (
+            [move] if move else []
+        )
+
+    # The move is still detected if a square is misclassified
+    previous_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
+    current_fen = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR"
+    probs = np.float32(generate_probs_with_no_indices_from_fen(current_fen))
+    probs[1] = 0
+    probs[1, _PIECE_TO_IDX_FULL["b"]] = 0.6
+    probs[1, _PIECE_TO_IDX_FULL["n"]] = 0.4
+    assert _detect_legal_move(previous_fen, probs).board_fen() == current_fen
+
+    # No move is detected if no legal move leads to the position
+    current_fen = "rnbqkbnr/pppppppp/8/8/3PP3/8/PPP2PPP/RNBQKBNR"
+    probs = np.float32(generate_probs_with_no_indices_from_fen(current_fen))
+    assert _detect_legal_move(previous_fen, probs) is None
+
+    # The candidate positions of a repeated previous FEN are reused
+    hits = _previous_fen_placements.cache_info().hits
+    assert _detect_legal_move(previous_fen, probs) is None
+    assert _previous_fen_placements.cache_info().hits == hits + 1
+
+
+def test_detect_legal_move_plies():
+    """Test `_detect_legal_move()` with several plies since the FEN."""
+    previous_fen = "r1bqkb1r/ppp2ppp/2n2n2/1N1pp3/3P1B2/8/PPP1PPPP/R2QKBNR"
+    cases = [
+        (
+            "r1bqkb1r/ppp2ppp/2n5/1N1pP2n/5B2/8/PPP1PPPP/R2QKBNR",
+            ["d4e5", "f6h5"],
+        ),
+        (
+            "r1bqkb1r/ppp2ppp/2n5/1N1pP2n/5B2/4P3/PPP2PPP/R2QKBNR",
+            ["d4e5", "f6h5", "e2e3"],
+        ),
+        (
+            "r1bqkb1r/ppp2ppp/2n5/1N1pP3/5n2/4P3/PPP2PPP/R2QKBNR",
+            ["d4e5", "e2e3", "f6h5", "h5f4"],
+        ),
+    ]
+    for current_fen, moves in cases:
+        probs = np.float32(
+            generate_probs_with_no_indices_from_fen(current_fen)
+        )
+        assert _detect_legal_move(previous_fen, probs, len(moves) - 1) is None
+
+        position = _detect_legal_move(previous_fen, probs, 4)
+        assert position.board_fen() == current_fen
+        assert len(position.move_stack) == len(moves)
+        assert sorted(m.uci() for m in position.move_stack) == sorted(moves)
+
+
+def test_temporal_decoder():
+    """Test `TemporalDecoder` with a sequence of noisy frames."""
+    rng = np.random.default_rng(0)
+    board = chess.Board()
+    fens = [board.board_fen()]
+    for move in ("e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6", "e1g1"):
+        board.push_uci(move)
+        fens.append(board.board_fen())
+
+    def frame(fen):
+        probs = np.float32(generate_probs_with_no_indices_from_fen(fen))
+        probs += rng.random((64, 13), dtype=np.float32) * 0.1
+        return probs / np.sum(probs, axis=1, keepdims=True)
+
+    decoder = TemporalDecoder(fens[0])
+    moves = []
+    # A frame with a hand over the board (after the third frame) and
+    # dropped frames (the fourth and the seventh positions)
+    for i in (0, 1, -1, 1, 2, 4, 5, 7):
+        if i == -1:
+            probs = frame(fens[1])
+            probs[20:44] = frame("8/8/8/8/8/8/8/8")[20:44]
+            assert decoder.update(probs, "BL") == []
+            continue
+
+        # The moves are committed once they are stable
+        for _ in range(3):
+            committed_moves = decoder.update(frame(fens[i]), "BL")
+            assert committed_moves is not None
+            moves += [move.uci() for move in committed_moves]
+        assert decoder.get_fen() == fens[i]
+    assert moves == [move.uci() for move in board.move_stack]
+
+    # The decoding starts over if the frames show another game
+    fen = "r1bqkb1r/PPPPPPPP/8/8/8/8/pppppppp/RNBQK2R"
+    for _ in range(decoder.max_doubtful_frames):
+        assert decoder.update(frame(fen), "BL") is not None
+    assert decoder.update(frame(fen), "BL") is None
+    assert decoder.get_fen() == fen
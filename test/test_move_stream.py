@@ -0,0 +1,134 @@
+"""This module is responsible for testing "move_stream.py" module.
+
+Specifically, it tests that the `MoveStream` class in the module prints
+the moves of each game and appends the games to a PGN file that
+python-chess reads back, in batches of `FLUSH_MOVES` moves and with the
+result of each game, and that the moves are written in SAN notation
+after promotions and castlings.
+"""
+
+
+import io
+import re
+
+import chess
+import chess.pgn
+
+from lc2fen.move_stream import FLUSH_MOVES, MoveStream
+
+
+# Position after 1. e4 e5 2. Nf3 Nc6 3. Bc4
+FEN = "r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R"
+
+# PGN headers of the games (with an unknown date)
+HEADERS = (
+    '[Event "?"]\n[Site "?"]\n[Date "?"]\n[Round "?"]\n[White "?"]\n'
+    '[Black "?"]\n[Result "*"]\n'
+)
+
+
+def read_pgn(pgn_path: str) -> str:
+    """Read a PGN file replacing the dates of the games with "?"."""
+    with open(pgn_path) as pgn_file:
+        return re.sub(r'\[Date "[0-9.]+"\]', '[Date "?"]', pgn_file.read())
+
+
+def test_move_stream(tmp_path, capsys):
+    """Test `MoveStream`."""
+    pgn_path = str(tmp_path / "games.pgn")
+    move_stream = MoveStream(pgn_path, flush_moves=4)
+
+    move_stream.start(chess.STARTING_BOARD_FEN)
+    move_stream.push([chess.Move.from_uci("e2e4")])
+    move_stream.push([chess.Move.from_uci(m) for m in ("e7e5", "g1f3")])
+    assert not (tmp_path / "games.pgn").exists()  # The flush is batched
+    move_stream.push([chess.Move.from_uci(m) for m in ("b8c6", "f1c4")])
+
+    # The second game starts with a black move
+    move_stream.start(FEN)
+    move_stream.push([chess.Move.from_uci(m) for m in ("g8f6", "e1g1")])
+    move_stream.end()
+
+    assert capsys.readouterr().out.split("\n") == [
+        chess.STARTING_BOARD_FEN,
+        "e2e4 e4",
+        "e7e5 e5",
+        "g1f3 Nf3",
+        "b8c6 Nc6",
+        "f1c4 Bc4",
+        FEN,
+        "g8f6 Nf6",
+        "e1g1 O-O",
+        "",
+    ]
+
+    with open(pgn_path) as pgn_file:
+        pgn = io.StringIO(pgn_file.read())
+    game = chess.pgn.read_game(pgn)
+    assert game.headers["Result"] == "*"
+    assert "FEN" not in game.headers
+    assert [move.uci() for move in game.mainline_moves()] == [
+        "e2e4",
+        "e7e5",
+        "g1f3",
+        "b8c6",
+        "f1c4",
+    ]
+    assert game.end().board().board_fen() == FEN
+
+    game = chess.pgn.read_game(pgn)
+    assert game.headers["FEN"] == FEN + " b KQkq - 0 1"
+    assert not game.errors
+    assert [move.uci() for move in game.mainline_moves()] == ["g8f6", "e1g1"]
+    assert chess.pgn.read_game(pgn) is None
+
+
+def test_move_stream_flush(tmp_path):
+    """Test the batched flush and the end of a game of `MoveStream`."""
+    pgn_path = str(tmp_path / "games.pgn")
+    move_stream = MoveStream(pgn_path)
+    assert move_stream.flush_moves == FLUSH_MOVES == 8
+
+    moves = "e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 d2d3 f8c5".split()
+    move_stream.start(chess.STARTING_BOARD_FEN)
+    move_stream.push([chess.Move.from_uci(m) for m in moves[:7]])
+    assert not (tmp_path / "games.pgn").exists()
+
+    move_stream.push([chess.Move.from_uci(moves[7])])
+    game = "\n1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 4. d3 Bc5\n"
+    assert read_pgn(pgn_path) == HEADERS + game
+
+    # The result is appended when the game ends
+    move_stream.end()
+    assert read_pgn(pgn_path) == HEADERS + game + "*\n\n"
+    move_stream.end()  # No game has started
+    assert read_pgn(pgn_path) == HEADERS + game + "*\n\n"
+
+    game = chess.pgn.read_game(io.StringIO(read_pgn(pgn_path)))
+    assert not game.errors
+    assert game.headers["Result"] == "*"
+    assert [move.uci() for move in game.mainline_moves()] == moves
+
+
+def test_move_stream_san(tmp_path, capsys):
+    """Test the SAN notation of `MoveStream` after special moves."""
+    pgn_path = str(tmp_path / "games.pgn")
+    move_stream = MoveStream(pgn_path)
+
+    fen = "3bk2r/1P6/8/8/8/8/8/R3K3"
+    moves = "b7b8q e8g8 e1c1 f8f1 d1f1".split()
+    move_stream.start(fen)
+    move_stream.push([chess.Move.from_uci(m) for m in moves])
+    move_stream.end()
+
+    sans = ["b8=Q", "O-O", "O-O-O", "Rf1", "Rxf1"]
+    assert capsys.readouterr().out.split("\n") == [
+        fen,
+        *(f"{move} {san}" for move, san in zip(moves, sans)),
+        "",
+    ]
+    assert read_pgn(pgn_path) == (
+        HEADERS
+        + f'[FEN "{fen} w Qk - 0 1"]\n[SetUp "1"]\n'
+        + "\n1. b8=Q O-O 2. O-O-O Rf1 3. Rxf1 *\n\n"
+    )